@@ -3,7 +3,7 @@ from django.contrib import admin
 # Register your models here.
 from .models import Tag, SearchHistory, ExternalMedia, Notification, \
                     ProfileVote, ProfileTagging, ProfileComment, \
-                    Friendship
+                    Friendship, Task
 
 # Registering tables into admin/
 admin.site.register(Tag)
@@ -14,3 +14,4 @@ admin.site.register(ProfileVote)
 admin.site.register(ProfileTagging)
 admin.site.register(ProfileComment)
 admin.site.register(Friendship)
+admin.site.register(Task)
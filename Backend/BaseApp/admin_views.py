@@ -0,0 +1,260 @@
+"""
+Admin API views: profile and comment lists with keyset pagination, and
+deleting and importing in bulk. Only staff may use them, except
+check_superuser.
+"""
+import io
+from itertools import islice
+
+# pylint: disable=C0412
+from rest_framework import generics, views, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
+from django_filters.rest_framework import DjangoFilterBackend
+from django_filters import FilterSet, CharFilter, IsoDateTimeFilter
+# pylint: enable=C0412
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError, ObjectDoesNotExist, \
+    PermissionDenied
+from django.db.utils import DatabaseError
+from .authentication import CachedJWTAuthentication, invalidate_user
+from .deletion import BatchedDeleter, delete_user, meta
+from .importer import ProfileImporter, detect_format, read_rows
+from .models import Profile, ProfileComment
+from .pagination import KeysetPagination
+from .serializer import AdminProfileCommentSerializer, AdminProfileSerializer
+from .task_queue import queue_settings
+from .tasks import queue_directory_refresh, queue_user_deletion
+
+
+# Keyset pagination with an estimated count for the admin lists
+class AdminProfilePagination(KeysetPagination):
+   ordering = ('user__username',)
+
+
+class AdminCommentPagination(KeysetPagination):
+   ordering = ('-created_at', '-id')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def check_superuser(request):
+   """Check if the current user is a superuser"""
+   is_superuser = request.user.is_superuser
+   return Response({'is_superuser': is_superuser})
+
+
+class AdminProfileListView(generics.ListAPIView):
+   """List all profiles for admin purposes"""
+   serializer_class = AdminProfileSerializer
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+   # Add pagination
+   pagination_class = AdminProfilePagination
+
+   def get_queryset(self):
+      return Profile.objects.select_related('user').prefetch_related(
+         'tags').order_by('user__username').all()
+
+
+class AdminProfileDeleteView(generics.DestroyAPIView):
+   """
+   Delete a profile and all related data in bounded batches. The user is
+   deactivated first. With ?async=true, where a task worker is deployed,
+   the data is deleted by the worker and the response is 202.
+   """
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+
+   def destroy(self, request, *args, **kwargs):
+      user_id = kwargs.get('pk')
+      batch_size = getattr(settings, 'PROFILE_DELETE_BATCH_SIZE', 900)
+      try:
+         # Without a worker a queued deletion would run in this request
+         # anyway
+         if request.query_params.get('async') == 'true' and \
+               queue_settings()['WORKER']:
+            # Locks the account out while the deletion waits in the queue
+            if not User.objects.filter(id=user_id).update(is_active=False):
+               raise ObjectDoesNotExist
+            invalidate_user(user_id)
+            queue_user_deletion(user_id, batch_size)
+            return Response({'user_id': user_id, 'status': 'queued'},
+                            status=status.HTTP_202_ACCEPTED)
+
+         if delete_user(user_id, batch_size=batch_size) is None:
+            raise ObjectDoesNotExist
+         # Their votes and comments are gone from other profiles too
+         queue_directory_refresh(full=True)
+         return Response(status=status.HTTP_204_NO_CONTENT)
+      except ObjectDoesNotExist:
+         return Response(
+             {'error': 'User not found'},
+             status=status.HTTP_404_NOT_FOUND
+         )
+      except (ValidationError, PermissionDenied) as e:
+         return Response(
+             {'error': str(e)},
+             status=status.HTTP_400_BAD_REQUEST
+         )
+      except DatabaseError as e:
+         return Response(
+             {'error': f'Database error: {str(e)}'},
+             status=status.HTTP_500_INTERNAL_SERVER_ERROR
+         )
+
+
+class AdminProfileImportView(views.APIView):
+   """Bulk-create profiles from an uploaded CSV or NDJSON file"""
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+   parser_classes = [MultiPartParser]
+
+   def post(self, request):
+      upload = request.FILES.get('file')
+      if not upload:
+         return Response({'error': 'A file is required'},
+                         status=status.HTTP_400_BAD_REQUEST)
+
+      fmt = request.data.get('format') or detect_format(upload.name)
+      if fmt not in ('csv', 'ndjson'):
+         return Response({'error': 'format must be csv or ndjson'},
+                         status=status.HTTP_400_BAD_REQUEST)
+
+      # Larger files should go through `manage.py import_profiles`
+      max_rows = getattr(settings, 'PROFILE_IMPORT_MAX_ROWS', 5000)
+      rows = read_rows(
+         io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), fmt)
+      try:
+         # Hashes in this process; a pool per request would starve the
+         # other workers
+         with ProfileImporter(error_limit=100) as importer:
+            result = importer.run(islice(rows, max_rows))
+      except (UnicodeDecodeError, DatabaseError) as e:
+         return Response({'error': f'Import failed: {str(e)}'},
+                         status=status.HTTP_400_BAD_REQUEST)
+
+      data = result.as_dict()
+      data['truncated'] = next(rows, None) is not None
+      return Response(data, status=status.HTTP_200_OK)
+
+
+class AdminCommentFilter(FilterSet):
+   commenter_username = CharFilter(field_name='commenter__username')
+   created_after = IsoDateTimeFilter(field_name='created_at',
+                                     lookup_expr='gte')
+   created_before = IsoDateTimeFilter(field_name='created_at',
+                                      lookup_expr='lt')
+   # Not indexed; narrow by the other filters on large tables
+   text = CharFilter(field_name='comment', lookup_expr='icontains')
+
+   class Meta:
+      model = ProfileComment
+      fields = ['commenter', 'profile']
+
+
+class AdminCommentListView(generics.ListAPIView):
+   """List all comments for admin purposes"""
+   serializer_class = AdminProfileCommentSerializer
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+   filter_backends = [DjangoFilterBackend]
+   filterset_class = AdminCommentFilter
+   # Add pagination
+   pagination_class = AdminCommentPagination
+
+   def get_queryset(self):
+      return ProfileComment.objects.select_related(
+          'commenter', 'profile', 'profile__user'
+      ).order_by('-created_at', '-id').all()
+
+
+class AdminCommentDeleteView(generics.DestroyAPIView):
+   """Delete a specific comment"""
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+   queryset = ProfileComment.objects.all()
+
+   def destroy(self, request, *args, **kwargs):
+      try:
+         comment = self.get_object()
+         comment.delete()
+         return Response(status=status.HTTP_204_NO_CONTENT)
+      except ObjectDoesNotExist:
+         return Response(
+             {'error': 'Comment not found'},
+             status=status.HTTP_404_NOT_FOUND
+         )
+      except (ValidationError, PermissionDenied) as e:
+         return Response(
+             {'error': str(e)},
+             status=status.HTTP_400_BAD_REQUEST
+         )
+      except DatabaseError as e:
+         return Response(
+             {'error': f'Database error: {str(e)}'},
+             status=status.HTTP_500_INTERNAL_SERVER_ERROR
+         )
+
+
+class AdminCommentBulkDeleteView(views.APIView):
+   """
+   Delete many comments at once, chosen by "ids" or by "filter" (the admin
+   comment list filters), in batched DELETEs. Returns how many were
+   removed.
+   """
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated, IsAdminUser]
+
+   def post(self, request):
+      ids = request.data.get('ids')
+      criteria = request.data.get('filter')
+      if (ids is None) == (criteria is None):
+         return Response({'error': 'Send either "ids" or "filter"'},
+                         status=status.HTTP_400_BAD_REQUEST)
+
+      if ids is not None:
+         if not isinstance(ids, list) or \
+               not all(isinstance(i, int) for i in ids):
+            return Response({'error': '"ids" must be a list of integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+         queryset = ProfileComment.objects.filter(id__in=ids)
+      else:
+         names = AdminCommentFilter.base_filters  # pylint: disable=no-member
+         if isinstance(criteria, dict):
+            criteria = {name: value.strip() if isinstance(value, str)
+                        else value for name, value in criteria.items()}
+         if not isinstance(criteria, dict) or \
+               not any(criteria.get(name) for name in names):
+            # An empty filter would match every comment, and so would
+            # a blank one
+            return Response({'error': '"filter" needs at least one of: ' +
+                             ', '.join(names)},
+                            status=status.HTTP_400_BAD_REQUEST)
+         filterset = AdminCommentFilter(
+            data=criteria, queryset=ProfileComment.objects.all())
+         if not filterset.is_valid():
+            return Response(filterset.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+         queryset = filterset.qs
+
+      try:
+         deleter = BatchedDeleter(
+            getattr(settings, 'COMMENT_DELETE_BATCH_SIZE', 900))
+         deleter.delete(queryset.order_by())
+      except DatabaseError as e:
+         return Response(
+             {'error': f'Database error: {str(e)}'},
+             status=status.HTTP_500_INTERNAL_SERVER_ERROR
+         )
+      report = deleter.report
+      if report.deleted:
+         queue_directory_refresh(full=True)
+      return Response({
+         'deleted': report.deleted.get(meta(ProfileComment).label, 0),
+         'batches': report.batches,
+      }, status=status.HTTP_200_OK)
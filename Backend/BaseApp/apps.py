@@ -3,3 +3,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
    default_auto_field = 'django.db.models.BigAutoField'
    name = 'BaseApp'
+
+   def ready(self):
+      # Connect model signal handlers
+      # pylint: disable=import-outside-toplevel,unused-import
+      from . import signals
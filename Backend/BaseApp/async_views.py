@@ -0,0 +1,141 @@
+"""
+Async variants of the read-heavy endpoints for deployments that serve
+saltnlight.asgi. They run on Django's async ORM so an ASGI worker can keep
+serving other connections while a request waits on the database.
+"""
+import functools
+import math
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .models import Profile, ProfileVote, Friendship
+from .serializer import ProfileSerializer, SearchProfileSerializer
+from .throttling import TokenBucketThrottle, throttle_wait
+from .search_views import DedicatedSearchView, search_queryset
+from .views import match_options, matchmaking_queryset
+
+authenticator = CachedJWTAuthentication()
+throttle = TokenBucketThrottle()
+
+
+def async_jwt_required(view):
+   """Authenticate a GET request with the JWT header before calling view"""
+
+   @functools.wraps(view)
+   async def wrapper(request, *args, **kwargs):
+      if request.method != 'GET':
+         return JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'},
+            status=405)
+      # Sub-requests of a batch arrive already authenticated
+      forced = getattr(request, '_force_auth_user', None)
+      try:
+         result = (forced, None) if forced is not None else \
+            await sync_to_async(authenticator.authenticate)(request)
+      except AuthenticationFailed as e:
+         return JsonResponse({'detail': str(e.detail)}, status=401)
+      if result is None:
+         return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=401)
+      request.user = result[0]
+      wait = throttle_wait(request, request.user, throttle.get_ident(request))
+      if wait:
+         response = JsonResponse(
+            {'detail': 'Request was throttled. Expected available in '
+                       f'{math.ceil(wait)} seconds.'}, status=429)
+         response['Retry-After'] = str(math.ceil(wait))
+         return response
+      return await view(request, *args, **kwargs)
+
+   return wrapper
+
+
+async def serialize(serializer_class, instance, request, many=False):
+   # Serializer method fields may query, so render on the sync side
+   def render():
+      return serializer_class(instance, many=many,
+                              context={'request': request}).data
+   return await sync_to_async(render)()
+
+
+@async_jwt_required
+async def async_dedicated_search(request):
+   try:
+      queryset = await sync_to_async(search_queryset)(request.GET)
+   except ValueError as e:
+      return JsonResponse({'detail': str(e)}, status=400)
+   # Paged as DedicatedSearchView pages, i.e. once PAGE_SIZE is set
+   paginator = DedicatedSearchView.pagination_class()
+   try:
+      page = await sync_to_async(paginator.paginate_queryset)(
+         queryset, Request(request))
+   except NotFound as e:
+      return JsonResponse({'detail': str(e.detail)}, status=404)
+   if page is None:
+      profiles = [profile async for profile in queryset]
+      data = await serialize(SearchProfileSerializer, profiles, request,
+                             many=True)
+      return JsonResponse(data, safe=False)
+   data = await serialize(SearchProfileSerializer, page, request, many=True)
+   return JsonResponse(paginator.get_paginated_response(data).data)
+
+
+@async_jwt_required
+async def async_matchmaking_results(request):
+   try:
+      weights, limit = match_options(request.GET)
+   except ValueError as e:
+      return JsonResponse({'detail': str(e)}, status=400)
+   queryset = ProfileSerializer.setup_queryset(
+      await sync_to_async(matchmaking_queryset)(request.user, weights, limit),
+      request.user)
+   profiles = [profile async for profile in queryset]
+   data = await serialize(ProfileSerializer, profiles, request, many=True)
+   return JsonResponse(data, safe=False)
+
+
+@async_jwt_required
+async def async_current_user(request):
+   profile = await ProfileSerializer.setup_queryset(
+      Profile.objects.filter(user=request.user)).afirst()
+
+   if profile is None:
+      return JsonResponse({"error": "Profile not found"}, status=404)
+   data = await serialize(ProfileSerializer, profile, None)
+   return JsonResponse(data)
+
+
+@async_jwt_required
+async def async_profile_overview(request, pk):
+   """Profile, the viewer's vote and the friendship state in one call"""
+   # One after the other: the async ORM runs every query on the same
+   # thread, so gathering them would not overlap them
+   profile = await ProfileSerializer.setup_queryset(
+      Profile.objects.filter(pk=pk), request.user).afirst()
+   if profile is None:
+      return JsonResponse({"error": "Profile not found"}, status=404)
+
+   vote = await ProfileVote.objects.filter(voter=request.user,
+                                           profile_id=pk).afirst()
+   friendship = await Friendship.between(request.user.id, pk).afirst()
+
+   friendship_data = {'status': None}
+   if friendship:
+      friendship_data = {
+         'status': friendship.status,
+         'friendship_id': friendship.id,
+         'is_sender': friendship.sender_id == request.user.id,
+      }
+   return JsonResponse({
+      'profile': await serialize(ProfileSerializer, profile, request),
+      'vote_status': {
+         'has_voted': vote is not None,
+         'is_upvote': vote.is_upvote if vote else None,
+      },
+      'friendship': friendship_data,
+   })
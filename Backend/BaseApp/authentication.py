@@ -0,0 +1,160 @@
+import copy
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, \
+    InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .caching import TTLCache
+from .models import Profile
+
+DEFAULT_TOKEN_USER_CACHE = {
+   'TTL': 60,
+   'MAX_SIZE': 10000,
+   # Build request.user from signed token claims without touching the DB
+   'TRUST_CLAIMS': False,
+}
+
+# Claims copied into tokens at issue time, see ProfileTokenObtainPairSerializer
+CLAIM_FIELDS = ('username', 'is_staff', 'is_superuser')
+# Only trusted while false; tokens claiming more are checked against the DB
+PRIVILEGE_CLAIMS = ('is_staff', 'is_superuser')
+
+
+def _cache_setting(name):
+   configured = getattr(settings, 'TOKEN_USER_CACHE', {})
+   return configured.get(name, DEFAULT_TOKEN_USER_CACHE[name])
+
+
+user_cache = TTLCache(max_size=_cache_setting('MAX_SIZE'),
+                      ttl=_cache_setting('TTL'))
+
+
+def changed_key(user_id):
+   return f'token-user:{user_id}'
+
+
+def mark_changed(user_id):
+   cache.set(changed_key(user_id), time.time(), timeout=None)
+
+
+def invalidate_user(user_id):
+   """
+   Drop a changed user from every worker's cache. The time of the change
+   goes in the shared cache, and users loaded or tokens issued before it
+   are checked against the database again.
+   """
+   user_cache.pop(user_id)
+   mark_changed(user_id)
+   # Again once committed, or a worker could reload the old row meanwhile
+   transaction.on_commit(lambda: mark_changed(user_id))
+
+
+def attach_profile(user, profile_id, user_type):
+   # Views read these instead of querying Profile again
+   user.profile_id = profile_id
+   user.user_type = user_type
+   return user
+
+
+def get_profile_info(user):
+   """
+   (profile_id, user_type) for an authenticated user, read from the
+   attributes CachedJWTAuthentication sets and queried otherwise.
+   """
+   if not hasattr(user, 'profile_id'):
+      profile = Profile.objects.filter(user_id=user.pk).values(
+         'user_type').first()
+      attach_profile(user, user.pk if profile else None,
+                     profile['user_type'] if profile else None)
+   return user.profile_id, user.user_type
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+   """
+   JWTAuthentication that keeps recently seen users, with their profile id
+   and user_type, in a bounded per-process TTL cache keyed by token user id.
+   Entries are dropped once invalidate_user() was called for their user,
+   by any worker.
+   """
+
+   def get_user(self, validated_token):
+      try:
+         user_id = validated_token[api_settings.USER_ID_CLAIM]
+      except KeyError as e:
+         raise InvalidToken(
+            _("Token contained no recognizable user identification")) from e
+
+      changed_at = cache.get(changed_key(user_id))
+      if _cache_setting('TRUST_CLAIMS') and 'user_type' in validated_token \
+            and self.claims_are_current(validated_token, changed_at):
+         return self.user_from_claims(user_id, validated_token)
+
+      cached = user_cache.get(user_id)
+      if cached is None or changed_at is None or changed_at >= cached[0]:
+         loaded_at = time.time()
+         user = super().get_user(validated_token)
+         get_profile_info(user)
+         user_cache.set(user_id, (loaded_at, user))
+         if changed_at is None:
+            # Not marked yet, or evicted: whatever was cached before now
+            # may be out of date
+            cache.add(changed_key(user_id), loaded_at, timeout=None)
+         return copy.copy(user)
+
+      cached = cached[1]
+
+      # Repeat the checks JWTAuthentication makes against the loaded row
+      if api_settings.CHECK_USER_IS_ACTIVE and not cached.is_active:
+         raise AuthenticationFailed(_("User is inactive"),
+                                    code="user_inactive")
+      if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+         api_settings.REVOKE_TOKEN_CLAIM
+      ) != get_md5_hash_password(cached.password):
+         raise AuthenticationFailed(
+            _("The user's password has been changed."),
+            code="password_changed")
+      return copy.copy(cached)
+
+   @staticmethod
+   def claims_are_current(validated_token, changed_at):
+      # Issued after the user last changed, and granting no privileges
+      issued_at = validated_token.get('iat')
+      return changed_at is not None and issued_at is not None and \
+         changed_at < issued_at and \
+         not any(validated_token.get(field) for field in PRIVILEGE_CLAIMS)
+
+   def user_from_claims(self, user_id, validated_token):
+      meta = User._meta  # pylint: disable=no-member,protected-access
+      user = User(id=user_id, is_active=True, **{
+         field: validated_token.get(field,
+                                    meta.get_field(field).get_default())
+         for field in CLAIM_FIELDS
+      })
+      user._state.adding = False  # pylint: disable=protected-access
+      return attach_profile(user, validated_token.get('profile_id'),
+                            validated_token.get('user_type'))
+
+
+# Only validates; create() and update() are never called
+class ProfileTokenObtainPairSerializer(TokenObtainPairSerializer):  # pylint: disable=abstract-method
+   """Adds the claims CachedJWTAuthentication can trust to issued tokens"""
+
+   @classmethod
+   def get_token(cls, user):
+      token = super().get_token(user)
+      for field in CLAIM_FIELDS:
+         token[field] = getattr(user, field)
+      profile = Profile.objects.filter(user=user).values(
+         'user_type').first()
+      token['profile_id'] = user.pk if profile else None
+      token['user_type'] = profile['user_type'] if profile else None
+      return token
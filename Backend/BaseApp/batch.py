@@ -0,0 +1,187 @@
+"""
+POST /api/batch/ runs several GET requests in one round trip:
+
+   {"requests": ["/api/profiles/me/", {"path": "/tag/?page=2"}]}
+
+returns {"responses": [{"path": ..., "status": ..., "body": ...}, ...]} in
+the same order. The JWT is checked once for the whole batch; each
+sub-request is resolved and dispatched in process, as the same user,
+without going through the middleware again.
+
+Async views run concurrently on the event loop - under ASGI that is the
+point of the endpoint - while sync views take turns on the request's
+thread, keeping them on its database connection. A batch holds at most
+BATCH_REQUESTS['MAX_REQUESTS'] sub-requests, identical ones run once, and
+batches can't be nested, so one call costs at most that many requests.
+"""
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.exception import response_for_exception
+from django.http import HttpRequest, JsonResponse, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+
+DEFAULT_BATCH_REQUESTS = {
+   'MAX_REQUESTS': 20,
+   # Async sub-requests in flight at once
+   'MAX_CONCURRENCY': 8,
+   'MAX_PATH_LENGTH': 2000,
+   # Paths that can't be batched
+   'EXCLUDED_PREFIXES': ['/admin/', '/metrics'],
+}
+
+# Parent request headers a sub-request doesn't inherit
+DROPPED_META = ('HTTP_AUTHORIZATION', 'CONTENT_TYPE', 'HTTP_CONTENT_TYPE',
+                'HTTP_CONTENT_LENGTH')
+
+authenticator = CachedJWTAuthentication()
+
+
+def batch_settings():
+   return {**DEFAULT_BATCH_REQUESTS,
+           **getattr(settings, 'BATCH_REQUESTS', {})}
+
+
+# The attributes are the ones HttpRequest's handler would set
+class SubRequest(HttpRequest):  # pylint: disable=too-many-instance-attributes
+   """A GET for one path, made as the batch request's user"""
+
+   def __init__(self, parent, path, query, auth):
+      super().__init__()
+      user, token = auth
+      self.parent = parent
+      self.method = 'GET'
+      self.path = self.path_info = path
+      self.META = {key: value for key, value in parent.META.items()
+                   if key not in DROPPED_META}
+      self.META.update(REQUEST_METHOD='GET', PATH_INFO=path,
+                       QUERY_STRING=query, CONTENT_LENGTH='0')
+      self.GET = QueryDict(query)
+      self.COOKIES = parent.COOKIES
+      self.user = user or AnonymousUser()
+      # DRF's Request uses these instead of authenticating again
+      self._force_auth_user = user
+      self._force_auth_token = token
+
+   def _get_scheme(self):
+      return self.parent.scheme
+
+
+def parse_item(item, config):
+   """(path, query) for one entry of "requests"; raises ValueError"""
+   if isinstance(item, dict):
+      if str(item.get('method', 'GET')).upper() != 'GET':
+         raise ValueError('only GET requests can be batched')
+      item = item.get('path')
+   if not isinstance(item, str) or not item.startswith('/'):
+      raise ValueError('path must be a string starting with "/"')
+   if len(item) > config['MAX_PATH_LENGTH']:
+      raise ValueError('path is too long')
+   url = urlsplit(item)
+   if url.scheme or url.netloc or url.path.startswith('//'):
+      raise ValueError('path must be local')
+   if url.path.startswith(tuple(config['EXCLUDED_PREFIXES'])):
+      raise ValueError(f'{url.path} can not be batched')
+   return url.path, url.query
+
+
+def response_body(response):
+   if response.streaming:
+      return None
+   if response.get('Content-Type', '').startswith('application/json'):
+      return json.loads(response.content or b'null')
+   return response.content.decode(response.charset, 'replace')
+
+
+def call_view(request, match):
+   """Run a sync view and render its response, as the handler would"""
+   try:
+      response = match.func(request, *match.args, **match.kwargs)
+      if hasattr(response, 'render') and callable(response.render):
+         response = response.render()
+   except Exception as e:  # pylint: disable=broad-except
+      response = response_for_exception(request, e)
+   return response
+
+
+async def dispatch(request, path, query, auth):
+   label = f'{path}?{query}' if query else path
+   try:
+      match = resolve(path)
+   except Resolver404:
+      return {'path': label, 'status': 404,
+              'body': {'detail': 'Not found.'}}
+   if match.func is batch_view:
+      return {'path': label, 'status': 400,
+              'body': {'detail': 'Batches can not be nested.'}}
+
+   sub = SubRequest(request, path, query, auth)
+   sub.resolver_match = match
+   if asyncio.iscoroutinefunction(match.func):
+      try:
+         response = await match.func(sub, *match.args, **match.kwargs)
+      except Exception as e:  # pylint: disable=broad-except
+         response = await sync_to_async(response_for_exception)(sub, e)
+   else:
+      response = await sync_to_async(call_view)(sub, match)
+
+   return {'path': label, 'status': response.status_code,
+           'body': await sync_to_async(response_body)(response)}
+
+
+def parse_batch(body, config):
+   """[(path, query)] of the batch's sub-requests; raises ValueError"""
+   try:
+      payload = json.loads(body or b'{}')
+   except ValueError as e:
+      raise ValueError('Body must be JSON.') from e
+   items = payload.get('requests') if isinstance(payload, dict) else None
+   if not isinstance(items, list) or not items:
+      raise ValueError('"requests" must be a non-empty list.')
+   if len(items) > config['MAX_REQUESTS']:
+      raise ValueError(
+         f"A batch holds at most {config['MAX_REQUESTS']} requests.")
+   return [parse_item(item, config) for item in items]
+
+
+async def batch_view(request):
+   if request.method != 'POST':
+      return JsonResponse(
+         {'detail': f'Method "{request.method}" not allowed.'}, status=405)
+   config = batch_settings()
+   try:
+      targets = parse_batch(request.body, config)
+   except ValueError as e:
+      return JsonResponse({'detail': str(e)}, status=400)
+
+   try:
+      auth = await sync_to_async(authenticator.authenticate)(request)
+   except AuthenticationFailed as e:
+      return JsonResponse({'detail': str(e.detail)}, status=401)
+
+   semaphore = asyncio.Semaphore(config['MAX_CONCURRENCY'])
+
+   async def run(path, query):
+      async with semaphore:
+         return await dispatch(request, path, query, auth or (None, None))
+
+   # Repeated sub-requests share one run
+   unique = list(dict.fromkeys(targets))
+   results = dict(zip(unique, await asyncio.gather(
+      *(run(path, query) for path, query in unique))))
+   return JsonResponse({'responses': [results[target]
+                                      for target in targets]})
+
+
+# Authenticated by bearer token, not cookies. csrf_exempt() would turn the
+# view into a sync one on Django 4.2
+batch_view.csrf_exempt = True
+# Only reads, so ReplicaRoutingMiddleware may serve it from a replica
+batch_view.read_only = True
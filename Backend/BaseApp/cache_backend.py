@@ -0,0 +1,267 @@
+"""
+A two-tier Django cache backend for the worker processes on a node.
+
+L1 is a bounded in-process LRU (BaseApp/caching.py's TTLCache) holding
+pickled values for at most OPTIONS['L1_TIMEOUT'] seconds, or their own
+timeout if shorter. L2 is a SQLite file in WAL mode at LOCATION (by
+default shared_path('cache.sqlite3'), see BaseApp/caching.py) that all
+workers share, culled to MAX_ENTRIES like Django's database cache; with
+OPTIONS['L2_CACHE'] naming another entry of CACHES, e.g. a RedisCache,
+that cache is the L2 instead.
+
+Workers keep their L1s consistent through a table of version counters in
+a memory-mapped file next to LOCATION. Writing or deleting a key bumps the
+counter of its slot, and an L1 entry is only used while the counter is
+where it was when the entry was filled. Keys are also prefixed with the
+version of their namespace, the part before the first ":", so
+invalidate_namespace("exact-count") drops every exact-count:* key in both
+tiers at once. The counters are per node: with a Redis L2 shared across
+nodes, other nodes' writes show up once L1_TIMEOUT has passed.
+
+stats() counts L1 and L2 hits, misses and evictions of this process; they
+are exported on /metrics.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .caching import TTLCache, map_file, shared_path
+from .throttling import key_hash
+
+VERSION_SLOTS = 65536
+# Slot 0 counts clear()s, which invalidate every L1 entry
+EPOCH = 0
+# Sets between two culls of the L2
+CULL_EVERY = 256
+
+
+class Versions:
+   """Version counters in a file-backed table shared by the processes"""
+
+   def __init__(self, path, slots=VERSION_SLOTS):
+      self.map = map_file(path, slots * 8)
+      self.values = memoryview(self.map).cast('Q')
+      self.slots = slots
+
+   def slot(self, key):
+      # Slot 0 is the epoch
+      return key_hash(key) % (self.slots - 1) + 1
+
+   def get(self, slot):
+      return self.values[slot]
+
+   def stamp(self, slot):
+      return self.values[EPOCH], self.values[slot]
+
+   def bump(self, slot):
+      # A clock rather than a count, as in BaseApp/response_cache.py, so a
+      # lost concurrent update can't bring a counter back to an old value
+      self.values[slot] = max(self.values[slot] + 1, time.time_ns())
+
+
+class SQLiteStore:
+   """The shared tier: (key, pickled value, expiry) rows in a WAL database"""
+
+   def __init__(self, path):
+      self.path = path
+      self.local = threading.local()
+      db = self.connection()
+      db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+                 'value BLOB NOT NULL, expires REAL)')
+      db.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+
+   def connection(self):
+      # One per thread, and none inherited across fork()
+      db = getattr(self.local, 'db', None)
+      if db is None or self.local.pid != os.getpid():
+         db = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                              check_same_thread=False)
+         db.execute('PRAGMA journal_mode=WAL')
+         # Losing the last writes on power loss is fine for a cache
+         db.execute('PRAGMA synchronous=NORMAL')
+         self.local.db, self.local.pid = db, os.getpid()
+      return db
+
+   def get(self, key):
+      return self.connection().execute(
+         'SELECT value, expires FROM cache WHERE key = ? AND '
+         '(expires IS NULL OR expires > ?)', (key, time.time())).fetchone()
+
+   def set(self, key, value, expires):
+      self.connection().execute(
+         'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+         (key, value, expires))
+
+   def add(self, key, value, expires):
+      # Only replaces an expired row
+      return self.connection().execute(
+         'INSERT INTO cache VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE '
+         'SET value = excluded.value, expires = excluded.expires '
+         'WHERE cache.expires <= ?',
+         (key, value, expires, time.time())).rowcount > 0
+
+   def touch(self, key, expires):
+      return self.connection().execute(
+         'UPDATE cache SET expires = ? WHERE key = ? AND '
+         '(expires IS NULL OR expires > ?)',
+         (expires, key, time.time())).rowcount > 0
+
+   def delete(self, key):
+      return self.connection().execute(
+         'DELETE FROM cache WHERE key = ?', (key,)).rowcount > 0
+
+   def clear(self):
+      self.connection().execute('DELETE FROM cache')
+
+   def cull(self, max_entries, cull_frequency):
+      """Drop expired rows, then the soonest to expire over max_entries"""
+      db = self.connection()
+      removed = db.execute('DELETE FROM cache WHERE expires <= ?',
+                           (time.time(),)).rowcount
+      count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+      if count > max_entries:
+         excess = count - max_entries
+         if cull_frequency:
+            excess = max(excess, count // cull_frequency)
+         removed += db.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+            'ORDER BY expires IS NULL, expires LIMIT ?)',
+            (excess,)).rowcount
+      return removed
+
+
+class CacheStore:
+   """Another Django cache, e.g. Redis, as the shared tier"""
+
+   def __init__(self, alias):
+      self.cache = caches[alias]
+
+   @staticmethod
+   def timeout(expires):
+      return None if expires is None else max(expires - time.time(), 0.001)
+
+   def get(self, key):
+      return self.cache.get(key)
+
+   def set(self, key, value, expires):
+      self.cache.set(key, (value, expires), self.timeout(expires))
+
+   def add(self, key, value, expires):
+      return self.cache.add(key, (value, expires), self.timeout(expires))
+
+   def touch(self, key, expires):
+      row = self.cache.get(key)
+      if row is None:
+         return False
+      self.cache.set(key, (row[0], expires), self.timeout(expires))
+      return True
+
+   def delete(self, key):
+      return self.cache.delete(key)
+
+   def clear(self):
+      self.cache.clear()
+
+   def cull(self, _max_entries, _cull_frequency):
+      # Left to the other cache's own eviction
+      return 0
+
+
+class TieredCache(BaseCache):
+   def __init__(self, location, params):
+      super().__init__(params)
+      options = params.get('OPTIONS', {})
+      location = location or shared_path('cache.sqlite3')
+      self.l1 = TTLCache(max_size=options.get('L1_MAX_ENTRIES', 10000),
+                         ttl=options.get('L1_TIMEOUT', 60))
+      self.versions = Versions(f'{location}-versions')
+      alias = options.get('L2_CACHE')
+      self.l2 = CacheStore(alias) if alias else SQLiteStore(location)
+      self.counts = dict.fromkeys(
+         ('l1_hits', 'l2_hits', 'misses', 'l2_evictions'), 0)
+      self.sets = 0
+
+   def stored_key(self, key, version=None):
+      """The key under its namespace's current version"""
+      namespace = str(key).split(':', 1)[0]
+      generation = self.versions.get(self.versions.slot(f'ns:{namespace}'))
+      return f'{generation}:{self.make_and_validate_key(key, version)}'
+
+   def invalidate_namespace(self, namespace):
+      """Drop every key starting with "<namespace>:", in every process"""
+      self.versions.bump(self.versions.slot(f'ns:{namespace}'))
+
+   def remember(self, key, stamp, value, expires):
+      ttl = self.l1.ttl if expires is None else \
+         min(self.l1.ttl, expires - time.time())
+      if ttl > 0:
+         self.l1.set(key, (stamp, value), ttl)
+
+   def get(self, key, default=None, version=None):
+      key = self.stored_key(key, version)
+      stamp = self.versions.stamp(self.versions.slot(key))
+      cached = self.l1.get(key)
+      if cached is not None and cached[0] == stamp:
+         self.counts['l1_hits'] += 1
+         return pickle.loads(cached[1])
+      row = self.l2.get(key)
+      if row is None:
+         self.counts['misses'] += 1
+         return default
+      self.counts['l2_hits'] += 1
+      # Stamped before reading L2, so a write since then invalidates it
+      self.remember(key, stamp, row[0], row[1])
+      return pickle.loads(row[0])
+
+   def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+      key = self.stored_key(key, version)
+      value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+      expires = self.get_backend_timeout(timeout)
+      self.l2.set(key, value, expires)
+      self.written(key, value, expires)
+
+   def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+      key = self.stored_key(key, version)
+      value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+      expires = self.get_backend_timeout(timeout)
+      if not self.l2.add(key, value, expires):
+         return False
+      self.written(key, value, expires)
+      return True
+
+   def written(self, key, value, expires):
+      slot = self.versions.slot(key)
+      self.versions.bump(slot)
+      self.remember(key, self.versions.stamp(slot), value, expires)
+      self.sets += 1
+      if self.sets % CULL_EVERY == 0:
+         self.counts['l2_evictions'] += self.l2.cull(
+            self._max_entries, self._cull_frequency)
+
+   def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+      key = self.stored_key(key, version)
+      self.forget(key)
+      return self.l2.touch(key, self.get_backend_timeout(timeout))
+
+   def delete(self, key, version=None):
+      key = self.stored_key(key, version)
+      self.forget(key)
+      return self.l2.delete(key)
+
+   def forget(self, key):
+      self.l1.pop(key)
+      self.versions.bump(self.versions.slot(key))
+
+   def clear(self):
+      self.l2.clear()
+      self.l1.clear()
+      self.versions.bump(EPOCH)
+
+   def stats(self):
+      return {**self.counts, 'l1_evictions': self.l1.evictions,
+              'l1_entries': len(self.l1)}
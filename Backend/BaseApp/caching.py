@@ -0,0 +1,82 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TTLCache:
+   """Small thread-safe LRU map whose entries expire after `ttl` seconds"""
+
+   def __init__(self, max_size=10000, ttl=60):
+      self.max_size = max_size
+      self.ttl = ttl
+      self._data = OrderedDict()
+      self._lock = threading.Lock()
+      # Entries dropped to stay within max_size
+      self.evictions = 0
+
+   def get(self, key, default=None):
+      with self._lock:
+         entry = self._data.get(key)
+         if entry is None:
+            return default
+         expires, value = entry
+         if expires < time.monotonic():
+            del self._data[key]
+            return default
+         self._data.move_to_end(key)
+         return value
+
+   def set(self, key, value, ttl=None):
+      expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+      with self._lock:
+         self._data[key] = (expires, value)
+         self._data.move_to_end(key)
+         while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+   def pop(self, key):
+      with self._lock:
+         self._data.pop(key, None)
+
+   def clear(self):
+      with self._lock:
+         self._data.clear()
+
+   def __len__(self):
+      return len(self._data)
+
+
+def shared_path(name):
+   """
+   A file the worker processes of this deployment share: `name` after
+   settings.SHARED_MEMORY_PREFIX. The default prefix is in /dev/shm when
+   there is one, to keep the file in RAM, and names the project directory
+   so deployments on the same host don't share files.
+   """
+   prefix = getattr(settings, 'SHARED_MEMORY_PREFIX', None)
+   if not prefix:
+      project = hashlib.blake2b(
+         str(getattr(settings, 'BASE_DIR', os.getcwd())).encode(),
+         digest_size=4).hexdigest()
+      prefix = os.path.join(
+         '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+         f'saltnlight-{project}')
+   return f'{prefix}-{name}'
+
+
+def map_file(path, size):
+   """A writable memory map of the file at `path`, grown to `size` bytes"""
+   fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+   try:
+      if os.fstat(fd).st_size < size:
+         os.ftruncate(fd, size)
+      return mmap.mmap(fd, size)
+   finally:
+      os.close(fd)
@@ -0,0 +1,131 @@
+"""
+Batched cascade delete for a user and everything that depends on them.
+
+user.delete() has Django's collector load every dependent row into memory
+and delete them all in one transaction. Here each dependent table is
+cleared with plain DELETEs (or UPDATEs for SET_NULL) of at most
+`batch_size` rows by primary key, each a transaction of its own, children
+before parents, so no lock is held for long. The DELETEs send no signals, so
+cached responses are invalidated here instead.
+
+A failure stops the deletion with the batches done so far committed;
+running it again carries on from there.
+"""
+import time
+
+from django.db import connections, models, router
+
+from .authentication import invalidate_user
+from .friend_graph import record_user_removed
+from .response_cache import bump_generation
+
+
+def meta(model):
+   return model._meta  # pylint: disable=protected-access
+
+
+def dependent_relations(model):
+   """Reverse relations of the rows pointing at `model`"""
+   return [field for field in meta(model).get_fields(include_hidden=True)
+           if field.auto_created and not field.concrete and
+           (field.one_to_one or field.one_to_many)]
+
+
+def raw_delete(model, ids):
+   """DELETE the rows with these primary keys, without the collector"""
+   database = router.db_for_write(model)
+   connection = connections[database]
+   quote = connection.ops.quote_name
+   with connection.cursor() as cursor:
+      cursor.execute(
+         f'DELETE FROM {quote(meta(model).db_table)} WHERE '
+         f'{quote(meta(model).pk.column)} IN '
+         f"({', '.join(['%s'] * len(ids))})", ids)
+      return cursor.rowcount
+
+
+class DeletionReport:
+   def __init__(self):
+      self.deleted = {}
+      self.updated = {}
+      self.batches = 0
+
+   def as_dict(self):
+      return {'deleted': self.deleted, 'updated': self.updated,
+              'batches': self.batches}
+
+
+class BatchedDeleter:
+   def __init__(self, batch_size=900, pause=0.0):
+      self.batch_size = batch_size
+      self.pause = pause
+      self.report = DeletionReport()
+
+   def delete(self, queryset, path=()):
+      """Delete every row of `queryset` and the rows that cascade from it"""
+      model = queryset.model
+      for relation in dependent_relations(model):
+         field = relation.field
+         related_model = relation.related_model
+         on_delete = field.remote_field.on_delete
+         # Cycles are skipped; PROTECT and RESTRICT relations make the
+         # DELETE of the parent rows fail, as the foreign key says
+         if related_model in (*path, model) or \
+               on_delete not in (models.CASCADE, models.SET_NULL):
+            continue
+         related = meta(related_model).base_manager.filter(
+            **{f'{field.name}__in': queryset.values(
+               field.target_field.attname)})
+         if on_delete is models.CASCADE:
+            self.delete(related, path + (model,))
+         else:
+            self.in_batches(
+               related, lambda ids, rows=meta(related_model).base_manager,
+               name=field.name: rows.filter(pk__in=ids).update(
+                  **{name: None}), self.report.updated)
+      self.in_batches(queryset, lambda ids: raw_delete(model, ids),
+                      self.report.deleted)
+
+   def in_batches(self, queryset, apply, totals):
+      """Call apply(ids) on batches of `queryset` until it is empty"""
+      model = queryset.model
+      label = meta(model).label
+      # Each id is a bound parameter, which SQLite caps at 999
+      limit = connections[router.db_for_write(model)] \
+         .features.max_query_params
+      batch_size = min(self.batch_size, limit or self.batch_size)
+      while True:
+         ids = list(queryset.order_by().values_list(
+            'pk', flat=True)[:batch_size])
+         if not ids:
+            return
+         count = apply(ids)
+         bump_generation(model)
+         totals[label] = totals.get(label, 0) + count
+         self.report.batches += 1
+         if len(ids) < batch_size:
+            return
+         if self.pause:
+            time.sleep(self.pause)
+
+
+def delete_user(user_id, batch_size=900, pause=0.0):
+   """
+   Delete a user, their profile and all dependent rows in bounded batches.
+   The user is deactivated first, so a deletion that fails halfway leaves
+   an account nobody can sign in to. Vote and comment totals are computed
+   when profiles are read, so no stored counters need adjusting. Returns
+   None if there is no such user.
+   """
+   # pylint: disable=import-outside-toplevel
+   from django.contrib.auth.models import User
+
+   users = User.objects.filter(pk=user_id)
+   if not users.update(is_active=False):
+      return None
+   invalidate_user(user_id)
+   deleter = BatchedDeleter(batch_size, pause)
+   deleter.delete(users)
+   invalidate_user(user_id)
+   record_user_removed(user_id)
+   return deleter.report
@@ -0,0 +1,365 @@
+"""
+A pre-rendered snapshot of the public profile directory, served for
+anonymous GET /api/profiles/ without touching the database.
+
+`manage.py build_directory_snapshot` renders every listed profile with
+ProfileSerializer into gzip-compressed JSON shards under
+DIRECTORY_SNAPSHOT['ROOT'], partitioned by user_type and country and cut
+into pages of PAGE_SIZE profiles. A shard holds the comma-separated
+profiles of one page; responses are spliced together from shards and
+one-character gzip members ("[", ",", "]"), which is still a valid gzip
+stream. The whole directory and each user_type are spliced once at build
+time, so the common requests are a single FileResponse of a precompressed
+file.
+
+Each build writes a new generation directory, hard-links the shards it
+didn't need to render again from the previous one and then swaps the
+`current` symlink to it, so readers never see a half-built snapshot.
+Model signals queue a refresh for the profiles a change touches; pages
+whose members changed are rendered again too. The refreshes queued within
+REFRESH_DELAY seconds run as one, on the task worker or, without one, in
+a timer thread of the web process, so a write never rebuilds the
+snapshot inside its request.
+"""
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .models import Profile
+from .serializer import ProfileSerializer
+
+DEFAULT_DIRECTORY_SNAPSHOT = {
+   # No snapshot is built or served without a directory
+   'ROOT': None,
+   'PAGE_SIZE': 500,
+   # Older generations kept for responses still being streamed
+   'KEEP_GENERATIONS': 2,
+   # Seconds changes are gathered before a queued refresh runs; with 0
+   # and no task worker each write rebuilds in its request
+   'REFRESH_DELAY': 5,
+   'COMPRESS_LEVEL': 6,
+}
+
+# Directory order, which the database fallback uses as well
+ORDERING = ('user_type', 'country', 'pk')
+# Query parameters the snapshot can answer
+PARAMETERS = {'user_type', 'country'}
+CURRENT = 'current'
+MANIFEST = 'manifest.json'
+CHUNK_SIZE = 64 * 1024
+
+OPEN, SEPARATOR, CLOSE = (gzip.compress(char, mtime=0)
+                          for char in (b'[', b',', b']'))
+EMPTY = OPEN + CLOSE
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def snapshot_settings():
+   return {**DEFAULT_DIRECTORY_SNAPSHOT,
+           **getattr(settings, 'DIRECTORY_SNAPSHOT', {})}
+
+
+def snapshot_exists():
+   root = snapshot_settings()['ROOT']
+   return bool(root) and os.path.lexists(os.path.join(root, CURRENT))
+
+
+def directory_queryset():
+   return Profile.objects.exclude(is_anonymous=True).order_by(*ORDERING)
+
+
+def user_type_choices():
+   return dict(Profile._meta.get_field('user_type').choices)  # pylint: disable=protected-access,no-member
+
+
+def page_digest(ids):
+   return hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest()[:20]
+
+
+def render_page(ids):
+   """The page's profiles as ProfileSerializer renders them, sans brackets"""
+   profiles = ProfileSerializer.setup_queryset(
+      Profile.objects.filter(pk__in=ids)).order_by('pk')
+   data = ProfileSerializer(profiles, many=True).data
+   return JSONRenderer().render(data)[1:-1]
+
+
+def layout():
+   """[((user_type, country), [profile ids])] in directory order"""
+   partitions = []
+   for pk, user_type, country in directory_queryset().values_list(
+         'pk', 'user_type', 'country'):
+      key = (user_type or '', country or '')
+      if not partitions or partitions[-1][0] != key:
+         partitions.append((key, []))
+      partitions[-1][1].append(pk)
+   return partitions
+
+
+class SnapshotReport:
+   def __init__(self, generation):
+      self.generation = generation
+      self.profiles = 0
+      self.rendered = 0
+      self.reused = 0
+
+
+@contextmanager
+def build_lock(root):
+   with open(os.path.join(root, '.lock'), 'w', encoding='utf-8') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+         yield
+      finally:
+         fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_manifest(directory):
+   with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+      return json.load(f)
+
+
+def splice(directory, name, shards):
+   """Write one gzip file holding the JSON array of the given shards"""
+   with open(os.path.join(directory, name), 'wb') as out:
+      out.write(OPEN)
+      for i, shard in enumerate(shards):
+         if i:
+            out.write(SEPARATOR)
+         with open(os.path.join(directory, shard), 'rb') as f:
+            shutil.copyfileobj(f, out, CHUNK_SIZE)
+      out.write(CLOSE)
+
+
+def build_snapshot(changed_ids=None):
+   """
+   Build a new generation and make it current. Pages of the previous
+   generation with the same members and none of changed_ids are reused;
+   changed_ids=None renders everything again.
+   """
+   config = snapshot_settings()
+   root = config['ROOT']
+   os.makedirs(root, exist_ok=True)
+   with build_lock(root):
+      current = os.path.join(root, CURRENT)
+      generation = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S-') + \
+         uuid.uuid4().hex[:8]
+      builder = SnapshotBuilder(os.path.join(root, generation), config,
+                                SnapshotReport(generation))
+      if changed_ids is not None and os.path.lexists(current):
+         builder.reuse(os.path.realpath(current), changed_ids)
+      builder.build()
+
+      # rename() over the old link is atomic, unlike unlink() + symlink()
+      link = os.path.join(root, f'.{generation}.link')
+      os.symlink(generation, link)
+      os.replace(link, current)
+      remove_old_generations(root, generation, config['KEEP_GENERATIONS'])
+   return builder.report
+
+
+class SnapshotBuilder:
+   """Writes one generation: its shards, spliced files and manifest"""
+
+   def __init__(self, directory, config, report):
+      self.directory = directory
+      self.config = config
+      self.report = report
+      self.previous = None
+      self.reusable = set()
+      self.changed_ids = set()
+
+   def reuse(self, previous, changed_ids):
+      """Link the previous generation's pages that are still up to date"""
+      self.previous = previous
+      self.reusable = {page['digest'] for partition in
+                       read_manifest(previous)['partitions']
+                       for page in partition['pages']}
+      self.changed_ids = set(changed_ids)
+
+   def build(self):
+      os.makedirs(os.path.join(self.directory, 'shards'))
+      partitions = []
+      for (user_type, country), ids in layout():
+         partitions.append({'user_type': user_type, 'country': country,
+                            'count': len(ids), 'pages': self.write_pages(ids)})
+         self.report.profiles += len(ids)
+      self.write_manifest(partitions)
+
+   def write_pages(self, ids):
+      size = self.config['PAGE_SIZE']
+      pages = []
+      for start in range(0, len(ids), size):
+         page_ids = ids[start:start + size]
+         digest = page_digest(page_ids)
+         name = f'shards/{digest}.gz'
+         self.write_page(name, digest, page_ids)
+         pages.append({'file': name, 'digest': digest,
+                       'count': len(page_ids)})
+      return pages
+
+   def write_page(self, name, digest, page_ids):
+      target = os.path.join(self.directory, name)
+      if digest in self.reusable and self.changed_ids.isdisjoint(page_ids):
+         link_or_copy(os.path.join(self.previous, name), target)
+         self.report.reused += 1
+      else:
+         with open(target, 'wb') as f:
+            f.write(gzip.compress(render_page(page_ids),
+                                  self.config['COMPRESS_LEVEL'], mtime=0))
+         self.report.rendered += 1
+
+   def write_manifest(self, partitions):
+      files = {'all': 'all.gz', 'user_types': {}}
+      splice(self.directory, 'all.gz', shard_files(partitions))
+      user_types = dict.fromkeys(p['user_type'] for p in partitions)
+      for i, user_type in enumerate(user_types):
+         name = files['user_types'][user_type] = f'user_type-{i}.gz'
+         splice(self.directory, name, shard_files(partitions, user_type))
+      with open(os.path.join(self.directory, MANIFEST), 'w',
+                encoding='utf-8') as f:
+         json.dump({
+            'generation': self.report.generation,
+            'built_at': datetime.now(timezone.utc).isoformat(),
+            'count': self.report.profiles,
+            'partitions': partitions,
+            'files': files,
+         }, f)
+
+
+def shard_files(partitions, user_type=None, country=None):
+   return [page['file'] for partition in partitions
+           if user_type in (None, partition['user_type'])
+           and country in (None, partition['country'])
+           for page in partition['pages']]
+
+
+def link_or_copy(source, target):
+   try:
+      os.link(source, target)
+   except OSError:
+      shutil.copyfile(source, target)
+
+
+def remove_old_generations(root, current, keep):
+   generations = sorted(
+      name for name in os.listdir(root)
+      if name != current and os.path.isdir(os.path.join(root, name))
+      and not os.path.islink(os.path.join(root, name)))
+   for name in generations[:max(len(generations) - keep, 0)]:
+      shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+_manifest = (None, None)
+_manifest_lock = threading.Lock()
+
+
+def current_manifest(root):
+   """(directory, manifest) of the current generation, or (None, None)"""
+   global _manifest  # pylint: disable=global-statement
+   try:
+      generation = os.readlink(os.path.join(root, CURRENT))
+   except OSError:
+      return None, None
+   directory = os.path.join(root, generation)
+   cached = _manifest
+   if cached[0] != directory:
+      with _manifest_lock:
+         try:
+            cached = _manifest = (directory, read_manifest(directory))
+         except (OSError, ValueError):
+            return None, None
+   return cached
+
+
+def gunzip(chunks):
+   """Decompress a stream of one or more gzip members"""
+   decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+   for chunk in chunks:
+      while chunk:
+         data = decompressor.decompress(chunk)
+         if data:
+            yield data
+         if not decompressor.eof:
+            break
+         chunk = decompressor.unused_data
+         decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+
+def file_chunks(path):
+   with open(path, 'rb') as f:
+      yield from iter(lambda: f.read(CHUNK_SIZE), b'')
+
+
+def read_files(directory, files):
+   """Chunks of the JSON array of the given shards, gzip-compressed"""
+   yield OPEN
+   for i, name in enumerate(files):
+      if i:
+         yield SEPARATOR
+      yield from file_chunks(os.path.join(directory, name))
+   yield CLOSE
+
+
+def snapshot_response(request):
+   """
+   The directory listing from the snapshot for an anonymous request with
+   at most ?user_type= and ?country=, or None when it has to be rendered
+   """
+   root = snapshot_settings()['ROOT']
+   params = request.query_params
+   if not root or request.user.is_authenticated or \
+         not set(params) <= PARAMETERS:
+      return None
+   user_type = params.get('user_type') or None
+   country = params.get('country') or None
+   if user_type is not None and user_type not in user_type_choices():
+      # Left to the filter backend, which rejects it
+      return None
+   directory, manifest = current_manifest(root)
+   if manifest is None:
+      return None
+
+   gzip_ok = accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+   if country is None:
+      response = spliced_response(directory, manifest, user_type, gzip_ok)
+   else:
+      response = stream(read_files(directory, shard_files(
+         manifest['partitions'], user_type, country)), gzip_ok)
+   if gzip_ok:
+      response['Content-Encoding'] = 'gzip'
+   response['Vary'] = 'Accept-Encoding, Authorization'
+   return response
+
+
+def spliced_response(directory, manifest, user_type, gzip_ok):
+   """The whole directory, or one user_type of it, as spliced at build"""
+   name = manifest['files']['all'] if user_type is None \
+      else manifest['files']['user_types'].get(user_type)
+   path = name and os.path.join(directory, name)
+   if path and gzip_ok:
+      # pylint: disable-next=consider-using-with
+      response = FileResponse(open(path, 'rb'),
+                              content_type='application/json')
+      # Not a download, whatever the file on disk is called
+      response.headers.pop('Content-Disposition', None)
+      return response
+   return stream(file_chunks(path) if path else iter([EMPTY]), gzip_ok)
+
+
+def stream(chunks, compressed):
+   return StreamingHttpResponse(chunks if compressed else gunzip(chunks),
+                                content_type='application/json')
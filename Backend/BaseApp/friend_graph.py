@@ -0,0 +1,193 @@
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Friendship
+
+
+class FriendGraph:
+   """
+   Accepted friendships as an adjacency map of sorted user id arrays.
+
+   Writers replace a user's array instead of mutating it, so readers can
+   walk a neighbour list without taking the lock.
+   """
+
+   def __init__(self):
+      self._neighbours = {}
+      self._lock = threading.Lock()
+
+   @classmethod
+   def from_pairs(cls, pairs):
+      adjacency = {}
+      for a, b in pairs:
+         if a == b:
+            continue
+         adjacency.setdefault(a, set()).add(b)
+         adjacency.setdefault(b, set()).add(a)
+      graph = cls()
+      graph._neighbours = {
+         user_id: array('q', sorted(friends))
+         for user_id, friends in adjacency.items()
+      }
+      return graph
+
+   def neighbours(self, user_id):
+      return self._neighbours.get(user_id, array('q'))
+
+   def are_friends(self, a, b):
+      friends = self.neighbours(a)
+      i = bisect_left(friends, b)
+      return i < len(friends) and friends[i] == b
+
+   def add_edge(self, a, b):
+      if a == b:
+         return
+      with self._lock:
+         self._insert(a, b)
+         self._insert(b, a)
+
+   def remove_edge(self, a, b):
+      with self._lock:
+         self._discard(a, b)
+         self._discard(b, a)
+
+   def remove_user(self, user_id):
+      with self._lock:
+         for friend in self._neighbours.pop(user_id, ()):
+            self._discard(friend, user_id)
+
+   def _insert(self, owner_id, other_id):
+      friends = self.neighbours(owner_id)
+      i = bisect_left(friends, other_id)
+      if i < len(friends) and friends[i] == other_id:
+         return
+      updated = array('q', friends)
+      updated.insert(i, other_id)
+      self._neighbours[owner_id] = updated
+
+   def _discard(self, owner_id, other_id):
+      friends = self.neighbours(owner_id)
+      i = bisect_left(friends, other_id)
+      if i == len(friends) or friends[i] != other_id:
+         return
+      updated = array('q', friends)
+      del updated[i]
+      if updated:
+         self._neighbours[owner_id] = updated
+      else:
+         self._neighbours.pop(owner_id, None)
+
+   def mutual_count(self, a, b):
+      # Merge-walk the two sorted lists
+      left, right = self.neighbours(a), self.neighbours(b)
+      i = j = count = 0
+      while i < len(left) and j < len(right):
+         if left[i] == right[j]:
+            count += 1
+            i += 1
+            j += 1
+         elif left[i] < right[j]:
+            i += 1
+         else:
+            j += 1
+      return count
+
+   def mutual_counts(self, user_id, other_ids):
+      return {other: self.mutual_count(user_id, other) for other in other_ids}
+
+   def suggestions(self, user_id, limit=None):
+      """Friends of friends ranked by how many mutual friends they share"""
+      friends = self.neighbours(user_id)
+      counts = Counter()
+      for friend in friends:
+         counts.update(self.neighbours(friend))
+      counts.pop(user_id, None)
+      for friend in friends:
+         counts.pop(friend, None)
+      ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+      return ranked[:limit]
+
+
+# Changed in the shared cache whenever a friendship changes, so the other
+# workers know their graph is out of date
+VERSION_KEY = 'friend-graph:version'
+
+_graph = None
+_graph_built_at = 0.0
+_graph_version = None
+_graph_lock = threading.Lock()
+
+
+def get_friend_graph():
+   """
+   Return this process's graph, building it from the database on first
+   use, again once another worker changed a friendship, and at the latest
+   once FRIEND_GRAPH_TTL seconds have passed.
+   """
+   # pylint: disable=global-statement
+   global _graph, _graph_built_at, _graph_version
+   ttl = getattr(settings, 'FRIEND_GRAPH_TTL', 300)
+   version = cache.get(VERSION_KEY)
+   if _graph is not None and _graph_version == version and \
+         time.monotonic() - _graph_built_at < ttl:
+      return _graph
+   with _graph_lock:
+      if _graph is None or _graph_version != version or \
+            time.monotonic() - _graph_built_at >= ttl:
+         pairs = Friendship.objects.filter(status='accepted').values_list(
+            'sender_id', 'receiver_id').iterator()
+         _graph = FriendGraph.from_pairs(pairs)
+         _graph_built_at = time.monotonic()
+         _graph_version = version
+   return _graph
+
+
+def publish_change():
+   global _graph_version  # pylint: disable=global-statement
+   version = uuid.uuid4().hex
+   cache.set(VERSION_KEY, version, timeout=None)
+   # This process applied the change itself and needn't rebuild
+   if _graph is not None:
+      _graph_version = version
+
+
+def changed():
+   # Once committed, or other workers could rebuild without the change
+   transaction.on_commit(publish_change)
+
+
+def record_friendship(friendship, removed=False):
+   """
+   Apply a responded-to or deleted friendship to this process's graph, if
+   loaded, right away, and have the other workers rebuild theirs
+   """
+   changed()
+   graph = _graph
+   if graph is None:
+      return
+   if friendship.status == 'accepted' and not removed:
+      graph.add_edge(friendship.sender_id, friendship.receiver_id)
+   else:
+      graph.remove_edge(friendship.sender_id, friendship.receiver_id)
+
+
+def record_user_removed(user_id):
+   """Drop a deleted user and their friendships from the graph if loaded"""
+   changed()
+   graph = _graph
+   if graph is not None:
+      graph.remove_user(user_id)
+
+
+def reset_friend_graph():
+   global _graph  # pylint: disable=global-statement
+   with _graph_lock:
+      _graph = None
@@ -0,0 +1,246 @@
+"""
+Geocoding and radius search without an external service.
+
+Profiles are placed at the coordinates of their city - or, failing that,
+their state or country - from an offline gazetteer when they are saved,
+and filed under a 1-degree grid cell in the indexed geo_cell column;
+geo_precision records which of the three was found. A search for
+?near=lat,lon&radius=km narrows the profiles to the grid cells the circle
+touches with index range scans, then keeps the ones actually within the
+radius by haversine distance, computed with NumPy for all candidates at
+once. Profiles placed only by their country are left out: a country's
+middle says nothing about how far away they are.
+
+The gazetteer is a tab-separated file with the columns country,
+country_code, state, state_code, city, latitude, longitude; rows with no
+city (or no state) give the point used for a whole state (or country)
+and come before that region's places, which are listed most populous
+first. `manage.py build_gazetteer` writes one from the GeoNames dumps.
+"""
+import csv
+import math
+import operator
+import os
+import threading
+import unicodedata
+from functools import reduce
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+EARTH_RADIUS_KM = 6371.0088
+# Cells are CELL_DEGREES square; cell = row * COLUMNS + column
+CELL_DEGREES = 1
+COLUMNS = 360 // CELL_DEGREES
+ROWS = 180 // CELL_DEGREES
+
+DEFAULT_GEO_SEARCH = {
+   'GAZETTEER': os.path.join(os.path.dirname(__file__), 'data',
+                             'gazetteer.tsv'),
+   'DEFAULT_RADIUS_KM': 50,
+   'MAX_RADIUS_KM': 20000,
+   # Nearest profiles kept by a radius search
+   'MAX_RESULTS': 500,
+}
+
+# How closely a profile was placed
+CITY, STATE, COUNTRY = 'city', 'state', 'country'
+PRECISIONS = [(CITY, 'City'), (STATE, 'State'), (COUNTRY, 'Country')]
+
+COUNTRY_ALIASES = {
+   'usa': 'us', 'u.s.': 'us', 'u.s.a.': 'us', 'america': 'us',
+   'united states of america': 'us', 'uk': 'gb', 'great britain': 'gb',
+}
+
+
+def geo_settings():
+   return {**DEFAULT_GEO_SEARCH, **getattr(settings, 'GEO_SEARCH', {})}
+
+
+def normalize(value):
+   """Lowercase, accents removed and whitespace collapsed"""
+   value = unicodedata.normalize('NFKD', value or '')
+   value = ''.join(c for c in value if not unicodedata.combining(c))
+   return ' '.join(value.lower().split())
+
+
+class Gazetteer:
+   def __init__(self):
+      self.countries = {}   # name or code -> country key
+      self.places = {}      # (country, state, city) -> (lat, lon)
+      self.states = {}      # (country, state name or code) -> state key
+
+   @classmethod
+   def from_file(cls, path):
+      gazetteer = cls()
+      with open(path, encoding='utf-8', newline='') as f:
+         rows = csv.DictReader((line for line in f
+                                if not line.startswith('#')),
+                               delimiter='\t', quoting=csv.QUOTE_NONE)
+         for row in rows:
+            gazetteer.add(row)
+      return gazetteer
+
+   def add(self, row):
+      country = normalize(row['country_code']) or normalize(row['country'])
+      self.countries.setdefault(normalize(row['country']), country)
+      self.countries.setdefault(country, country)
+      state = normalize(row['state'])
+      if state:
+         self.states.setdefault((country, state), state)
+         if row.get('state_code'):
+            self.states.setdefault(
+               (country, normalize(row['state_code'])), state)
+      point = (float(row['latitude']), float(row['longitude']))
+      city = normalize(row['city'])
+      # The first place of a name wins, so a country's or state's own row
+      # must come before its places; without one, its first (most
+      # populous) place stands in for it
+      if city:
+         self.places.setdefault((country, state, city), point)
+         self.places.setdefault((country, '', city), point)
+      if state:
+         self.places.setdefault((country, state, ''), point)
+      self.places.setdefault((country, '', ''), point)
+
+   def locate(self, city=None, state=None, country=None):
+      """
+      ((latitude, longitude), precision) for a place, the precision being
+      CITY, STATE or COUNTRY; None if the country is unknown
+      """
+      country = normalize(country)
+      country = self.countries.get(COUNTRY_ALIASES.get(country, country))
+      if country is None:
+         return None
+      state = self.states.get((country, normalize(state)), '')
+      city = normalize(city)
+      for key in ((country, state, city), (country, '', city),
+                  (country, state, ''), (country, '', '')):
+         if key in self.places:
+            return self.places[key], precision_of(key)
+      return None
+
+
+def precision_of(key):
+   _, state, city = key
+   return CITY if city else STATE if state else COUNTRY
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+   global _gazetteer  # pylint: disable=global-statement
+   if _gazetteer is None:
+      with _gazetteer_lock:
+         if _gazetteer is None:
+            _gazetteer = Gazetteer.from_file(geo_settings()['GAZETTEER'])
+   return _gazetteer
+
+
+def cell_of(latitude, longitude):
+   row = min(int((latitude + 90) // CELL_DEGREES), ROWS - 1)
+   column = int((longitude + 180) // CELL_DEGREES) % COLUMNS
+   return row * COLUMNS + column
+
+
+def geocode_profile(profile):
+   """Set a profile's coordinates and grid cell from its location"""
+   found = get_gazetteer().locate(profile.city, profile.state,
+                                  profile.country)
+   if found is None:
+      profile.latitude = profile.longitude = profile.geo_cell = None
+      profile.geo_precision = None
+   else:
+      point, profile.geo_precision = found
+      profile.latitude, profile.longitude = point
+      profile.geo_cell = cell_of(*point)
+
+
+def cell_ranges(latitude, longitude, radius_km):
+   """
+   [(first, last)] ranges of cell ids covering a circle: one or two per
+   grid row it crosses, or one for a whole band of rows.
+   """
+   angle = radius_km / EARTH_RADIUS_KM
+   south = max(-90.0, latitude - math.degrees(angle))
+   north = min(90.0, latitude + math.degrees(angle))
+   rows = range(cell_of(south, 0) // COLUMNS, cell_of(north, 0) // COLUMNS + 1)
+   # How far east and west the circle reaches; all the way round when it
+   # contains a pole
+   spread = math.sin(angle) / max(math.cos(math.radians(latitude)), 1e-12)
+   if south <= -90 or north >= 90 or angle >= math.pi / 2 or spread >= 1:
+      return [(rows[0] * COLUMNS, rows[-1] * COLUMNS + COLUMNS - 1)]
+
+   reach = math.degrees(math.asin(spread))
+   return [cells for row in rows for cells in row_ranges(
+      row, cell_of(0, longitude - reach) % COLUMNS,
+      cell_of(0, longitude + reach) % COLUMNS)]
+
+
+def row_ranges(row, west, east):
+   """Cell ranges of one grid row from column `west` east to `east`"""
+   base = row * COLUMNS
+   if west <= east:
+      return [(base + west, base + east)]
+   # Crosses the antimeridian
+   return [(base + west, base + COLUMNS - 1), (base, base + east)]
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+   """Distances in km from one point to arrays of points"""
+   lat1, lon1 = math.radians(latitude), math.radians(longitude)
+   lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+   a = np.sin((lat2 - lat1) / 2) ** 2 + \
+      math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+   return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def parse_near(near, radius=None):
+   """(latitude, longitude, radius_km) from the query; raises ValueError"""
+   config = geo_settings()
+   try:
+      latitude, longitude = (float(part) for part in near.split(','))
+      radius_km = float(radius) if radius else config['DEFAULT_RADIUS_KM']
+   except ValueError as e:
+      raise ValueError('near must be "latitude,longitude" and radius a '
+                       'number of km') from e
+   if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+      raise ValueError('near is not a valid latitude,longitude')
+   if not 0 < radius_km <= config['MAX_RADIUS_KM']:
+      raise ValueError(
+         f"radius must be between 0 and {config['MAX_RADIUS_KM']} km")
+   return latitude, longitude, radius_km
+
+
+def nearest(queryset, latitude, longitude, radius_km):
+   """
+   [(pk, distance_km)] of the profiles in `queryset` within radius_km of a
+   point, nearest first, at most GEO_SEARCH['MAX_RESULTS'] of them. Only
+   profiles placed by their city or state are considered.
+   """
+   cells = reduce(operator.or_, (
+      Q(geo_cell__gte=first, geo_cell__lte=last)
+      for first, last in cell_ranges(latitude, longitude, radius_km)))
+   rows = list(queryset.filter(cells, geo_precision__in=[CITY, STATE])
+               .order_by().values_list('pk', 'latitude', 'longitude')
+               .distinct())
+   if not rows:
+      return []
+
+   ids, latitudes, longitudes = (np.array(column) for column in zip(*rows))
+   return closest(ids, haversine_km(latitude, longitude,
+                                    latitudes.astype(float),
+                                    longitudes.astype(float)), radius_km)
+
+
+def closest(ids, distances, radius_km):
+   """[(id, distance_km)] of the ids within radius_km, nearest first"""
+   inside = np.flatnonzero(distances <= radius_km)
+   limit = geo_settings()['MAX_RESULTS']
+   if len(inside) > limit:
+      inside = inside[np.argpartition(distances[inside], limit - 1)[:limit]]
+   inside = inside[np.lexsort((ids[inside], distances[inside]))]
+   return [(int(ids[i]), round(float(distances[i]), 1)) for i in inside]
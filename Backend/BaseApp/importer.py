@@ -0,0 +1,267 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .authentication import invalidate_user
+from .geo import geocode_profile
+from .models import Profile, ProfileTagging, Tag
+from .response_cache import bump_generation
+from .tasks import queue_directory_refresh
+
+PROFILE_FIELDS = ('user_type', 'first_name', 'last_name', 'street_address',
+                  'city', 'state', 'country', 'phone_number',
+                  'years_of_experience', 'description', 'is_anonymous')
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name')
+
+
+def model_field(model, name):
+   return model._meta.get_field(name)  # pylint: disable=protected-access
+
+
+# Checked against their model fields' validators (max_length, email and
+# username format) before anything is written
+TEXT_FIELDS = [
+   (name, model_field(model, name))
+   for model, names in (
+      (User, USER_FIELDS),
+      (Profile, ('first_name', 'last_name', 'street_address', 'city',
+                 'state', 'country', 'phone_number', 'description')))
+   for name in names
+]
+USER_TYPES = {choice for choice, _ in model_field(Profile,
+                                                  'user_type').choices}
+
+
+def read_rows(stream, fmt):
+   """Yield (row_number, dict) from a CSV or NDJSON text stream"""
+   if fmt == 'csv':
+      for number, row in enumerate(csv.DictReader(stream), start=1):
+         yield number, row
+   elif fmt == 'ndjson':
+      number = 0
+      for line in stream:
+         if not line.strip():
+            continue
+         number += 1
+         try:
+            yield number, json.loads(line)
+         except ValueError:
+            yield number, None
+   else:
+      raise ValueError(f"Unsupported format: {fmt}")
+
+
+def detect_format(filename):
+   return 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+class ImportResult:
+   def __init__(self, error_limit=None):
+      self.rows = 0
+      self.created = 0
+      self.failed = 0
+      self.last_row = 0
+      # The first error_limit failed rows; `failed` counts them all
+      self.errors = []
+      self.error_limit = error_limit
+
+   def add_error(self, number, errors):
+      self.failed += 1
+      if self.error_limit is None or len(self.errors) < self.error_limit:
+         self.errors.append({'row': number, 'errors': errors})
+
+   def as_dict(self):
+      return {
+         'rows': self.rows,
+         'created': self.created,
+         'failed': self.failed,
+         'last_row': self.last_row,
+         'errors': self.errors,
+      }
+
+
+def _init_worker():
+   # Spawned (non-forked) workers need the app registry for the hashers
+   if not django.apps.apps.ready:
+      django.setup()
+
+
+def _split_tags(value):
+   if isinstance(value, list):
+      return [str(tag).strip() for tag in value if str(tag).strip()]
+   return [tag.strip() for tag in (value or '').replace(';', ',').split(',')
+           if tag.strip()]
+
+
+def _validate_text(cleaned, errors):
+   for name, field in TEXT_FIELDS:
+      if cleaned[name] in ('', None) or name in errors:
+         continue
+      cleaned[name] = str(cleaned[name])
+      try:
+         field.run_validators(cleaned[name])
+      except ValidationError as e:
+         errors[name] = ' '.join(e.messages)
+
+
+def _clean_row(row, tags_by_name):
+   """Return (cleaned, errors) for one input row"""
+   if not isinstance(row, dict):
+      return None, {'row': 'Row is not a JSON object'}
+
+   errors = {}
+   cleaned = {
+      field: (row.get(field) or '').strip()
+      if isinstance(row.get(field), str) else row.get(field)
+      for field in set(PROFILE_FIELDS) | set(USER_FIELDS) | {'password'}
+   }
+   if not cleaned['username']:
+      errors['username'] = 'This field is required.'
+   if not cleaned['password']:
+      errors['password'] = 'This field is required.'
+   _validate_text(cleaned, errors)
+
+   cleaned['user_type'] = cleaned['user_type'] or 'other'
+   if cleaned['user_type'] not in USER_TYPES:
+      errors['user_type'] = \
+         f"\"{cleaned['user_type']}\" is not a valid choice."
+
+   years = cleaned['years_of_experience']
+   if years in ('', None):
+      cleaned['years_of_experience'] = None
+   else:
+      try:
+         cleaned['years_of_experience'] = int(years)
+      except (TypeError, ValueError):
+         errors['years_of_experience'] = 'A valid integer is required.'
+
+   cleaned['is_anonymous'] = str(cleaned['is_anonymous']).lower() in (
+      'true', '1', 'yes')
+
+   tag_ids = []
+   for name in _split_tags(row.get('tags')):
+      tag_id = tags_by_name.get(name.lower())
+      if tag_id is None:
+         errors.setdefault('tags', []).append(f'Unknown tag "{name}"')
+      else:
+         tag_ids.append(tag_id)
+   cleaned['tag_ids'] = sorted(set(tag_ids))
+   return cleaned, errors
+
+
+class ProfileImporter:
+   """
+   Creates users, profiles and tag links in bulk. With workers > 1,
+   passwords are hashed in a process pool; `manage.py import_profiles` uses
+   one per core, requests hash in their own process. Each chunk is written
+   in its own transaction, so an interrupted import can resume after the
+   last committed chunk. Only the first error_limit failed rows are kept.
+   """
+
+   def __init__(self, chunk_size=500, workers=1, error_limit=None):
+      self.chunk_size = chunk_size
+      self.workers = workers
+      self.error_limit = error_limit
+      # Tags may be given by name or by id; names win on a clash
+      tags = Tag.objects.values_list('id', 'tag_name')
+      self.tags_by_name = {str(tag_id): tag_id for tag_id, _ in tags}
+      self.tags_by_name.update(
+         {name.lower(): tag_id for tag_id, name in tags})
+      self._pool = None
+
+   def __enter__(self):
+      if self.workers > 1:
+         self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                          initializer=_init_worker)
+      return self
+
+   def __exit__(self, *exc_info):
+      if self._pool:
+         self._pool.shutdown()
+
+   def hash_passwords(self, passwords):
+      if self._pool is None:
+         return [make_password(password) for password in passwords]
+      chunksize = max(1, len(passwords) // (self.workers * 4))
+      return list(self._pool.map(make_password, passwords,
+                                 chunksize=chunksize))
+
+   def run(self, rows, start_after=0, on_chunk=None):
+      """
+      Import (row_number, dict) pairs, skipping rows up to `start_after`.
+      `on_chunk(result)` is called after every committed chunk.
+      """
+      result = ImportResult(self.error_limit)
+      rows = ((n, row) for n, row in rows if n > start_after)
+      while True:
+         chunk = list(islice(rows, self.chunk_size))
+         if not chunk:
+            break
+         self.import_chunk(chunk, result)
+         result.last_row = chunk[-1][0]
+         if on_chunk:
+            on_chunk(result)
+      return result
+
+   def import_chunk(self, chunk, result):
+      result.rows += len(chunk)
+      valid = self.validate_chunk(chunk, result)
+      if not valid:
+         return
+
+      hashes = self.hash_passwords([c['password'] for _, c in valid])
+      with transaction.atomic():
+         users = User.objects.bulk_create([
+            User(password=password_hash,
+                 **{field: cleaned[field] or '' for field in USER_FIELDS})
+            for (_, cleaned), password_hash in zip(valid, hashes)
+         ])
+         profiles = [
+            Profile(user_id=user.id,
+                    **{field: cleaned[field] for field in PROFILE_FIELDS})
+            for user, (_, cleaned) in zip(users, valid)
+         ]
+         # bulk_create skips Profile.save(), which places profiles
+         for profile in profiles:
+            geocode_profile(profile)
+         Profile.objects.bulk_create(profiles)
+         ProfileTagging.objects.bulk_create([
+            ProfileTagging(profile_id=user.id, tag_id=tag_id)
+            for user, (_, cleaned) in zip(users, valid)
+            for tag_id in cleaned['tag_ids']
+         ])
+      # bulk_create sends no post_save either, so do what its receivers do
+      bump_generation(User, Profile, ProfileTagging)
+      for user in users:
+         invalidate_user(user.id)
+      queue_directory_refresh([user.id for user in users])
+      result.created += len(users)
+
+   def validate_chunk(self, chunk, result):
+      """(row_number, cleaned) of the rows that can be created"""
+      valid = []
+      seen = set()
+      for number, row in chunk:
+         cleaned, errors = _clean_row(row, self.tags_by_name)
+         if not errors and cleaned['username'] in seen:
+            errors = {'username': 'Duplicate username in import file.'}
+         if errors:
+            result.add_error(number, errors)
+            continue
+         seen.add(cleaned['username'])
+         valid.append((number, cleaned))
+
+      taken = set(User.objects.filter(username__in=seen).values_list(
+         'username', flat=True))
+      for number, cleaned in valid:
+         if cleaned['username'] in taken:
+            result.add_error(number, {
+               'username': 'A user with that username already exists.'})
+      return [(n, c) for n, c in valid if c['username'] not in taken]
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# (sync route served by WSGI, async route served by ASGI)
+ROUTE_PAIRS = [
+   ('/api/search/?q=a', '/api/async/search/?q=a'),
+   ('/api/profiles/match', '/api/async/profiles/match'),
+   ('/api/profiles/me/', '/api/async/profiles/me/'),
+]
+
+
+def shares(total, concurrency):
+   """Requests per connection"""
+   return [total // concurrency + (i < total % concurrency)
+           for i in range(concurrency)]
+
+
+def check(response, url):
+   # A failing route would make the rate meaningless
+   if response.status_code != 200:
+      raise CommandError(f"{url} answered {response.status_code}")
+
+
+class Command(BaseCommand):
+   help = ("Compare request throughput of the sync endpoints on the WSGI "
+           "handler with their async variants on the ASGI handler at the "
+           "same number of concurrent connections")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--username',
+                          help='User to authenticate as (default: first '
+                               'user with a profile)')
+      parser.add_argument('--requests', type=int, default=200)
+      parser.add_argument('--concurrency', type=int, default=16)
+
+   def handle(self, *args, **options):
+      if options['username']:
+         user = User.objects.filter(username=options['username']).first()
+      else:
+         user = User.objects.filter(profile__isnull=False).first()
+      if user is None:
+         raise CommandError('No user to authenticate as; seed data first')
+
+      headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+      load = (options['requests'], options['concurrency'])
+
+      self.stdout.write(f"{load[0]} requests, {load[1]} concurrent")
+      self.stdout.write(f"{'route':<32}{'WSGI req/s':>12}{'ASGI req/s':>12}")
+      # The test clients send requests to the host "testserver". The
+      # throttle is off, or the runs would time its 429s and not the endpoints
+      with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            THROTTLE={**getattr(settings, 'THROTTLE', {}), 'ENABLED': False}):
+         for sync_url, async_url in ROUTE_PAIRS:
+            wsgi_rate = self.run_wsgi(sync_url, headers, *load)
+            asgi_rate = asyncio.run(self.run_asgi(async_url, headers, *load))
+            self.stdout.write(
+               f"{sync_url:<32}{wsgi_rate:>12.1f}{asgi_rate:>12.1f}")
+
+   @staticmethod
+   def run_wsgi(url, headers, total, concurrency):
+      # One thread per connection, like a threaded WSGI worker
+      def worker(count):
+         client = Client()
+         for _ in range(count):
+            check(client.get(url, headers=headers), url)
+         connections.close_all()
+
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=concurrency) as pool:
+         list(pool.map(worker, shares(total, concurrency)))
+      return total / (time.perf_counter() - start)
+
+   @staticmethod
+   async def run_asgi(url, headers, total, concurrency):
+      # All connections share one event loop, like an ASGI worker
+      async def worker(count):
+         client = AsyncClient()
+         for _ in range(count):
+            check(await client.get(url, headers=headers), url)
+
+      start = time.perf_counter()
+      await asyncio.gather(*(worker(share)
+                             for share in shares(total, concurrency)))
+      return total / (time.perf_counter() - start)
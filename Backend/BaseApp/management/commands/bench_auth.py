@@ -0,0 +1,67 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from BaseApp.authentication import CachedJWTAuthentication, \
+    ProfileTokenObtainPairSerializer, user_cache
+from BaseApp.models import Profile
+from BaseApp.views import CurrentUserView, MatchmakingResultsView
+
+
+class Rollback(Exception):
+   pass
+
+
+def measure(client, url, count):
+   """(queries, seconds) taken by `count` GETs of url after a warm-up"""
+   client.get(url)
+   with CaptureQueriesContext(connection) as queries:
+      start = time.perf_counter()
+      for _ in range(count):
+         client.get(url)
+      elapsed = time.perf_counter() - start
+   return len(queries.captured_queries), elapsed
+
+
+class Command(BaseCommand):
+   help = ("Compare database round trips and latency per authenticated "
+           "request with and without the token user cache")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--requests', type=int, default=200)
+
+   def handle(self, *args, **options):
+      # Everything runs in a transaction that is rolled back at the end
+      try:
+         with transaction.atomic():
+            self.run(options['requests'])
+            raise Rollback()
+      except Rollback:
+         pass
+
+   def run(self, count):
+      user = User.objects.create_user(
+         username='bench-auth-user', password='bench-auth-password')
+      Profile.objects.create(user=user, user_type='missionary')
+      token = ProfileTokenObtainPairSerializer.get_token(user).access_token
+      client = APIClient()
+      client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+      self.stdout.write(
+         f"{'route':<28}{'auth class':<26}{'queries/req':>12}{'ms/req':>10}")
+      for url, view in (('/api/profiles/me/', CurrentUserView),
+                        ('/api/profiles/match', MatchmakingResultsView)):
+         for auth_class in (JWTAuthentication, CachedJWTAuthentication):
+            user_cache.clear()
+            with mock.patch.object(view, 'authentication_classes',
+                                   [auth_class]):
+               queries, elapsed = measure(client, url, count)
+            self.stdout.write(
+               f"{url:<28}{auth_class.__name__:<26}"
+               f"{queries / count:>12.2f}{elapsed * 1000 / count:>10.2f}")
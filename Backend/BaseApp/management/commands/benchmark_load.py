@@ -0,0 +1,173 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from BaseApp.models import Profile
+
+from .bench_async import shares
+
+
+def search_request(rng, context):
+   return 'get', f"/api/search/?q={rng.choice(context['names'])}", None
+
+
+def vote_request(rng, context):
+   return 'post', '/api/profiles/vote/', {
+      'profile': rng.choice(context['profile_ids']),
+      'is_upvote': rng.random() < 0.85,
+   }
+
+
+# name -> function(rng, context) returning (method, path, data)
+ENDPOINTS = {
+   'search': search_request,
+   'match': lambda rng, context: ('get', '/api/profiles/match', None),
+   'list': lambda rng, context: ('get', '/api/profiles/', None),
+   'vote': vote_request,
+   'notifications': lambda rng, context: (
+      'get', '/api/notifications/', None),
+}
+
+
+def percentile(sorted_values, percent):
+   """Nearest-rank percentile of an already sorted list"""
+   if not sorted_values:
+      return None
+   rank = max(0, -(-len(sorted_values) * percent // 100) - 1)
+   return sorted_values[int(rank)]
+
+
+def summarize(samples, elapsed):
+   latencies = sorted(ms for ms, _ in samples)
+   return {
+      'requests': len(samples),
+      'errors': sum(1 for _, status in samples if status >= 400),
+      'throughput': round(len(samples) / elapsed, 2),
+      'mean_ms': round(sum(latencies) / len(latencies), 2),
+      'p50_ms': round(percentile(latencies, 50), 2),
+      'p95_ms': round(percentile(latencies, 95), 2),
+      'p99_ms': round(percentile(latencies, 99), 2),
+      'max_ms': round(latencies[-1], 2),
+   }
+
+
+def load_context(prefix, actors):
+   """Tokens to send requests with and values to fill them in with"""
+   users = list(User.objects.filter(
+      username__startswith=prefix, profile__isnull=False)
+      .order_by('id')[:actors])
+   if not users:
+      raise CommandError(
+         f"No users prefixed \"{prefix}\"; run seed_data first")
+   profiles = Profile.objects.values_list('user_id', 'first_name')
+   return {
+      'tokens': [str(AccessToken.for_user(user)) for user in users],
+      'profile_ids': [user_id for user_id, _ in profiles],
+      'names': sorted({name for _, name in profiles if name}) or ['a'],
+   }
+
+
+def timed(client, method, path, data, token):
+   """(ms, status) of one request"""
+   start = time.perf_counter()
+   response = getattr(client, method)(
+      path, data, content_type='application/json',
+      headers={'Authorization': f'Bearer {token}'})
+   return (time.perf_counter() - start) * 1000, response.status_code
+
+
+def send(build_request, context, rng, count):
+   """(ms, status) of `count` requests sent one after the other"""
+   client = Client()
+   return [timed(client, *build_request(rng, context),
+                 rng.choice(context['tokens']))
+           for _ in range(count)]
+
+
+def result_line(name, row):
+   return (f"{name:<16}{row['throughput']:>10.1f}{row['p50_ms']:>10.1f}"
+           f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['errors']:>8}")
+
+
+class Command(BaseCommand):
+   help = ("Drive the API routes in-process at a given concurrency and "
+           "report throughput and p50/p95/p99 latency per endpoint. Runs "
+           "against the configured database; the vote endpoint writes, so "
+           "point DATABASE_URL at a throwaway SQLite or Postgres database "
+           "filled by seed_data.")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS),
+                          default=list(ENDPOINTS))
+      parser.add_argument('--requests', type=int, default=500,
+                          help='Requests per endpoint')
+      parser.add_argument('--concurrency', type=int, default=8)
+      parser.add_argument('--warmup', type=int, default=20,
+                          help='Untimed requests per endpoint')
+      parser.add_argument('--actors', type=int, default=50,
+                          help='Number of users to send requests as')
+      parser.add_argument('--prefix', default='synthetic',
+                          help='Username prefix of the users to act as')
+      parser.add_argument('--seed', type=int, default=0)
+      parser.add_argument('--output', help='Write the results as JSON here')
+
+   def handle(self, *args, **options):
+      rng = random.Random(options['seed'])
+      context = load_context(options['prefix'], options['actors'])
+      total = options['requests']
+      concurrency = options['concurrency']
+      results = {}
+      self.stdout.write(f"{total} requests per endpoint, "
+                        f"{concurrency} concurrent")
+      self.stdout.write(f"{'endpoint':<16}{'req/s':>10}{'p50 ms':>10}"
+                        f"{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+      # The test client sends requests to the host "testserver". The
+      # throttle is off, or the runs would time its 429s and not the endpoints
+      with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            THROTTLE={**getattr(settings, 'THROTTLE', {}), 'ENABLED': False}):
+         for name in options['endpoints']:
+            if options['warmup']:
+               self.run(ENDPOINTS[name], context, options['warmup'],
+                        concurrency, rng.random())
+            results[name] = summarize(*self.run(
+               ENDPOINTS[name], context, total, concurrency, rng.random()))
+            self.stdout.write(result_line(name, results[name]))
+
+      if options['output']:
+         with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({
+               'started': timezone.now().isoformat(),
+               'database': connection.vendor,
+               'profiles': len(context['profile_ids']),
+               'concurrency': concurrency,
+               'requests': total,
+               'seed': options['seed'],
+               'endpoints': results,
+            }, f, indent=2, sort_keys=True)
+         self.stdout.write(f"Results written to {options['output']}")
+
+   @staticmethod
+   def run(build_request, context, total, concurrency, seed):
+      """Send `total` requests from `concurrency` threads"""
+      def worker(index, count):
+         samples = send(build_request, context,
+                        random.Random(f'{seed}-{index}'), count)
+         connections.close_all()
+         return samples
+
+      start = time.perf_counter()
+      with ThreadPoolExecutor(max_workers=concurrency) as pool:
+         batches = list(pool.map(worker, range(concurrency),
+                                 shares(total, concurrency)))
+      elapsed = time.perf_counter() - start
+      return [sample for batch in batches for sample in batch], elapsed
@@ -0,0 +1,108 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from BaseApp.matching import MatchFeatures, get_match_features, \
+    parse_weights, rank
+
+from .benchmark_load import percentile
+
+
+def random_features(profiles, tags, tags_per_profile, seed):
+   """MatchFeatures shaped like a large deployment, without a database"""
+   rng = np.random.default_rng(seed)
+   words = max(1, -(-tags // 64))
+   bitsets = np.zeros((profiles, words), dtype=np.uint64)
+   # Skewed towards the first tags, like real tag popularity
+   picks = np.minimum(rng.zipf(1.3, (profiles, tags_per_profile)), tags) - 1
+   rows = np.repeat(np.arange(profiles), tags_per_profile)
+   picks = picks.ravel()
+   np.bitwise_or.at(bitsets, (rows, picks // 64),
+                    np.left_shift(np.uint64(1),
+                                  (picks % 64).astype(np.uint64)))
+   experience = rng.integers(0, 40, profiles).astype(np.float32)
+   experience[rng.random(profiles) < 0.2] = np.nan
+   return MatchFeatures(
+      ids=np.arange(1, profiles + 1, dtype=np.int64),
+      user_types=rng.integers(0, 3, profiles, dtype=np.int8),
+      listed=rng.random(profiles) > 0.05,
+      tags=bitsets,
+      countries=rng.integers(-1, 50, profiles, dtype=np.int32),
+      states=rng.integers(-1, 500, profiles, dtype=np.int32),
+      cities=rng.integers(-1, 5000, profiles, dtype=np.int32),
+      experience=experience,
+      votes=np.round(rng.pareto(1.5, profiles) * 3).astype(np.float32),
+   )
+
+
+def time_ranking(features, viewers, weights, limit):
+   """Sorted milliseconds taken to rank for each viewer, after a warm-up"""
+   rank(features, viewers[0], weights, limit)
+   latencies = []
+   for viewer in viewers:
+      start = time.perf_counter()
+      rank(features, viewer, weights, limit)
+      latencies.append((time.perf_counter() - start) * 1000)
+   return sorted(latencies)
+
+
+class Command(BaseCommand):
+   help = ("Time MatchingEngine ranking for random viewers over synthetic "
+           "profiles, or over the database with --database")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--profiles', type=int, default=100000)
+      parser.add_argument('--tags', type=int, default=200)
+      parser.add_argument('--tags-per-profile', type=int, default=5)
+      parser.add_argument('--database', action='store_true',
+                          help='Rank the profiles in the database instead')
+      parser.add_argument('--rounds', type=int, default=200)
+      parser.add_argument('--limit', type=int, default=50)
+      parser.add_argument('--weights', default='',
+                          help='Scorer weights, e.g. "tags:1,votes:0.5"')
+      parser.add_argument('--budget-ms', type=float, default=50,
+                          help='Fail when p95 is slower than this')
+      parser.add_argument('--seed', type=int, default=0)
+      parser.add_argument('--output', help='Write the results as JSON')
+
+   def handle(self, *args, **options):
+      start = time.perf_counter()
+      if options['database']:
+         features = get_match_features(refresh=True)
+      else:
+         features = random_features(options['profiles'], options['tags'],
+                                    options['tags_per_profile'],
+                                    options['seed'])
+      load_ms = (time.perf_counter() - start) * 1000
+      weights = parse_weights(options['weights'])
+
+      viewers = np.random.default_rng(options['seed']).choice(
+         features.ids, options['rounds'])
+      latencies = time_ranking(features, viewers.tolist(), weights,
+                               options['limit'])
+
+      results = {
+         'profiles': len(features),
+         'load_ms': round(load_ms, 1),
+         'rounds': len(latencies),
+         'p50_ms': round(percentile(latencies, 50), 2),
+         'p95_ms': round(percentile(latencies, 95), 2),
+         'max_ms': round(latencies[-1], 2),
+      }
+      self.report(results, options['output'])
+      if results['p95_ms'] > options['budget_ms']:
+         self.stderr.write(self.style.ERROR(  # pylint: disable=no-member
+            f"p95 {results['p95_ms']} ms is over the "
+            f"{options['budget_ms']} ms budget"))
+         raise SystemExit(1)
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f"p95 within the {options['budget_ms']} ms budget"))
+
+   def report(self, results, output):
+      for name, value in results.items():
+         self.stdout.write(f'{name:<10}{value:>12}')
+      if output:
+         with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from BaseApp.directory_snapshot import build_snapshot, snapshot_settings
+
+
+class Command(BaseCommand):
+   help = ("Render the public profile directory into the snapshot served "
+           "to anonymous visitors, reusing the pages that haven't changed")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--full', action='store_true',
+                          help='Render every page again, e.g. after '
+                               'changing ProfileSerializer')
+
+   def handle(self, *args, **options):
+      if not snapshot_settings()['ROOT']:
+         raise CommandError('Set DIRECTORY_SNAPSHOT["ROOT"] (or '
+                            'DIRECTORY_SNAPSHOT_ROOT) to build a snapshot')
+      report = build_snapshot(None if options['full'] else ())
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f'Snapshot {report.generation}: {report.profiles} profiles, '
+         f'{report.rendered} pages rendered, {report.reused} reused'))
@@ -0,0 +1,67 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from BaseApp.geo import geo_settings
+
+COLUMNS = ['country', 'country_code', 'state', 'state_code', 'city',
+           'latitude', 'longitude']
+
+
+def read_tsv(path):
+   with open(path, encoding='utf-8', newline='') as f:
+      for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+         if row and not row[0].startswith('#'):
+            yield row
+
+
+def read_places(options):
+   """(country code, -population, gazetteer row) of each GeoNames city"""
+   # ISO code -> country name, "US.TN" -> state name
+   countries = {row[0]: row[4] for row in read_tsv(options['countries'])}
+   states = {row[0]: row[1] for row in read_tsv(options['admin1'])}
+   places = []
+   for row in read_tsv(options['cities']):
+      population = int(row[14] or 0)
+      if population < options['min_population']:
+         continue
+      code, admin1 = row[8], row[10]
+      # Only letter codes (US states, ...) are what people type
+      state_code = admin1 if admin1.isalpha() else ''
+      places.append((code, -population, [
+         countries.get(code, code), code,
+         states.get(f'{code}.{admin1}', ''), state_code, row[1],
+         row[4], row[5]]))
+   return places
+
+
+class Command(BaseCommand):
+   help = ("Write the geocoding gazetteer from the GeoNames dumps "
+           "citiesN.txt, admin1CodesASCII.txt and countryInfo.txt "
+           "(https://download.geonames.org/export/dump/)")
+
+   def add_arguments(self, parser):
+      parser.add_argument('cities', help='e.g. cities15000.txt')
+      parser.add_argument('admin1', help='admin1CodesASCII.txt')
+      parser.add_argument('countries', help='countryInfo.txt')
+      parser.add_argument('--min-population', type=int, default=0)
+      parser.add_argument('--output', default=geo_settings()['GAZETTEER'])
+
+   def handle(self, *args, **options):
+      try:
+         places = read_places(options)
+      except (OSError, IndexError, ValueError) as e:
+         raise CommandError(f'Could not read the GeoNames files: {e}') from e
+
+      # Most populous first within a country, which then stands in for its
+      # country and state
+      places.sort(key=lambda place: place[:2])
+      with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+         f.write('# Places profiles are geocoded against, see '
+                 'BaseApp/geo.py.\n# Data from GeoNames (CC BY 4.0).\n')
+         writer = csv.writer(f, delimiter='\t', lineterminator='\n',
+                             quoting=csv.QUOTE_NONE, escapechar='\\')
+         writer.writerow(COLUMNS)
+         writer.writerows(place for _, _, place in places)
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f"Wrote {len(places)} places to {options['output']}"))
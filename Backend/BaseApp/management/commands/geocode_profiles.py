@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from BaseApp.geo import geocode_profile
+from BaseApp.models import Profile
+
+
+class Command(BaseCommand):
+   help = ("Place profiles on the map from their city, state and country, "
+           "for profiles saved before geocoding or with bulk_create")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--all', action='store_true',
+                          help='Redo profiles that already have a location, '
+                               'e.g. after changing the gazetteer')
+      parser.add_argument('--batch-size', type=int, default=1000,
+                          help='Profiles updated per transaction')
+
+   def handle(self, *args, **options):
+      if options['batch_size'] < 1:
+         raise CommandError('--batch-size must be at least 1')
+      queryset = Profile.objects.only(
+         'pk', 'city', 'state', 'country').order_by('pk')
+      if not options['all']:
+         # Also picks up profiles placed before precision was recorded
+         queryset = queryset.filter(geo_precision__isnull=True)
+
+      last_pk = None
+      updated = located = 0
+      while True:
+         batch = queryset if last_pk is None \
+            else queryset.filter(pk__gt=last_pk)
+         profiles = list(batch[:options['batch_size']])
+         if not profiles:
+            break
+         for profile in profiles:
+            geocode_profile(profile)
+         with transaction.atomic():
+            Profile.objects.bulk_update(profiles, Profile.GEO_FIELDS)
+         last_pk = profiles[-1].pk
+         updated += len(profiles)
+         located += sum(1 for p in profiles if p.geo_cell is not None)
+
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f'Geocoded {updated} profiles, {located} found in the gazetteer'))
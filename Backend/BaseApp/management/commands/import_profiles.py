@@ -0,0 +1,88 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from BaseApp.importer import ProfileImporter, detect_format, read_rows
+
+
+def saved_row(state_file):
+   """The last row a previous run committed, or 0"""
+   if not os.path.exists(state_file):
+      return 0
+   with open(state_file, encoding='utf-8') as f:
+      return json.load(f)['last_row']
+
+
+class Progress:
+   """Saves new errors and the last committed row after every chunk"""
+
+   def __init__(self, stdout, errors_out, state_file):
+      self.stdout = stdout
+      self.errors_out = errors_out
+      self.state_file = state_file
+
+   def __call__(self, result):
+      # Dropped once written, so memory doesn't grow with the failures
+      for error in result.errors:
+         self.errors_out.write(json.dumps(error) + '\n')
+      self.errors_out.flush()
+      result.errors.clear()
+      with open(self.state_file + '.tmp', 'w', encoding='utf-8') as f:
+         json.dump({'last_row': result.last_row}, f)
+      os.replace(self.state_file + '.tmp', self.state_file)
+      self.stdout.write(
+         f"Row {result.last_row}: {result.created} created, "
+         f"{result.failed} failed")
+
+
+class Command(BaseCommand):
+   help = ("Bulk-create users and profiles from a CSV or NDJSON file. "
+           "Progress is saved after every chunk so the import can resume.")
+
+   def add_arguments(self, parser):
+      parser.add_argument('path', help='CSV or NDJSON file to import')
+      parser.add_argument('--format', choices=['csv', 'ndjson'],
+                          help='Defaults to the file extension')
+      parser.add_argument('--chunk-size', type=int, default=500,
+                          help='Rows written per transaction')
+      parser.add_argument('--workers', type=int, default=None,
+                          help='Password hashing processes (default: '
+                               'all cores)')
+      parser.add_argument('--state-file',
+                          help='Progress file (default: <path>.progress)')
+      parser.add_argument('--errors-file',
+                          help='Failed rows as NDJSON (default: '
+                               '<path>.errors.ndjson)')
+      parser.add_argument('--restart', action='store_true',
+                          help='Ignore saved progress and start over')
+
+   def handle(self, *args, **options):
+      path = options['path']
+      if not os.path.exists(path):
+         raise CommandError(f"File not found: {path}")
+      state_file = options['state_file'] or f"{path}.progress"
+      errors_file = options['errors_file'] or f"{path}.errors.ndjson"
+
+      start_after = 0 if options['restart'] else saved_row(state_file)
+      if start_after:
+         self.stdout.write(f"Resuming after row {start_after}")
+
+      mode = 'a' if start_after else 'w'
+      with open(errors_file, mode, encoding='utf-8') as errors_out:
+         result = self.run(path, options, start_after,
+                           Progress(self.stdout, errors_out, state_file))
+
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f"Imported {result.created} profiles from {result.rows} rows; "
+         f"{result.failed} failed (see {errors_file})"))
+
+   @staticmethod
+   def run(path, options, start_after, on_chunk):
+      fmt = options['format'] or detect_format(path)
+      with open(path, newline='', encoding='utf-8') as stream, \
+            ProfileImporter(chunk_size=options['chunk_size'],
+                            workers=options['workers'] or
+                            os.cpu_count()) as importer:
+         return importer.run(read_rows(stream, fmt), start_after=start_after,
+                             on_chunk=on_chunk)
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from BaseApp.startup import import_times, measure_cold_start
+
+
+class Command(BaseCommand):
+   help = ("Report what a cold import of saltnlight.wsgi spends its time "
+           "on, per module or per package, from python -X importtime")
+
+   def add_arguments(self, parser):
+      mode = parser.add_mutually_exclusive_group()
+      mode.add_argument('--api-only', dest='api_only', action='store_true',
+                        default=None, help='Profile DJANGO_API_ONLY=true')
+      mode.add_argument('--full', dest='api_only', action='store_false',
+                        help='Profile the full site')
+      parser.add_argument('--depth', type=int, default=0,
+                          help='Group modules by their first N name parts '
+                               '(0 lists single modules)')
+      parser.add_argument('--top', type=int, default=30)
+      parser.add_argument('--output', help='Write the full report as JSON')
+
+   def handle(self, *args, **options):
+      total_ms = measure_cold_start(options['api_only'])
+      times = import_times(options['api_only'])
+      ordered = ordered_rows(times, options['depth'])
+
+      self.stdout.write(f"Cold start: {total_ms:.0f} ms, "
+                        f"{len(times)} modules imported")
+      self.stdout.write(f"{'module':<56}{'self ms':>10}{'cumul. ms':>11}")
+      for name, (self_us, cumulative_us) in ordered[:options['top']]:
+         cumulative = '' if cumulative_us is None \
+            else f'{cumulative_us / 1000:.1f}'
+         self.stdout.write(f"{name:<56}{self_us / 1000:>10.1f}"
+                           f"{cumulative:>11}")
+
+      if options['output']:
+         write_report(options['output'], total_ms, ordered)
+         self.stdout.write(f"Report written to {options['output']}")
+
+def ordered_rows(times, depth):
+   """(name, (self us, cumulative us)) rows, slowest first"""
+   if not depth:
+      return sorted(times.items(), key=lambda row: -row[1][1])
+   # Only self times add up; cumulative times overlap
+   groups = {}
+   for module, (self_us, _) in times.items():
+      group = '.'.join(module.split('.')[:depth])
+      groups[group] = groups.get(group, 0) + self_us
+   return sorted(((group, (self_us, None))
+                  for group, self_us in groups.items()),
+                 key=lambda row: -row[1][0])
+
+
+def write_report(path, total_ms, ordered):
+   with open(path, 'w', encoding='utf-8') as f:
+      json.dump({
+         'cold_start_ms': round(total_ms, 1),
+         'modules': {name: {'self_us': self_us,
+                            'cumulative_us': cumulative_us}
+                     for name, (self_us, cumulative_us) in ordered},
+      }, f, indent=2)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from BaseApp.retention import apply_policy, get_policies
+
+
+def summary(report, dry_run):
+   verb = 'would remove' if dry_run else 'removed'
+   line = (f"{report.name}: {verb} {report.rows} rows "
+           f"(~{report.bytes} bytes) in {report.batches} batches")
+   if report.archived_bytes:
+      line += f", archived {report.archived_bytes} compressed bytes"
+   return line
+
+
+class Command(BaseCommand):
+   help = ("Prune old notifications and search history according to "
+           "settings.RETENTION_POLICIES, in small batches")
+
+   def add_arguments(self, parser):
+      parser.add_argument(
+         '--policy', action='append', dest='policies',
+         help='Only run the named policy (may be repeated)')
+      parser.add_argument(
+         '--batch-size', type=int, default=1000,
+         help='Rows deleted per transaction')
+      parser.add_argument(
+         '--archive-dir',
+         help='Write removed rows to gzipped NDJSON files in this directory')
+      parser.add_argument(
+         '--pause', type=float, default=0.0,
+         help='Seconds to sleep between batches')
+      parser.add_argument(
+         '--dry-run', action='store_true',
+         help='Report what would be removed without deleting anything')
+
+   def handle(self, *args, **options):
+      if options['batch_size'] < 1:
+         raise CommandError('--batch-size must be at least 1')
+      try:
+         policies = get_policies(options['policies'])
+      except ValueError as e:
+         raise CommandError(str(e)) from e
+
+      reports = []
+      for policy in policies:
+         reports.append(apply_policy(
+            policy,
+            batch_size=options['batch_size'],
+            archive_dir=options['archive_dir'],
+            dry_run=options['dry_run'],
+            pause=options['pause'],
+         ))
+         self.stdout.write(summary(reports[-1], options['dry_run']))
+
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f"Total: {sum(report.rows for report in reports)} rows, "
+         f"~{sum(report.bytes for report in reports)} bytes"))
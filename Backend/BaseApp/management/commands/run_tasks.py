@@ -0,0 +1,73 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from BaseApp.task_queue import run_ready
+from BaseApp.task_worker import init_worker, run_group_in_worker
+
+# Modules whose @task handlers the worker can run
+TASK_MODULES = ['BaseApp.tasks', 'BaseApp.pagination']
+
+
+class Command(BaseCommand):
+   help = ("Run queued background tasks from the Task table until "
+           "stopped, or until the queue is empty with --once. Deploy it "
+           "with TASK_WORKER=true, so requests stop running tasks inline")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--workers', type=int, default=4)
+      parser.add_argument('--pool', choices=['thread', 'process'],
+                          default='thread',
+                          help='Use processes for CPU-bound handlers')
+      parser.add_argument('--batch-size', type=int, default=100,
+                          help='Tasks claimed per round')
+      parser.add_argument('--poll-interval', type=float, default=1.0,
+                          help='Seconds to wait when the queue is empty')
+      parser.add_argument('--names', nargs='+',
+                          help='Only run tasks with these names')
+      parser.add_argument('--once', action='store_true',
+                          help='Exit once no task is ready')
+
+   def handle(self, *args, **options):
+      init_worker(TASK_MODULES)
+      stopping = False
+
+      def stop(signum, frame):  # pylint: disable=unused-argument
+         nonlocal stopping
+         stopping = True
+         self.stdout.write("Finishing the current round, then stopping")
+      signal.signal(signal.SIGTERM, stop)
+      signal.signal(signal.SIGINT, stop)
+
+      if options['pool'] == 'process':
+         # Children must not share the parent's database connections
+         connections.close_all()
+         executor = ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(TASK_MODULES,))
+      else:
+         executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+      totals = [0, 0, 0]
+      with executor:
+         while not stopping:
+            claimed, done, failed = run_ready(
+               options['batch_size'], options['names'], executor,
+               run_group_in_worker)
+            totals = [a + b for a, b in zip(totals, (claimed, done, failed))]
+            if claimed:
+               self.stdout.write(f"Claimed {claimed}: {done} done, "
+                                 f"{failed} failed, "
+                                 f"{claimed - done - failed} to retry")
+            elif options['once']:
+               break
+            else:
+               time.sleep(options['poll_interval'])
+
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         f"Ran {totals[0]} tasks: {totals[1]} done, {totals[2]} failed"))
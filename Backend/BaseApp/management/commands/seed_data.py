@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from BaseApp.synthetic import DEFAULT_SIZES, SyntheticDataset
+
+
+class Command(BaseCommand):
+   help = ("Generate a deterministic synthetic dataset of users, profiles, "
+           "tags, votes, comments, friendships and notifications for load "
+           "testing. The same --seed and sizes give the same data.")
+
+   def add_arguments(self, parser):
+      parser.add_argument('--users', type=int, default=1000)
+      parser.add_argument('--seed', type=int, default=0)
+      parser.add_argument('--prefix', default='synthetic',
+                          help='Username prefix of the generated users')
+      parser.add_argument('--password', default='synthetic-password',
+                          help='Password shared by every generated user')
+      parser.add_argument('--batch-size', type=int, default=1000)
+      parser.add_argument('--tags-per-profile', type=int, default=4)
+      parser.add_argument('--votes-per-user', type=int, default=10)
+      parser.add_argument('--comment-ratio', type=float, default=0.3,
+                          help='Share of votes that also get a comment')
+      parser.add_argument('--friends-per-user', type=int, default=6)
+      parser.add_argument('--notifications-per-user', type=int, default=5)
+      parser.add_argument('--flush', action='store_true',
+                          help='Delete users with the prefix first')
+
+   def handle(self, *args, **options):
+      try:
+         dataset = SyntheticDataset(
+            users=options['users'], seed=options['seed'],
+            prefix=options['prefix'], password=options['password'],
+            **{name: options[name] for name in DEFAULT_SIZES})
+      except ValueError as e:
+         raise CommandError(str(e)) from e
+
+      existing = dataset.existing_users()
+      if existing.exists():
+         if not options['flush']:
+            raise CommandError(
+               f"Users prefixed \"{options['prefix']}\" already exist; "
+               f"pass --flush to replace them")
+         deleted, _ = existing.delete()
+         self.stdout.write(f"Deleted {deleted} rows of earlier data")
+
+      counts = dataset.generate(log=self.stdout.write)
+      self.stdout.write(self.style.SUCCESS(  # pylint: disable=no-member
+         'Generated ' + ', '.join(f'{count} {name}'
+                                  for name, count in counts.items())))
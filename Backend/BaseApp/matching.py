@@ -0,0 +1,285 @@
+"""
+Ranks matchmaking candidates by a weighted blend of scorers evaluated over
+every profile at once. Profile features live in columnar NumPy arrays
+(tag bitsets, encoded locations, experience, vote score) that each worker
+process loads from the database and reloads every MATCHING['TTL']
+seconds, like the friend graph.
+
+A scorer takes a MatchQuery and returns one float per profile, ideally in
+[0, 1]; register new ones with @scorer('name') and give them a weight in
+MATCHING['WEIGHTS'] or ?weights=name:1.5 on the request.
+"""
+import threading
+import time
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, IntegerField, Sum, Value, When
+
+from .models import Profile, ProfileTagging, ProfileVote
+
+DEFAULT_MATCHING = {
+   'WEIGHTS': {'tags': 0.5, 'location': 0.2, 'experience': 0.1,
+               'votes': 0.2},
+   'TTL': 60,
+   'LIMIT': 50,
+   'MAX_LIMIT': 200,
+}
+
+# name -> function(query) returning a float array over all profiles
+scorers = {}
+
+USER_TYPES = ('missionary', 'supporter', 'other')
+# Years of experience apart at which the experience score halves
+EXPERIENCE_HALF_LIFE = 5.0
+# Vote score at which the votes score reaches about 0.88
+VOTE_SCALE = 10.0
+
+
+def matching_settings():
+   return {**DEFAULT_MATCHING, **getattr(settings, 'MATCHING', {})}
+
+
+def scorer(name):
+   def register(func):
+      scorers[name] = func
+      return func
+   return register
+
+
+# One array per feature, so scorers read them as columns
+class MatchFeatures:  # pylint: disable=too-many-instance-attributes
+   """
+   One row per profile. Locations are encoded as integer ids (-1 when
+   blank), tags as bitsets of uint64 words, missing experience as NaN.
+   """
+
+   def __init__(self, ids, user_types, listed, tags, countries, states,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                cities, experience, votes):
+      self.ids = ids
+      self.user_types = user_types
+      self.listed = listed
+      self.tags = tags
+      self.countries = countries
+      self.states = states
+      self.cities = cities
+      self.experience = experience
+      self.votes = votes
+      self.rows = {int(profile_id): row
+                   for row, profile_id in enumerate(ids.tolist())}
+
+   def __len__(self):
+      return len(self.ids)
+
+   @classmethod
+   def from_database(cls):
+      profiles = list(Profile.objects.values_list(
+         'user_id', 'user_type', 'is_anonymous', 'country', 'state', 'city',
+         'years_of_experience').order_by('user_id'))
+      ids = np.fromiter((p[0] for p in profiles), dtype=np.int64,
+                        count=len(profiles))
+      rows = {profile_id: row for row, profile_id in enumerate(ids.tolist())}
+      return cls(
+         ids=ids,
+         user_types=np.array([encode_user_type(p[1]) for p in profiles],
+                             dtype=np.int8),
+         listed=np.array([not p[2] for p in profiles], dtype=bool),
+         tags=load_tags(rows),
+         countries=encode_labels(p[3] for p in profiles),
+         states=encode_labels(p[4] for p in profiles),
+         cities=encode_labels(p[5] for p in profiles),
+         experience=np.array([np.nan if p[6] is None else p[6]
+                              for p in profiles], dtype=np.float32),
+         votes=load_votes(rows),
+      )
+
+
+def load_tags(rows):
+   """Tag bitsets for the profiles in `rows` (profile id -> row)"""
+   # Taggings of profiles created since the profiles were read are left
+   # for the next reload
+   pairs = [(rows[profile_id], tag_id) for profile_id, tag_id in
+            ProfileTagging.objects.values_list('profile_id', 'tag_id')
+            if profile_id in rows]
+   tag_bits = {tag_id: bit for bit, tag_id in
+               enumerate(sorted({tag_id for _, tag_id in pairs}))}
+   tags = np.zeros((len(rows), max(1, -(-len(tag_bits) // 64))),
+                   dtype=np.uint64)
+   if pairs:
+      tag_rows = np.array([row for row, _ in pairs])
+      bits = np.array([tag_bits[tag_id] for _, tag_id in pairs])
+      np.bitwise_or.at(tags, (tag_rows, bits // 64),
+                       np.left_shift(np.uint64(1),
+                                     (bits % 64).astype(np.uint64)))
+   return tags
+
+
+def load_votes(rows):
+   """Upvotes minus downvotes of the profiles in `rows`"""
+   votes = np.zeros(len(rows), dtype=np.float32)
+   totals = ProfileVote.objects.values_list('profile_id').annotate(
+      score=Sum(Case(When(is_upvote=True, then=Value(1)), default=-1,
+                     output_field=IntegerField())))
+   for profile_id, score in totals:
+      if profile_id in rows:
+         votes[rows[profile_id]] = score
+   return votes
+
+
+def encode_user_type(user_type):
+   return USER_TYPES.index(user_type) if user_type in USER_TYPES else -1
+
+
+def encode_labels(values):
+   """Integer ids for free-text labels, compared case-insensitively"""
+   codes = {}
+   encoded = []
+   for value in values:
+      value = (value or '').strip().lower()
+      encoded.append(codes.setdefault(value, len(codes)) if value else -1)
+   return np.array(encoded, dtype=np.int32)
+
+
+class MatchQuery:
+   """The features and the viewer's row; shared work is computed once"""
+
+   def __init__(self, features, row):
+      self.features = features
+      self.row = row
+
+   @cached_property
+   def shared_tags(self):
+      features = self.features
+      return np.bitwise_count(features.tags & features.tags[self.row]) \
+         .sum(axis=1, dtype=np.int32)
+
+   @cached_property
+   def viewer_tag_count(self):
+      return int(np.bitwise_count(self.features.tags[self.row]).sum())
+
+
+@scorer('tags')
+def tag_overlap(query):
+   # Share of the viewer's tags the candidate also has
+   return query.shared_tags / max(query.viewer_tag_count, 1)
+
+
+@scorer('location')
+def same_location(query):
+   # A third each for the same country, state and city, outermost first
+   f, row = query.features, query.row
+   country = (f.countries == f.countries[row]) & (f.countries[row] >= 0)
+   state = country & (f.states == f.states[row]) & (f.states[row] >= 0)
+   city = state & (f.cities == f.cities[row]) & (f.cities[row] >= 0)
+   return (country.astype(np.float32) + state + city) / 3
+
+
+@scorer('experience')
+def experience_fit(query):
+   # 1 for the viewer's own experience, halving every EXPERIENCE_HALF_LIFE
+   # years apart; 0 when either side left it blank
+   f = query.features
+   gap = np.abs(f.experience - f.experience[query.row])
+   return np.nan_to_num(np.exp2(-gap / EXPERIENCE_HALF_LIFE), nan=0.0)
+
+
+@scorer('votes')
+def vote_score(query):
+   votes = query.features.votes
+   return np.tanh(np.maximum(votes, 0) / VOTE_SCALE)
+
+
+def parse_weights(value):
+   """Parse "tags:1,location:0.5" into a dict; raises ValueError"""
+   weights = {}
+   for item in filter(None, (value or '').split(',')):
+      name, _, weight = item.partition(':')
+      name = name.strip()
+      if name not in scorers:
+         raise ValueError(f'Unknown scorer "{name}"; '
+                          f'choose from {", ".join(sorted(scorers))}')
+      weights[name] = float(weight)
+      if not np.isfinite(weights[name]):
+         raise ValueError(f'Weight for "{name}" must be a finite number')
+   return weights
+
+
+def rank(features, profile_id, weights=None, limit=None):
+   """
+   Return [(profile_id, score)] of the best `limit` matches for a profile:
+   listed profiles of another user_type that share at least one tag,
+   ordered by their weighted score.
+   """
+   config = matching_settings()
+   weights = {**config['WEIGHTS'], **(weights or {})}
+   limit = limit or config['LIMIT']
+   row = features.rows.get(profile_id)
+   if row is None:
+      return []
+
+   query = MatchQuery(features, row)
+   eligible = features.listed & (query.shared_tags > 0) & \
+      (features.user_types != features.user_types[row])
+   eligible[row] = False
+   candidates = np.flatnonzero(eligible)
+   if candidates.size == 0:
+      return []
+   return best(features, candidates,
+               weighted_scores(query, weights)[candidates], limit)
+
+
+def weighted_scores(query, weights):
+   scores = np.zeros(len(query.features), dtype=np.float32)
+   for name, weight in weights.items():
+      if weight:
+         scores += np.float32(weight) * scorers[name](query)
+   return scores
+
+
+def best(features, candidates, scores, limit):
+   """The `limit` best scoring candidates as [(profile_id, score)]"""
+   if len(candidates) > limit:
+      top = np.argpartition(-scores, limit - 1)[:limit]
+      candidates, scores = candidates[top], scores[top]
+   # Best score first, lower profile id first on ties
+   order = np.lexsort((features.ids[candidates], -scores))
+   return [(int(features.ids[i]), float(scores[j]))
+           for i, j in zip(candidates[order], order)]
+
+
+_features = None
+_features_built_at = 0.0
+_features_lock = threading.Lock()
+
+
+def get_match_features(refresh=False):
+   """
+   Return this process's features, loading them on first use, when
+   MATCHING['TTL'] seconds have passed, or when refresh is set.
+   """
+   global _features, _features_built_at  # pylint: disable=global-statement
+   ttl = matching_settings()['TTL']
+   if not refresh and _features is not None and \
+         time.monotonic() - _features_built_at < ttl:
+      return _features
+   with _features_lock:
+      if refresh or _features is None or \
+            time.monotonic() - _features_built_at >= ttl:
+         _features = MatchFeatures.from_database()
+         _features_built_at = time.monotonic()
+   return _features
+
+
+def reset_match_features():
+   global _features  # pylint: disable=global-statement
+   with _features_lock:
+      _features = None
+
+
+def rank_profiles(profile_id, weights=None, limit=None):
+   features = get_match_features()
+   if profile_id not in features.rows:
+      # A profile created since the features were loaded
+      features = get_match_features(refresh=True)
+   return rank(features, profile_id, weights, limit)
@@ -0,0 +1,339 @@
+"""
+Per-request instrumentation: query count, DB time, serialization time and
+total time for every request, reported in a Server-Timing header and
+aggregated into per-route histograms served at /metrics. Scrapes need
+REQUEST_METRICS['TOKEN'] as a bearer token, or a staff session or JWT.
+
+Each thread writes only to its own shard of counters, so recording a
+request never takes a lock. A scrape sums the shards. The numbers are per
+process, as Prometheus expects from multi-worker servers.
+"""
+import hmac
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, \
+   sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+HISTOGRAMS = {
+   'request_duration_seconds': ('Total request time', SECONDS_BUCKETS),
+   'request_db_seconds': ('Time spent in database queries', SECONDS_BUCKETS),
+   'request_serialize_seconds': ('Time spent rendering the response body',
+                                 SECONDS_BUCKETS),
+   'request_db_queries': ('Database queries per request', QUERY_BUCKETS),
+}
+PREFIX = 'saltnlight_'
+
+
+def metrics_settings():
+   return {
+      'SLOW_REQUEST_MS': 500,
+      'SLOW_LOG_SAMPLE_RATE': 0.1,
+      'SLOW_LOG_QUERIES': 5,
+      # Without one only staff may scrape
+      'TOKEN': None,
+      **getattr(settings, 'REQUEST_METRICS', {}),
+   }
+
+
+class Shard:
+   """Counters written by a single thread"""
+
+   def __init__(self):
+      # (route, method) -> {histogram: [count, sum, *bucket counts]}
+      self.histograms = {}
+      # (route, method, status) -> count
+      self.requests = {}
+
+   def observe(self, key, name, value):
+      buckets = HISTOGRAMS[name][1]
+      series = self.histograms.setdefault(key, {})
+      values = series.get(name)
+      if values is None:
+         values = series[name] = [0, 0] + [0] * len(buckets)
+      values[0] += 1
+      values[1] += value
+      index = bisect_left(buckets, value)
+      if index < len(buckets):
+         values[2 + index] += 1
+
+
+class Registry:
+   def __init__(self):
+      self._local = threading.local()
+      self._shards = []
+      self._lock = threading.Lock()
+
+   @property
+   def shard(self):
+      shard = getattr(self._local, 'shard', None)
+      if shard is None:
+         # Taken once per thread, never on the request path after that
+         shard = self._local.shard = Shard()
+         with self._lock:
+            self._shards.append(shard)
+      return shard
+
+   def record(self, route, method, status, timings):
+      shard = self.shard
+      key = (route, method)
+      status_key = (route, method, status)
+      shard.requests[status_key] = shard.requests.get(status_key, 0) + 1
+      shard.observe(key, 'request_duration_seconds', timings.total)
+      shard.observe(key, 'request_db_seconds', timings.db_time)
+      shard.observe(key, 'request_serialize_seconds', timings.serialize)
+      shard.observe(key, 'request_db_queries', timings.queries)
+
+   def collect(self):
+      """Sum every shard into (requests, histograms)"""
+      requests, histograms = {}, {}
+      with self._lock:
+         shards = list(self._shards)
+      for shard in shards:
+         for key, count in list(shard.requests.items()):
+            requests[key] = requests.get(key, 0) + count
+         for key, series in list(shard.histograms.items()):
+            merge_series(histograms.setdefault(key, {}), series)
+      return requests, histograms
+
+   def reset(self):
+      with self._lock:
+         self._shards = []
+      self._local = threading.local()
+
+
+def merge_series(merged, series):
+   for name, values in list(series.items()):
+      total = merged.setdefault(name, [0] * len(values))
+      for i, value in enumerate(values):
+         total[i] += value
+
+
+registry = Registry()
+
+
+class RequestTimings:
+   """Wraps every query on the request's thread to count and time it"""
+
+   def __init__(self):
+      self.queries = 0
+      self.db_time = 0.0
+      self.serialize = 0.0
+      self.total = 0.0
+      self.timed_queries = []
+
+   # The signature Django calls execute wrappers with
+   def __call__(self, execute, sql, params, many, context):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+      start = time.perf_counter()
+      try:
+         return execute(sql, params, many, context)
+      finally:
+         elapsed = time.perf_counter() - start
+         self.queries += 1
+         self.db_time += elapsed
+         self.timed_queries.append((elapsed, sql))
+
+   def server_timing(self):
+      return ', '.join([
+         f'db;desc="{self.queries} queries";dur={self.db_time * 1000:.2f}',
+         f'serialize;dur={self.serialize * 1000:.2f}',
+         f'total;dur={self.total * 1000:.2f}',
+      ])
+
+
+def route_label(request):
+   match = getattr(request, 'resolver_match', None)
+   if match is None:
+      return '<unmatched>'
+   # Router patterns are regexes, e.g. '^tag/(?P<pk>[^/.]+)/$'
+   route = re.sub(r'\(\?P<(\w+)>[^)]*\)', r'<\1>', match.route)
+   return '/' + route.replace('^', '').replace('$', '')
+
+
+def watch_queries(timings):
+   """Time the queries of this thread's connections until unwatch_queries"""
+   wrappers = ExitStack()
+   for connection in connections.all():
+      wrappers.enter_context(connection.execute_wrapper(timings))
+   return wrappers
+
+
+def unwatch_queries(wrappers):
+   wrappers.close()
+
+
+class RequestMetricsMiddleware:
+   """
+   Put first in MIDDLEWARE so the total covers the rest of the stack.
+   Serialization time is the time DRF and template responses spend
+   rendering their body. Runs async under ASGI, so async views aren't
+   pushed into a thread.
+   """
+   sync_capable = True
+   async_capable = True
+
+   def __init__(self, get_response):
+      self.get_response = get_response
+      if iscoroutinefunction(get_response):
+         markcoroutinefunction(self)
+
+   def __call__(self, request):
+      if iscoroutinefunction(self):
+         return self.__acall__(request)
+      timings = request.request_timings = RequestTimings()
+      wrappers = watch_queries(timings)
+      start = time.perf_counter()
+      try:
+         response = self.get_response(request)
+      finally:
+         unwatch_queries(wrappers)
+      return self.record(request, response, timings, start)
+
+   async def __acall__(self, request):
+      timings = request.request_timings = RequestTimings()
+      # Connections belong to a thread; the async ORM and sync views of
+      # this request share the one thread_sensitive calls run on
+      wrappers = await sync_to_async(watch_queries)(timings)
+      start = time.perf_counter()
+      try:
+         response = await self.get_response(request)
+      finally:
+         await sync_to_async(unwatch_queries)(wrappers)
+      return self.record(request, response, timings, start)
+
+   def record(self, request, response, timings, start):
+      timings.total = time.perf_counter() - start
+      route = route_label(request)
+      response['Server-Timing'] = timings.server_timing()
+      registry.record(route, request.method, response.status_code, timings)
+      self.log_if_slow(request, route, timings)
+      return response
+
+   def process_template_response(self, request, response):
+      # Called right before the response is rendered
+      timings = getattr(request, 'request_timings', None)
+      if timings is not None:
+         start = time.perf_counter()
+
+         def rendered(_response):
+            timings.serialize += time.perf_counter() - start
+         response.add_post_render_callback(rendered)
+      return response
+
+   @staticmethod
+   def log_if_slow(request, route, timings):
+      config = metrics_settings()
+      if timings.total * 1000 < config['SLOW_REQUEST_MS'] or \
+            random.random() >= config['SLOW_LOG_SAMPLE_RATE']:
+         return
+      slowest = sorted(timings.timed_queries, key=lambda query: query[0],
+                       reverse=True)[:config['SLOW_LOG_QUERIES']]
+      logger.warning(
+         "Slow request %s %s (%s): %.0f ms total, %d queries in %.0f ms, "
+         "%.0f ms serializing. Slowest queries:\n%s",
+         request.method, request.path, route, timings.total * 1000,
+         timings.queries, timings.db_time * 1000, timings.serialize * 1000,
+         '\n'.join(f'  {elapsed * 1000:.1f} ms: {sql}'
+                   for elapsed, sql in slowest))
+
+
+def escape_label(value):
+   return str(value).replace('\\', r'\\').replace('"', r'\"') \
+      .replace('\n', r'\n')
+
+
+def histogram_lines(name, buckets, histograms):
+   for (route, method), series in sorted(histograms.items()):
+      if name in series:
+         labels = f'route="{escape_label(route)}",method="{method}"'
+         yield from series_lines(f'{PREFIX}{name}', labels, buckets,
+                                 series[name])
+
+
+def series_lines(name, labels, buckets, values):
+   count, total, *counts = values
+   cumulative = 0
+   for bound, bucket_count in zip(buckets, counts):
+      cumulative += bucket_count
+      yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+   yield f'{name}_bucket{{{labels},le="+Inf"}} {count}'
+   yield f'{name}_sum{{{labels}}} {total:.6g}'
+   yield f'{name}_count{{{labels}}} {count}'
+
+
+def cache_lines():
+   for alias in settings.CACHES:
+      stats = getattr(caches[alias], 'stats', None)
+      if stats is None:
+         continue
+      for event, count in sorted(stats().items()):
+         if not event.endswith('_entries'):
+            yield (f'{PREFIX}cache_events_total{{cache="{alias}",'
+                   f'event="{event}"}} {count}')
+
+
+def render_metrics():
+   """The registry in the Prometheus text exposition format"""
+   requests, histograms = registry.collect()
+   lines = [f'# HELP {PREFIX}requests_total Requests by route and status',
+            f'# TYPE {PREFIX}requests_total counter']
+   for (route, method, status), count in sorted(requests.items()):
+      lines.append(f'{PREFIX}requests_total{{route="{escape_label(route)}",'
+                   f'method="{method}",status="{status}"}} {count}')
+
+   for name, (description, buckets) in HISTOGRAMS.items():
+      lines += [f'# HELP {PREFIX}{name} {description}',
+                f'# TYPE {PREFIX}{name} histogram']
+      lines += histogram_lines(name, buckets, histograms)
+
+   lines += [f'# HELP {PREFIX}cache_events_total Cache hits, misses and '
+             f'evictions of this process by cache and tier',
+             f'# TYPE {PREFIX}cache_events_total counter']
+   lines += cache_lines()
+   return '\n'.join(lines) + '\n'
+
+
+def is_staff(request):
+   user = getattr(request, 'user', None)
+   if user is not None and user.is_staff:
+      return True
+   # Not a DRF view, so JWTs aren't looked at otherwise
+   try:
+      authenticated = CachedJWTAuthentication().authenticate(request)
+   except AuthenticationFailed:
+      return False
+   return authenticated is not None and authenticated[0].is_staff
+
+
+def scrape_allowed(request):
+   token = metrics_settings()['TOKEN']
+   if token and hmac.compare_digest(
+         request.headers.get('Authorization', '').encode(),
+         f'Bearer {token}'.encode()):
+      return True
+   return is_staff(request)
+
+
+def metrics_view(request):
+   if not scrape_allowed(request):
+      return HttpResponse('Unauthorized\n', status=401,
+                          content_type='text/plain')
+   return HttpResponse(render_metrics(),
+                       content_type='text/plain; version=0.0.4')
@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .geo import PRECISIONS, geocode_profile
 
 # Defines the Tag table
 
@@ -32,14 +35,32 @@ class Profile(models.Model):
    years_of_experience = models.IntegerField(blank=True, null=True)
    description = models.TextField(blank=True, null=True)
    is_anonymous = models.BooleanField(default=False)
+   # Set from city/state/country on save, see BaseApp/geo.py
+   latitude = models.FloatField(blank=True, null=True, editable=False)
+   longitude = models.FloatField(blank=True, null=True, editable=False)
+   geo_cell = models.IntegerField(blank=True, null=True, editable=False,
+                                  db_index=True)
+   geo_precision = models.CharField(max_length=7, choices=PRECISIONS,
+                                    blank=True, null=True, editable=False)
 
    # Tags with additional metadata through the intermediate model
    tags = models.ManyToManyField(Tag, through='ProfileTagging',
                                  related_name='profiles', blank=True)
 
+   LOCATION_FIELDS = {'city', 'state', 'country'}
+   GEO_FIELDS = {'latitude', 'longitude', 'geo_cell', 'geo_precision'}
+
    def __str__(self):
       return f"{self.user.username} - {self.user_type}"  # pylint: disable=no-member
 
+   def save(self, *args, **kwargs):
+      update_fields = kwargs.get('update_fields')
+      if update_fields is None or self.LOCATION_FIELDS & set(update_fields):
+         geocode_profile(self)
+         if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *self.GEO_FIELDS}
+      super().save(*args, **kwargs)
+
 
 # Defines Search History table
 class SearchHistory(models.Model):
@@ -51,6 +72,11 @@ class SearchHistory(models.Model):
    # Overwrites the automatic plural form of words in admin
    class Meta:
       verbose_name_plural = "Search History"
+      indexes = [
+         # A user's searches by age, which retention walks behind a cutoff
+         models.Index(fields=['user', 'search_time', 'id'],
+                      name='search_user_time_idx'),
+      ]
 
 
 # Defines External Media table
@@ -63,6 +89,11 @@ class ExternalMedia(models.Model):
    # Overwrites the automatic plural form of words in admin
    class Meta:
       verbose_name_plural = "External Media"
+      indexes = [
+         # A profile's media feed, newest first, and its keyset cursor
+         models.Index(fields=['user', 'uploaded_at', 'id'],
+                      name='media_user_uploaded_idx'),
+      ]
 
 
 class ProfileVote(models.Model):
@@ -95,6 +126,16 @@ class ProfileComment(models.Model):
    class Meta:
       # Ensures one comment per user per profile
       unique_together = ('commenter', 'profile')
+      indexes = [
+         # Admin list order, date range filter and keyset cursor
+         models.Index(fields=['created_at', 'id'],
+                      name='comment_created_idx'),
+         # Admin filters by commenter or profile, newest first
+         models.Index(fields=['commenter', 'created_at'],
+                      name='comment_commenter_idx'),
+         models.Index(fields=['profile', 'created_at'],
+                      name='comment_profile_idx'),
+      ]
 
    def clean(self):
       if self.commenter == self.profile.user:  # pylint: disable=no-member
@@ -144,6 +185,11 @@ class Notification(models.Model):
 
    class Meta:
       ordering = ['-created_at']
+      indexes = [
+         # Covers the unread badge count and the recipient's feed
+         models.Index(fields=['recipient', 'is_read', 'created_at'],
+                      name='notif_recipient_read_idx'),
+      ]
 
    def __str__(self):
       return (f"{self.notification_type} notification for"  # pylint:disable=no-member
@@ -167,5 +213,58 @@ class Friendship(models.Model):
               f"{self.receiver.username} ({self.status})"  # pylint: disable=no-member
               )
 
+   @classmethod
+   def between(cls, user_id, other_id):
+      # Both directions in one range scan of the (sender, receiver) index
+      pair = [user_id, other_id]
+      return cls.objects.filter(sender_id__in=pair, receiver_id__in=pair) \
+         .exclude(sender_id=models.F('receiver_id'))
+
    class Meta:
       ordering = ['-created_at']
+      constraints = [
+         models.UniqueConstraint(fields=['sender', 'receiver'],
+                                 name='unique_friendship_pair'),
+      ]
+      indexes = [
+         models.Index(fields=['receiver', 'status'],
+                      name='friendship_receiver_idx'),
+      ]
+
+
+# Background work queued by requests and run by `manage.py run_tasks`,
+# see BaseApp/task_queue.py
+class Task(models.Model):
+   QUEUED = 'queued'
+   RUNNING = 'running'
+   DONE = 'done'
+   FAILED = 'failed'
+
+   name = models.CharField(max_length=100)
+   payload = models.JSONField(default=dict)
+   # Enqueueing the same key twice keeps only the first task
+   idempotency_key = models.CharField(max_length=200, unique=True,
+                                      null=True, blank=True)
+   status = models.CharField(max_length=10, default=QUEUED,
+                             choices=[(QUEUED, 'Queued'),
+                                      (RUNNING, 'Running'),
+                                      (DONE, 'Done'),
+                                      (FAILED, 'Failed')])
+   attempts = models.PositiveIntegerField(default=0)
+   max_attempts = models.PositiveIntegerField(default=5)
+   run_after = models.DateTimeField(default=timezone.now)
+   # Set while running; a task whose lease ran out is picked up again
+   claimed_by = models.CharField(max_length=36, null=True, blank=True)
+   locked_until = models.DateTimeField(null=True, blank=True)
+   last_error = models.TextField(blank=True)
+   created_at = models.DateTimeField(auto_now_add=True)
+   finished_at = models.DateTimeField(null=True, blank=True)
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['status', 'run_after'],
+                      name='task_ready_idx'),
+      ]
+
+   def __str__(self):
+      return f"{self.name} task #{self.pk} ({self.status})"
@@ -0,0 +1,256 @@
+"""
+Pagination for large admin lists. PageNumberPagination runs an exact
+COUNT(*) and an OFFSET scan on every page, both of which grow with the
+table. KeysetPagination instead moves through the list with a cursor on
+its ordering columns, so every page costs the same, and reports a count
+that is only exact below ADMIN_COUNTS['EXACT_THRESHOLD']:
+
+   - below the threshold, a COUNT capped at threshold + 1 rows;
+   - for a whole table, an exact count taken by the recount_table task
+     and cached; it is recounted once older than CACHE_SECONDS, and is
+     reported as an estimate since rows may have come and gone since;
+   - otherwise the database's own row estimate.
+"""
+import base64
+import binascii
+import datetime
+import json
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .task_queue import enqueue, task
+
+DEFAULT_ADMIN_COUNTS = {
+   'EXACT_THRESHOLD': 10000,
+   'CACHE_SECONDS': 300,
+}
+
+
+def count_setting(name):
+   configured = getattr(settings, 'ADMIN_COUNTS', {})
+   return configured.get(name, DEFAULT_ADMIN_COUNTS[name])
+
+
+def exact_count_key(model):
+   return f'exact-count:{model._meta.label}'  # pylint: disable=protected-access
+
+
+@task()
+def recount_table(payload):
+   model = apps.get_model(payload['model'])
+   count = model.objects.count()
+   cache.set(exact_count_key(model), (count, time.time()), timeout=None)
+
+
+def queue_recount(model):
+   """Queue a recount of a table, unless one was queued in the last while"""
+   label = model._meta.label  # pylint: disable=protected-access
+   if cache.add(f'recount-queued:{label}', True,
+                timeout=count_setting('CACHE_SECONDS')):
+      enqueue(recount_table, {'model': label})
+
+
+def planner_estimate(queryset):
+   """The database's row estimate for a queryset, or None if it has none"""
+   connection = connections[queryset.db]
+   queryset = queryset.order_by()
+   filtered = queryset.query.has_filters()
+   try:
+      with connection.cursor() as cursor:
+         if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+               plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+         if connection.vendor == 'sqlite' and not filtered:
+            # Only there once ANALYZE has run; the stat starts with the
+            # table's row count
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s',
+                           [queryset.model._meta.db_table])  # pylint: disable=protected-access
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+   except DatabaseError:
+      return None
+   return None
+
+
+def estimated_count(queryset):
+   """Return (count, is_estimate) for a queryset"""
+   whole_table = not queryset.query.has_filters()
+   if whole_table:
+      cached = cache.get(exact_count_key(queryset.model))
+      if cached is not None:
+         count, counted_at = cached
+         if time.time() - counted_at > count_setting('CACHE_SECONDS'):
+            queue_recount(queryset.model)
+         return count, True
+
+   threshold = count_setting('EXACT_THRESHOLD')
+   capped = queryset.order_by()[:threshold + 1].count()
+   if capped <= threshold:
+      return capped, False
+
+   if whole_table:
+      queue_recount(queryset.model)
+   return max(planner_estimate(queryset) or 0, capped), True
+
+
+def field_value(instance, field):
+   for name in field.split('__'):
+      instance = getattr(instance, name)
+   return instance
+
+
+def encode_value(value):
+   if isinstance(value, (datetime.date, datetime.time)):
+      return value.isoformat()
+   return value
+
+
+class KeysetPagination(BasePagination):
+   """
+   Cursor pagination on every column of `ordering`, which must end in a
+   unique column. ?page=N is still accepted and pages by OFFSET; the next
+   and previous links it returns use cursors.
+   """
+   page_size = 20
+   page_size_query_param = 'page_size'
+   max_page_size = 100
+   cursor_query_param = 'cursor'
+   page_query_param = 'page'
+   ordering = ('-id',)
+   # No page links in the browsable API
+   display_page_controls = False
+
+   def __init__(self):
+      self.base_url = None
+      self.count, self.count_is_estimate = 0, False
+      self.has_next = self.has_previous = False
+      self.rows = []
+
+   def paginate_queryset(self, queryset, request, view=None):
+      self.base_url = request.build_absolute_uri()
+      self.count, self.count_is_estimate = estimated_count(queryset)
+      size = self.get_page_size(request)
+      position, reverse = self.decode_cursor(request)
+
+      ordering = [self.reversed(field) if reverse else field
+                  for field in self.ordering]
+      queryset = queryset.order_by(*ordering)
+      offset = 0
+      if position is not None:
+         queryset = queryset.filter(self.after(ordering, position))
+      elif request.query_params.get(self.page_query_param):
+         offset = (self.get_page_number(request) - 1) * size
+
+      rows = list(queryset[offset:offset + size + 1])
+      self.rows = rows[:size]
+      if reverse:
+         self.rows.reverse()
+         self.has_next, self.has_previous = True, len(rows) > size
+      else:
+         self.has_next = len(rows) > size
+         self.has_previous = position is not None or offset > 0
+      return self.rows
+
+   def to_html(self):
+      return ''
+
+   def get_page_size(self, request):
+      try:
+         size = int(request.query_params[self.page_size_query_param])
+      except (KeyError, ValueError):
+         return self.page_size
+      return min(max(size, 1), self.max_page_size)
+
+   def get_page_number(self, request):
+      try:
+         page = int(request.query_params[self.page_query_param])
+      except ValueError as e:
+         raise NotFound('Invalid page.') from e
+      if page < 1:
+         raise NotFound('Invalid page.')
+      return page
+
+   @staticmethod
+   def reversed(field):
+      return field[1:] if field.startswith('-') else f'-{field}'
+
+   @staticmethod
+   def after(ordering, position):
+      """Rows that come after `position` in `ordering`"""
+      condition = Q()
+      equal = {}
+      for field, value in zip(ordering, position):
+         name = field.lstrip('-')
+         lookup = 'lt' if field.startswith('-') else 'gt'
+         condition |= Q(**equal, **{f'{name}__{lookup}': value})
+         equal[name] = value
+      return condition
+
+   def decode_cursor(self, request):
+      encoded = request.query_params.get(self.cursor_query_param)
+      if not encoded:
+         return None, False
+      try:
+         data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+         position, reverse = data['p'], bool(data.get('r'))
+      except (binascii.Error, ValueError, TypeError, KeyError) as e:
+         raise NotFound('Invalid cursor.') from e
+      if not isinstance(position, list) or \
+            len(position) != len(self.ordering):
+         raise NotFound('Invalid cursor.')
+      return position, reverse
+
+   def encode_cursor(self, row, reverse):
+      position = [encode_value(field_value(row, field.lstrip('-')))
+                  for field in self.ordering]
+      data = json.dumps({'p': position, 'r': int(reverse)})
+      url = remove_query_param(self.base_url, self.page_query_param)
+      return replace_query_param(
+         url, self.cursor_query_param,
+         base64.urlsafe_b64encode(data.encode()).decode())
+
+   def get_next_link(self):
+      if not self.has_next or not self.rows:
+         return None
+      return self.encode_cursor(self.rows[-1], reverse=False)
+
+   def get_previous_link(self):
+      if not self.has_previous or not self.rows:
+         return None
+      return self.encode_cursor(self.rows[0], reverse=True)
+
+   def get_paginated_response(self, data):
+      return Response({
+         'count': self.count,
+         'count_is_estimate': self.count_is_estimate,
+         'next': self.get_next_link(),
+         'previous': self.get_previous_link(),
+         'results': data,
+      })
+
+   def get_paginated_response_schema(self, schema):
+      return {
+         'type': 'object',
+         'required': ['count', 'results'],
+         'properties': {
+            'count': {'type': 'integer'},
+            'count_is_estimate': {'type': 'boolean'},
+            'next': {'type': 'string', 'format': 'uri', 'nullable': True},
+            'previous': {'type': 'string', 'format': 'uri',
+                         'nullable': True},
+            'results': schema,
+         },
+      }
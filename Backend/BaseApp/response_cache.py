@@ -0,0 +1,325 @@
+"""
+Cached responses for anonymous GETs of the public endpoints.
+
+Views opt in with an `anonymous_cache_models` attribute naming the models
+their responses are read from. The first anonymous GET of a URL renders
+as usual and its JSON body is kept gzip- and (with the brotli package)
+brotli-compressed, keyed by the normalized URL; later ones get the body in
+the encoding their Accept-Encoding asks for, without reaching the view.
+Entries share a RESPONSE_CACHE['MAX_BYTES'] budget and the least recently
+used go first.
+
+Each model has a generation counter, bumped by model signals when one of
+its rows is written. An entry remembers the counters of its models as
+they were before the view ran and is dropped once one of them moved. The
+counters live in a memory-mapped file shared by the worker processes on a
+node, so a write made by one worker invalidates the entries of all of
+them. Writes the signals can't see, raw SQL or another node's, show up
+after MAX_AGE seconds at the latest.
+
+The middleware goes last in MIDDLEWARE, so the others still see cached
+responses on their way out. Cached responses skip throttling, which is
+there to bound work they don't do.
+"""
+import gzip
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .caching import map_file, shared_path
+from .models import ExternalMedia, Profile, ProfileComment, ProfileTagging, \
+   ProfileVote, Tag
+from .throttling import key_hash
+
+try:
+   import brotli
+except ImportError:  # Optional; only gzip bodies are kept without it
+   brotli = None
+
+DEFAULT_RESPONSE_CACHE = {
+   'ENABLED': True,
+   'MAX_BYTES': 64 * 1024 * 1024,
+   # Larger bodies aren't cached
+   'MAX_ENTRY_BYTES': 4 * 1024 * 1024,
+   # Seconds an entry is served without a counter moving
+   'MAX_AGE': 300,
+   'GZIP_LEVEL': 6,
+   # 11 is brotli's default and far slower to compress for little gain
+   'BROTLI_QUALITY': 5,
+   # Shared by the processes using the same file; by default
+   # shared_path('generations'), see BaseApp/caching.py
+   'GENERATIONS_PATH': None,
+}
+
+# Everything a serialized profile shows
+PROFILE_MODELS = (User, Profile, Tag, ProfileTagging, ProfileVote,
+                  ProfileComment, ExternalMedia)
+TAG_MODELS = (Tag, ProfileTagging)
+
+GENERATION_SLOTS = 1024
+VARY = ('Accept', 'Accept-Encoding', 'Authorization', 'Cookie')
+accepts_brotli = re.compile(r'\bbr\b')
+accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def response_cache_settings():
+   return {**DEFAULT_RESPONSE_CACHE,
+           **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+class Generations:
+   """
+   Per-model write counters in a file-backed table. Models whose labels
+   share a slot invalidate each other's entries, which only costs hits.
+   """
+
+   def __init__(self, path, slots=GENERATION_SLOTS):
+      self.path = path
+      self.map = map_file(path, slots * 8)
+      self.values = memoryview(self.map).cast('Q')
+      self.slots = slots
+
+   def slots_for(self, models):
+      return tuple(key_hash(model._meta.label) % self.slots  # pylint: disable=protected-access
+                   for model in models)
+
+   def stamp(self, slots):
+      values = self.values
+      return tuple(values[slot] for slot in slots)
+
+   def bump(self, models):
+      # A clock rather than a count, so a lost concurrent update can't
+      # bring a counter back to a value an entry was stamped with
+      for slot in self.slots_for(models):
+         self.values[slot] = max(self.values[slot] + 1, time.time_ns())
+
+
+class Entry:
+   __slots__ = ('bodies', 'content_type', 'slots', 'stamp', 'expires',
+                'size')
+
+   def __init__(self, bodies, content_type, stamped, expires):
+      self.bodies = bodies
+      self.content_type = content_type
+      # The generation slots of its models and their counters
+      self.slots, self.stamp = stamped
+      self.expires = expires
+      self.size = sum(map(len, bodies.values()))
+
+
+class ResponseCache:
+   """Entries by normalized URL, least recently used first"""
+
+   def __init__(self, max_bytes):
+      self.max_bytes = max_bytes
+      self.entries = OrderedDict()
+      self.size = 0
+      self.lock = threading.Lock()
+
+   def get(self, key):
+      entry = self.entries.get(key)
+      if entry is not None:
+         try:
+            self.entries.move_to_end(key)
+         except KeyError:  # Evicted by another thread meanwhile
+            pass
+      return entry
+
+   def set(self, key, entry):
+      with self.lock:
+         old = self.entries.pop(key, None)
+         if old is not None:
+            self.size -= old.size
+         self.entries[key] = entry
+         self.size += entry.size
+         while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+   def discard(self, key, entry):
+      with self.lock:
+         if self.entries.get(key) is entry:
+            del self.entries[key]
+            self.size -= entry.size
+
+   def clear(self):
+      with self.lock:
+         self.entries.clear()
+         self.size = 0
+
+
+_generations = None
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_generations():
+   global _generations  # pylint: disable=global-statement
+   path = response_cache_settings()['GENERATIONS_PATH'] or \
+      shared_path('generations')
+   generations = _generations
+   if generations is None or generations.path != path:
+      with _response_cache_lock:
+         if _generations is None or _generations.path != path:
+            _generations = Generations(path)
+         generations = _generations
+   return generations
+
+
+def get_response_cache():
+   global _response_cache  # pylint: disable=global-statement
+   max_bytes = response_cache_settings()['MAX_BYTES']
+   cache = _response_cache
+   if cache is None or cache.max_bytes != max_bytes:
+      with _response_cache_lock:
+         if _response_cache is None or \
+               _response_cache.max_bytes != max_bytes:
+            _response_cache = ResponseCache(max_bytes)
+         cache = _response_cache
+   return cache
+
+
+def reset_response_cache():
+   global _response_cache  # pylint: disable=global-statement
+   with _response_cache_lock:
+      _response_cache = None
+
+
+def bump_generation(*models):
+   """Invalidate the cached responses read from any of `models`"""
+   generations = get_generations()
+   generations.bump(models)
+   # Again once committed: a response rendered in between read the old rows
+   transaction.on_commit(partial(generations.bump, models))
+
+
+def cache_key(request):
+   """The normalized URL of a cacheable request, or None"""
+   if request.method != 'GET' or 'HTTP_AUTHORIZATION' in request.META or \
+         settings.SESSION_COOKIE_NAME in request.COOKIES or \
+         'text/html' in request.META.get('HTTP_ACCEPT', ''):
+      return None
+   query = request.META.get('QUERY_STRING', '')
+   if '&' in query:
+      query = '&'.join(sorted(query.split('&')))
+   return (f"{request.scheme}://{request.META.get('HTTP_HOST', '')}"
+           f"{request.path}?{query}")
+
+
+def encoding_for(request):
+   accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+   if brotli is not None and accepts_brotli.search(accepted):
+      return 'br'
+   if accepts_gzip.search(accepted):
+      return 'gzip'
+   return 'identity'
+
+
+def encode(body, config):
+   bodies = {'identity': body,
+             'gzip': gzip.compress(body, config['GZIP_LEVEL'], mtime=0)}
+   if brotli is not None:
+      bodies['br'] = brotli.compress(body, quality=config['BROTLI_QUALITY'])
+   return bodies
+
+
+def cached_response(entry, encoding):
+   response = HttpResponse(entry.bodies[encoding],
+                           content_type=entry.content_type)
+   if encoding != 'identity':
+      response['Content-Encoding'] = encoding
+   response['Vary'] = ', '.join(VARY)
+   return response
+
+
+def cacheable(response, config):
+   return response.status_code == 200 and not response.streaming and \
+      not response.has_header('Content-Encoding') and \
+      response.get('Content-Type', '').startswith('application/json') and \
+      len(response.content) <= config['MAX_ENTRY_BYTES']
+
+
+class AnonymousResponseCacheMiddleware:
+   """
+   Serves and stores anonymous GETs of views that opt in; goes last. Runs
+   async under ASGI, so it doesn't push the async views into a thread.
+   """
+   sync_capable = True
+   async_capable = True
+
+   def __init__(self, get_response):
+      self.get_response = get_response
+      if iscoroutinefunction(get_response):
+         markcoroutinefunction(self)
+
+   def __call__(self, request):
+      if iscoroutinefunction(self):
+         return self.__acall__(request)
+      key, response = self.lookup(request)
+      if key is None or response is not None:
+         return response or self.get_response(request)
+      return self.store(request, key, self.get_response(request))
+
+   async def __acall__(self, request):
+      key, response = self.lookup(request)
+      if key is None or response is not None:
+         return response or await self.get_response(request)
+      return self.store(request, key, await self.get_response(request))
+
+   @staticmethod
+   def lookup(request):
+      """(key, cached response); the key is None when not cacheable"""
+      config = response_cache_settings()
+      key = cache_key(request) if config['ENABLED'] else None
+      if key is None:
+         return None, None
+
+      cache = get_response_cache()
+      entry = cache.get(key)
+      if entry is not None:
+         if entry.expires > time.monotonic() and \
+               get_generations().stamp(entry.slots) == entry.stamp:
+            return key, cached_response(entry, encoding_for(request))
+         cache.discard(key, entry)
+      request.response_cache_key = key
+      return key, None
+
+   @staticmethod
+   def store(request, key, response):
+      config = response_cache_settings()
+      stamped = getattr(request, 'response_cache_stamp', None)
+      if stamped is None or not cacheable(response, config):
+         return response
+
+      entry = Entry(encode(response.content, config),
+                    response['Content-Type'], stamped,
+                    time.monotonic() + config['MAX_AGE'])
+      get_response_cache().set(key, entry)
+      # This response goes out compressed as well
+      encoding = encoding_for(request)
+      if encoding != 'identity':
+         response.content = entry.bodies[encoding]
+         response['Content-Encoding'] = encoding
+      patch_vary_headers(response, VARY)
+      return response
+
+   def process_view(self, request, view_func, _view_args, _view_kwargs):
+      if not hasattr(request, 'response_cache_key'):
+         return None
+      models = getattr(getattr(view_func, 'cls', view_func),
+                       'anonymous_cache_models', None)
+      if models:
+         # Taken before the view reads, so a write meanwhile invalidates it
+         generations = get_generations()
+         slots = generations.slots_for(models)
+         request.response_cache_stamp = (slots, generations.stamp(slots))
+      return None
@@ -0,0 +1,224 @@
+import abc
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Notification, SearchHistory, Task
+
+# Used when settings.RETENTION_POLICIES is not defined
+DEFAULT_RETENTION_POLICIES = {
+   'notifications': {'max_age_days': 90, 'read_only': True},
+   'search_history': {'keep_last': 50},
+   'tasks': {'max_age_days': 7},
+}
+
+
+class RetentionReport:
+   """Running totals for a single policy"""
+
+   def __init__(self, name):
+      self.name = name
+      self.rows = 0
+      self.bytes = 0
+      self.archived_bytes = 0
+      self.batches = 0
+
+   def as_dict(self):
+      return {
+         'policy': self.name,
+         'rows': self.rows,
+         'bytes': self.bytes,
+         'archived_bytes': self.archived_bytes,
+         'batches': self.batches,
+      }
+
+
+class RetentionPolicy(abc.ABC):
+   """Base class: subclasses say which rows of `model` have expired"""
+   name = None
+   model = None
+
+   def __init__(self, **options):
+      self.options = options
+
+   @abc.abstractmethod
+   def expired(self):
+      """Queryset of every row this policy would remove"""
+
+   def next_batch(self, batch_size):
+      """Ids of up to batch_size expired rows; [] once there are none"""
+      return list(self.expired().order_by('pk').values_list(
+         'pk', flat=True)[:batch_size])
+
+   def deletable(self, ids):
+      """Rows from a selected batch that may still be removed"""
+      return self.model.objects.filter(pk__in=ids)
+
+
+class NotificationRetention(RetentionPolicy):
+   name = 'notifications'
+   model = Notification
+
+   def expired(self):
+      cutoff = timezone.now() - timedelta(
+         days=self.options.get('max_age_days', 90))
+      queryset = Notification.objects.filter(created_at__lt=cutoff)
+      if self.options.get('read_only', True):
+         queryset = queryset.filter(is_read=True)
+      return queryset
+
+   def deletable(self, ids):
+      # A notification may have been marked unread since it was selected
+      return self.expired().filter(pk__in=ids)
+
+
+class SearchHistoryRetention(RetentionPolicy):
+   name = 'search_history'
+   model = SearchHistory
+
+   def __init__(self, **options):
+      super().__init__(**options)
+      self.cutoffs = None
+
+   def ranked(self):
+      # Rank each user's searches newest first
+      return SearchHistory.objects.annotate(
+         rank=Window(RowNumber(), partition_by=[F('user_id')],
+                     order_by=[F('search_time').desc(), F('id').desc()])
+      )
+
+   def expired(self):
+      # New searches only push older rows further down, so a row that has
+      # fallen out of the top N stays expired
+      return self.ranked().filter(rank__gt=self.options.get('keep_last', 50))
+
+   def next_batch(self, batch_size):
+      # The ranking is a pass over the whole table, so it is done once per
+      # run: it gives each user's oldest kept search, and batches are then
+      # that user's rows behind it, read through the user's index
+      if self.cutoffs is None:
+         self.cutoffs = list(self.ranked().filter(
+            rank=self.options.get('keep_last', 50)).values_list(
+               'user_id', 'search_time', 'id'))
+      ids = []
+      while self.cutoffs and len(ids) < batch_size:
+         user_id, search_time, pk = self.cutoffs[-1]
+         older = SearchHistory.objects.filter(
+            Q(search_time__lt=search_time) |
+            Q(search_time=search_time, id__lt=pk), user_id=user_id)
+         wanted = batch_size - len(ids)
+         found = list(older.order_by('pk').values_list(
+            'pk', flat=True)[:wanted])
+         ids += found
+         if len(found) < wanted:
+            # Nothing of this user's left to remove
+            self.cutoffs.pop()
+      return ids
+
+
+class TaskRetention(RetentionPolicy):
+   name = 'tasks'
+   model = Task
+
+   def expired(self):
+      # Queued and running tasks are never removed
+      cutoff = timezone.now() - timedelta(
+         days=self.options.get('max_age_days', 7))
+      return Task.objects.filter(status__in=[Task.DONE, Task.FAILED],
+                                 finished_at__lt=cutoff)
+
+
+POLICY_CLASSES = {
+   policy.name: policy
+   for policy in (NotificationRetention, SearchHistoryRetention,
+                  TaskRetention)
+}
+
+
+def get_policies(names=None):
+   configured = getattr(settings, 'RETENTION_POLICIES',
+                        DEFAULT_RETENTION_POLICIES)
+   policies = []
+   for name, options in configured.items():
+      if names and name not in names:
+         continue
+      if name not in POLICY_CLASSES:
+         raise ValueError(f"Unknown retention policy: {name}")
+      policies.append(POLICY_CLASSES[name](**options))
+   return policies
+
+
+def delete_batch(policy, ids, archive):
+   """
+   Delete the rows of a batch that are still deletable, archiving exactly
+   those. Returns their serialized lines.
+   """
+   with transaction.atomic():
+      # Locked, so rows changed since they were selected are left alone
+      # and what is archived is what is deleted
+      rows = list(policy.deletable(ids).select_for_update().values())
+      lines = [json.dumps(row, cls=DjangoJSONEncoder) for row in rows]
+      if archive:
+         archive.write(''.join(line + '\n' for line in lines))
+         archive.flush()
+      policy.model.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+   return lines
+
+
+def measure_expired(policy, batch_size):
+   """What apply_policy() would remove, without removing it"""
+   report = RetentionReport(policy.name)
+   for row in policy.expired().values().iterator(chunk_size=batch_size):
+      row.pop('rank', None)
+      report.rows += 1
+      report.bytes += len(json.dumps(row, cls=DjangoJSONEncoder))
+   return report
+
+
+def archive_file(archive_dir, name):
+   os.makedirs(archive_dir, exist_ok=True)
+   stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+   return os.path.join(archive_dir, f"{name}-{stamp}.ndjson.gz")
+
+
+def apply_policy(policy, batch_size=1000, archive_dir=None, dry_run=False,
+                 pause=0.0):
+   """
+   Delete expired rows in bounded batches, one short transaction each, so
+   the table is never locked for long while traffic keeps running.
+   """
+   if dry_run:
+      return measure_expired(policy, batch_size)
+
+   report = RetentionReport(policy.name)
+   archive = archive_path = None
+   if archive_dir:
+      archive_path = archive_file(archive_dir, policy.name)
+      archive = gzip.open(archive_path, 'at', encoding='utf-8')
+
+   try:
+      while True:
+         ids = policy.next_batch(batch_size)
+         if not ids:
+            break
+         lines = delete_batch(policy, ids, archive)
+         report.rows += len(lines)
+         report.bytes += sum(len(line) for line in lines)
+         report.batches += 1
+         if pause:
+            time.sleep(pause)
+   finally:
+      if archive:
+         archive.close()
+         report.archived_bytes = os.path.getsize(archive_path)
+
+   return report
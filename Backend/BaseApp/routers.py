@@ -0,0 +1,144 @@
+"""
+Sends the reads of safe requests to a read replica from
+settings.READ_REPLICAS. Everything else - writes, unsafe requests,
+management commands - uses the primary. After a user writes, their reads
+stay on the primary for REPLICA_PIN_SECONDS so they see their own changes
+despite replication lag.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, \
+   sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import CachedJWTAuthentication
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY = 'default'
+
+# Alias the current request reads from; None means the primary
+read_alias = contextvars.ContextVar('read_alias', default=None)
+authenticator = CachedJWTAuthentication()
+
+
+def pin_key(user_id):
+   return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+   cache.set(pin_key(user_id), True,
+             timeout=getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+
+
+def is_pinned(user_id):
+   return cache.get(pin_key(user_id), False)
+
+
+def request_user_id(request):
+   """The user id from the JWT, or the session user; checks no database"""
+   header = authenticator.get_header(request)
+   raw_token = authenticator.get_raw_token(header) if header else None
+   if raw_token is not None:
+      try:
+         token = authenticator.get_validated_token(raw_token)
+      except (InvalidToken, TokenError):
+         return None
+      return token.get(api_settings.USER_ID_CLAIM)
+   user = getattr(request, 'user', None)
+   if user is not None and user.is_authenticated:
+      return user.id
+   return None
+
+
+# Django's router interface; the replicas are interchangeable for any model
+class ReplicaRouter:  # pylint: disable=unused-argument
+   def db_for_read(self, model, **hints):
+      return read_alias.get()
+
+   def db_for_write(self, model, **hints):
+      return PRIMARY
+
+   def allow_relation(self, obj1, obj2, **hints):
+      # Replicas hold the same rows as the primary
+      return True
+
+   def allow_migrate(self, db, app_label, model_name=None, **hints):
+      return db == PRIMARY
+
+
+def choose_alias(request, replicas):
+   """The replica a request reads from, or None for the primary"""
+   user_id = request.replica_user_id = request_user_id(request)
+   if request.method in SAFE_METHODS and \
+         (user_id is None or not is_pinned(user_id)):
+      return random.choice(replicas)
+   return None
+
+
+def pin_writer(request, response):
+   user_id = request.replica_user_id
+   if request.method not in SAFE_METHODS and user_id is not None and \
+         response.status_code < 400 and \
+         not getattr(request, 'read_only_view', False):
+      pin_to_primary(user_id)
+
+
+class ReplicaRoutingMiddleware:
+   """
+   Chooses the database a request reads from and pins writers. Runs async
+   under ASGI; the cache and session lookups go through sync_to_async.
+   """
+   sync_capable = True
+   async_capable = True
+
+   def __init__(self, get_response):
+      self.get_response = get_response
+      if iscoroutinefunction(get_response):
+         markcoroutinefunction(self)
+
+   def __call__(self, request):
+      if iscoroutinefunction(self):
+         return self.__acall__(request)
+      replicas = getattr(settings, 'READ_REPLICAS', [])
+      if not replicas:
+         return self.get_response(request)
+
+      token = read_alias.set(choose_alias(request, replicas))
+      try:
+         response = self.get_response(request)
+      finally:
+         read_alias.reset(token)
+      pin_writer(request, response)
+      return response
+
+   async def __acall__(self, request):
+      replicas = getattr(settings, 'READ_REPLICAS', [])
+      if not replicas:
+         return await self.get_response(request)
+
+      # The alias is a context variable, which sync_to_async carries over
+      token = read_alias.set(
+         await sync_to_async(choose_alias)(request, replicas))
+      try:
+         response = await self.get_response(request)
+      finally:
+         read_alias.reset(token)
+      await sync_to_async(pin_writer)(request, response)
+      return response
+
+   def process_view(self, request, view_func, _view_args, _view_kwargs):
+      # Views marked read_only, like the batch endpoint, read from a
+      # replica and don't pin the user even when the method is unsafe
+      replicas = getattr(settings, 'READ_REPLICAS', [])
+      if not replicas or request.method in SAFE_METHODS or \
+            not getattr(view_func, 'read_only', False):
+         return None
+      request.read_only_view = True
+      user_id = getattr(request, 'replica_user_id', None)
+      if user_id is None or not is_pinned(user_id):
+         read_alias.set(random.choice(replicas))
+      return None
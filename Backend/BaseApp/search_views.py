@@ -0,0 +1,218 @@
+"""
+Profile search: the dedicated search endpoint, with its name, type,
+location, tag and ?near= filters, and the older filterable list.
+"""
+import logging
+import operator
+from functools import reduce
+
+# pylint: disable=C0412
+from rest_framework import generics, filters
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from django_filters.rest_framework import DjangoFilterBackend
+from django_filters import FilterSet, CharFilter
+# pylint: enable=C0412
+
+from django.db.models import Case, FloatField, Q, Value, When
+from .authentication import CachedJWTAuthentication, get_profile_info
+from .geo import nearest, parse_near
+from .models import Tag, Profile, ProfileTagging
+from .serializer import SearchProfileSerializer
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileFilter(FilterSet):
+   tags = CharFilter(method='filter_tags')
+
+   def filter_tags(self, queryset, value):
+      if not value:
+         return queryset
+      tag_ids = [int(id) for id in value.split(',') if id.strip().isdigit()]
+      return queryset.filter(tags__id__in=tag_ids)
+
+   class Meta:
+      model = Profile
+      fields = ['user_type', 'city', 'state', 'country']
+
+class ProfileSearchView(generics.ListAPIView):
+   serializer_class = SearchProfileSerializer
+   permission_classes = [AllowAny]
+   filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+   filterset_class = ProfileFilter
+   search_fields = [
+      'user_type', 'city', 'state', 'country', 'tags__tag_name',
+      'first_name', 'last_name', 'description'
+   ]
+
+   def get_queryset(self):
+      logger.info("Starting search with params: %s",
+                  self.request.query_params)
+
+      # Log all query parameters
+      for key, value in self.request.query_params.items():
+         logger.info("Query param - %s: %s", key, value)
+
+      # Build queryset with detailed logging
+      logger.info("Building base queryset...")
+      queryset = Profile.objects.select_related('user').prefetch_related(
+         'tags'
+      )
+      logger.info("Base queryset count: %s", queryset.count())
+
+      # Apply anonymous filter
+      logger.info("Applying anonymous filter...")
+      queryset = queryset.exclude(is_anonymous=True)
+      logger.info("After anonymous filter count: %s", queryset.count())
+
+      # Log search parameters if present
+      search_term = self.request.query_params.get('search', None)
+      if search_term:
+         logger.info("Search term: %s", search_term)
+
+      # Log filter parameters
+      for field in self.filterset_class.Meta.fields + ['tags']:
+         value = self.request.query_params.get(field)
+         if value:
+            logger.info("Filter %s: %s", field, value)
+
+      # Log final queryset SQL
+      logger.info("Final queryset SQL: %s", str(queryset.query))
+
+      return queryset
+
+   def get_serializer_context(self):
+      context = super().get_serializer_context()
+      context['request'] = self.request
+      if self.request.user.is_authenticated:
+         profile_id, _ = get_profile_info(self.request.user)
+         if profile_id:
+            context['profile_id'] = profile_id
+            context['self_added_tag_ids'] = set(
+               ProfileTagging.objects.filter(
+                  profile_id=profile_id, is_self_added=True
+               ).values_list('tag_id', flat=True))
+            logger.info(
+               "Added profile_id %s to context for user %s",
+               profile_id, self.request.user.id)
+         else:
+            logger.warning("Profile not found for user %s",
+               self.request.user.id)
+      return context
+
+   def list(self, request, *args, **kwargs):
+      logger.info("Starting search request from IP: %s",
+         request.META.get('REMOTE_ADDR'))
+      logger.info("Request headers: %s", request.headers)
+
+      # Get the queryset
+      queryset = self.get_queryset()
+      logger.info("Queryset count before filtering: %s", queryset.count())
+
+      # Apply filters
+      queryset = self.filter_queryset(queryset)
+      logger.info("Queryset count after filtering: %s", queryset.count())
+
+      # Paginate
+      page = self.paginate_queryset(queryset)
+      if page is not None:
+         logger.info("Paginated results count: %s", len(page))
+         serializer = self.get_serializer(page, many=True)
+         return self.get_paginated_response(serializer.data)
+
+      # Serialize
+      serializer = self.get_serializer(queryset, many=True)
+      logger.info("Serialized results count: %s", len(serializer.data))
+
+      return Response(serializer.data)
+
+
+class DedicatedSearchView(generics.ListAPIView):
+   serializer_class = SearchProfileSerializer
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [IsAuthenticated]
+   pagination_class = PageNumberPagination
+
+   def get_queryset(self):
+      """Get the queryset for the dedicated search view"""
+      try:
+         return search_queryset(self.request.query_params)
+      except ValueError as e:
+         raise ParseError(str(e)) from e
+
+
+def search_queryset(params):
+   """
+   Build the dedicated search queryset from request query parameters.
+   Raises ValueError for a malformed near/radius.
+   """
+   queryset = Profile.objects.select_related(
+      'user').prefetch_related('tags').all()
+
+   # Always filter out anonymous profiles
+   queryset = queryset.filter(is_anonymous=False)
+
+   # Get search parameters
+   search_query = params.get('q', '')
+   user_type = params.get('user_type', '')
+   location = params.get('location', '')
+   city = params.get('city', '')
+   tags = params.getlist('tags', [])
+
+   # Apply filters
+   if search_query:
+      queryset = apply_filters(search_query, queryset)
+
+   if user_type:
+      queryset = queryset.filter(user_type=user_type)
+
+   if location:
+      queryset = queryset.filter(
+      Q(city__icontains=location) |
+      Q(state__icontains=location) |
+      Q(country__icontains=location)
+      )
+
+   if city:
+      queryset = queryset.filter(city__icontains=city)
+
+   if tags:
+      tag_objects = Tag.objects.filter(tag_name__in=tags)
+      if tag_objects.exists():
+         for tag in tag_objects:
+            queryset = queryset.filter(tags=tag)
+         queryset = queryset.distinct()
+
+   if params.get('near'):
+      queryset = near_queryset(queryset, params['near'], params.get('radius'))
+
+   return queryset
+
+
+def near_queryset(queryset, near, radius):
+   """The profiles within the radius, nearest first, with distance_km"""
+   found = nearest(queryset, *parse_near(near, radius))
+   return queryset.filter(
+      pk__in=[profile_id for profile_id, _ in found]
+   ).annotate(distance_km=Case(
+      *[When(pk=profile_id, then=Value(distance))
+        for profile_id, distance in found],
+      default=None, output_field=FloatField(),
+   )).order_by('distance_km', 'pk')
+
+
+def apply_filters(search_query, queryset):
+   search_terms = search_query.split()
+   name_filters = []
+   for term in search_terms:
+      name_filters.append(
+         Q(first_name__icontains=term) |
+         Q(last_name__icontains=term)
+      )
+   if name_filters:
+      queryset = queryset.filter(reduce(operator.and_, name_filters))
+
+   return queryset
@@ -1,15 +1,37 @@
+import copy
 import logging
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
 from .models import Tag, SearchHistory, \
     ExternalMedia, Profile, ProfileVote, ProfileComment, \
     Notification, Friendship
+from .response_cache import bump_generation
 
 logger = logging.getLogger(__name__)
 
 
-class UserSerializer(serializers.ModelSerializer):
+class PrecompiledModelSerializer(serializers.ModelSerializer):
+   """
+   Builds the fields from the model once per class instead of on every
+   instantiation; each instance gets a deep copy, as DRF does for declared
+   fields. BaseApp.startup.warm_up() builds them all at import.
+   """
+
+   @classmethod
+   def precompiled_fields(cls):
+      fields = cls.__dict__.get('_precompiled_fields')
+      if fields is None:
+         fields = super(PrecompiledModelSerializer, cls()).get_fields()
+         cls._precompiled_fields = fields
+      return fields
+
+   def get_fields(self):
+      return copy.deepcopy(self.precompiled_fields())
+
+
+class UserSerializer(PrecompiledModelSerializer):
    class Meta:
       model = User
       fields = ['id', 'username', 'email', 'first_name', 'last_name',
@@ -25,7 +47,7 @@ class UserSerializer(serializers.ModelSerializer):
 # Serializer class for Tags
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(PrecompiledModelSerializer):
    is_self_added = serializers.SerializerMethodField()
 
    class Meta:
@@ -38,13 +60,17 @@ class TagSerializer(serializers.ModelSerializer):
       profile_id = self.context.get('profile_id')
       if not request or not profile_id:
          return False
+      # Views may load the profile's self-added tag ids once up front
+      self_added = self.context.get('self_added_tag_ids')
+      if self_added is not None:
+         return obj.id in self_added
       tagging = obj.profiletagging_set.filter(
          profile_id=profile_id
           ).first()
       return tagging.is_self_added if tagging else False
 
 
-class ProfileVoteSerializer(serializers.ModelSerializer):
+class ProfileVoteSerializer(PrecompiledModelSerializer):
    voter_username = serializers.CharField(
       source='voter.username', read_only=True)
 
@@ -60,7 +86,7 @@ class ProfileVoteSerializer(serializers.ModelSerializer):
       return super().create(validated_data)
 
 
-class ProfileCommentSerializer(serializers.ModelSerializer):
+class ProfileCommentSerializer(PrecompiledModelSerializer):
    commenter_username = serializers.CharField(
       source='commenter.username', read_only=True)
 
@@ -76,7 +102,7 @@ class ProfileCommentSerializer(serializers.ModelSerializer):
       return super().create(validated_data)
 
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(PrecompiledModelSerializer):
    user = UserSerializer()  # Nested User serializer
    tags = serializers.PrimaryKeyRelatedField(
        queryset=Tag.objects.all(), many=True, required=False)
@@ -84,10 +110,45 @@ class ProfileSerializer(serializers.ModelSerializer):
    comments = ProfileCommentSerializer(
       source='comments_received', many=True, read_only=True)
    current_user_vote = serializers.SerializerMethodField()
+   latest_media = serializers.SerializerMethodField()
+   # Only set on matchmaking results
+   match_score = serializers.FloatField(read_only=True)
 
    class Meta:
       model = Profile
-      fields = '__all__'
+      # Coordinates are derived from the location and not shown
+      exclude = ['latitude', 'longitude', 'geo_cell', 'geo_precision']
+
+   @staticmethod
+   def setup_queryset(queryset, user=None, media_limit=0):
+      """
+      Load everything the serializer reads in a fixed number of queries:
+      vote totals and the viewer's vote as annotations, comments and tags
+      as prefetches. With media_limit, the newest media_limit media of
+      every profile are loaded too, in one windowed query for the page.
+      """
+      queryset = queryset.select_related('user').prefetch_related(
+         'tags',
+         Prefetch('comments_received',
+                  queryset=ProfileComment.objects.select_related('commenter')),
+      ).annotate(
+         upvote_total=Count('votes_received', distinct=True,
+                            filter=Q(votes_received__is_upvote=True)),
+         downvote_total=Count('votes_received', distinct=True,
+                              filter=Q(votes_received__is_upvote=False)),
+      )
+      if user is not None and user.is_authenticated:
+         queryset = queryset.annotate(viewer_vote=Subquery(
+            ProfileVote.objects.filter(
+               profile=OuterRef('pk'), voter=user).values('is_upvote')[:1]
+         ))
+      if media_limit:
+         queryset = queryset.prefetch_related(Prefetch(
+            'user__externalmedia_set',
+            queryset=ExternalMedia.objects.order_by(
+               '-uploaded_at', '-id')[:media_limit],
+            to_attr='latest_media'))
+      return queryset
 
    def create(self, validated_data):
       user_data = validated_data.pop('user')
@@ -122,22 +183,46 @@ class ProfileSerializer(serializers.ModelSerializer):
       return instance
 
    def get_vote_count(self, obj):
+      if hasattr(obj, 'upvote_total'):
+         return obj.upvote_total - obj.downvote_total
       upvotes = obj.votes_received.filter(is_upvote=True).count()
       downvotes = obj.votes_received.filter(is_upvote=False).count()
       return upvotes - downvotes
 
+   def get_latest_media(self, obj):
+      # Only embedded when setup_queryset was asked for it
+      media = getattr(obj.user, 'latest_media', None)
+      if media is None:
+         return None
+      return ProfileMediaSerializer(media, many=True).data
+
    def get_current_user_vote(self, obj):
       request = self.context.get('request')
       if request and request.user.is_authenticated:
+         if hasattr(obj, 'viewer_vote'):
+            return obj.viewer_vote
          vote = obj.votes_received.filter(voter=request.user).first()
          if vote:
             return vote.is_upvote
       return None
 
+
+class ProfilePageSerializer(ProfileSerializer):
+   """
+   The profile in /api/profiles/<id>/page/, which sends its tags and latest
+   comments next to it rather than inside
+   """
+   tags = None
+   comments = None
+   latest_media = None
+
+   class Meta(ProfileSerializer.Meta):
+      exclude = ProfileSerializer.Meta.exclude + ['tags']
+
 # Serializer class for Search History
 
 
-class SearchHistorySerializer(serializers.ModelSerializer):
+class SearchHistorySerializer(PrecompiledModelSerializer):
    class Meta:
       model = SearchHistory
       fields = '__all__'
@@ -145,13 +230,32 @@ class SearchHistorySerializer(serializers.ModelSerializer):
 # Serializer class for External Media
 
 
-class ExternalMediaSerializer(serializers.ModelSerializer):
+class ExternalMediaSerializer(PrecompiledModelSerializer):
    class Meta:
       model = ExternalMedia
       fields = '__all__'
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+# Lists of media are only ever created, never updated
+class BulkExternalMediaSerializer(serializers.ListSerializer):  # pylint: disable=abstract-method
+   def create(self, validated_data):
+      # One INSERT for the whole list, which sends no post_save
+      media = ExternalMedia.objects.bulk_create(
+         [ExternalMedia(**item) for item in validated_data])
+      bump_generation(ExternalMedia)
+      return media
+
+
+# Media of one profile; the owner comes from the URL
+class ProfileMediaSerializer(PrecompiledModelSerializer):
+   class Meta:
+      model = ExternalMedia
+      fields = ['id', 'user', 'media_url', 'description', 'uploaded_at']
+      read_only_fields = ['user', 'uploaded_at']
+      list_serializer_class = BulkExternalMediaSerializer
+
+
+class NotificationSerializer(PrecompiledModelSerializer):
    recipient_username = serializers.CharField(source='recipient.username',
                                               read_only=True)
    created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S",
@@ -165,7 +269,7 @@ class NotificationSerializer(serializers.ModelSerializer):
 
 
 # Special serializer for admin dashboard
-class AdminProfileCommentSerializer(serializers.ModelSerializer):
+class AdminProfileCommentSerializer(PrecompiledModelSerializer):
    commenter = UserSerializer(read_only=True)
    profile_detail = serializers.SerializerMethodField(read_only=True)
 
@@ -221,7 +325,7 @@ class AdminProfileCommentSerializer(serializers.ModelSerializer):
          }
 
 
-class FriendshipSerializer(serializers.ModelSerializer):
+class FriendshipSerializer(PrecompiledModelSerializer):
    sender_username = serializers.CharField(source='sender.username',
                                            read_only=True)
    receiver_username = serializers.CharField(source='receiver.username',
@@ -234,14 +338,36 @@ class FriendshipSerializer(serializers.ModelSerializer):
       read_only_fields = ['id', 'created_at',
                           'sender_username', 'receiver_username', 'sender']
 
+   def validate(self, attrs):
+      request = self.context.get('request')
+      receiver = attrs.get('receiver')
+      if request and receiver and self.instance is None:
+         if receiver.id == request.user.id:
+            raise serializers.ValidationError(
+               "You cannot send a friend request to yourself")
+         existing = list(Friendship.between(request.user.id, receiver.id))
+         # A rejected request may be sent again, by either of the two
+         if any(friendship.status != 'rejected' for friendship in existing):
+            raise serializers.ValidationError(
+               "A friendship with this user already exists")
+         attrs['rejected'] = existing[0] if existing else None
+      return attrs
+
    def create(self, validated_data):
       # Automatically set the sender to the current user
       validated_data['sender'] = self.context['request'].user
-      return super().create(validated_data)
+      rejected = validated_data.pop('rejected', None)
+      if rejected is None:
+         return super().create(validated_data)
+      # Replaced rather than reused, the pair being unique, so the new
+      # request gets its own id and its own notification
+      with transaction.atomic():
+         rejected.delete()
+         return super().create(validated_data)
 
 
 # Special serializer for admin dashboard
-class AdminProfileSerializer(serializers.ModelSerializer):
+class AdminProfileSerializer(PrecompiledModelSerializer):
    user = UserSerializer()  # Nested User serializer
    tags = serializers.SerializerMethodField()
 
@@ -262,10 +388,12 @@ class AdminProfileSerializer(serializers.ModelSerializer):
       ]
 
 
-class SearchProfileSerializer(serializers.ModelSerializer):
+class SearchProfileSerializer(PrecompiledModelSerializer):
    user = serializers.SerializerMethodField()
    tags = TagSerializer(many=True, read_only=True)
    full_name = serializers.SerializerMethodField()
+   # Only set on ?near= searches
+   distance_km = serializers.FloatField(read_only=True)
 
    class Meta:
       model = Profile
@@ -274,7 +402,7 @@ class SearchProfileSerializer(serializers.ModelSerializer):
          'full_name',
          'street_address', 'city', 'state', 'country',
          'phone_number', 'years_of_experience', 'description',
-         'is_anonymous', 'tags'
+         'is_anonymous', 'tags', 'distance_km'
       ]
 
    def get_user(self, obj):
@@ -0,0 +1,76 @@
+# pylint: disable=unused-argument
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+   pre_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .directory_snapshot import snapshot_settings
+from .models import Profile, ProfileComment, ProfileTagging, ProfileVote, \
+   Tag
+from .response_cache import PROFILE_MODELS, TAG_MODELS, bump_generation, \
+   response_cache_settings
+from .tasks import queue_directory_refresh
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+   invalidate_user(instance.pk)
+   # Logging in saves last_login, which the directory doesn't show
+   if update_fields is None or set(update_fields) != {'last_login'}:
+      queue_directory_refresh([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+   invalidate_user(instance.user_id)
+   queue_directory_refresh([instance.user_id])
+
+
+# Shown with the profile in the directory snapshot
+def profile_content_changed(sender, instance, **kwargs):
+   queue_directory_refresh([instance.profile_id])
+
+
+def profile_tags_changed(sender, instance, action, reverse, pk_set,
+                         **kwargs):
+   if not action.startswith('post_'):
+      return
+   if not reverse:
+      queue_directory_refresh([instance.pk])
+   else:
+      # From a tag's side pk_set holds the profiles; clear() doesn't say
+      queue_directory_refresh(pk_set or (), full=pk_set is None)
+
+
+def tag_changed(sender, instance, created=False, **kwargs):
+   # Renaming a tag changes every profile shown with it. Deletes are
+   # caught before they cascade, while the taggings still say which
+   if not created:
+      queue_directory_refresh(list(ProfileTagging.objects.filter(
+         tag=instance).values_list('profile_id', flat=True)))
+
+
+# Only connected with a snapshot to refresh: a delete listener makes
+# Django fetch rows before deleting them instead of a single DELETE
+if snapshot_settings()['ROOT']:
+   for model in (ProfileVote, ProfileComment, ProfileTagging):
+      post_save.connect(profile_content_changed, sender=model)
+      post_delete.connect(profile_content_changed, sender=model)
+   m2m_changed.connect(profile_tags_changed, sender=ProfileTagging)
+   post_save.connect(tag_changed, sender=Tag)
+   pre_delete.connect(tag_changed, sender=Tag)
+
+
+def cached_model_changed(sender, **kwargs):
+   bump_generation(sender)
+
+
+# Invalidate cached anonymous responses, see BaseApp/response_cache.py.
+# tags.set() and friends save taggings without post_save
+if response_cache_settings()['ENABLED']:
+   for model in set(PROFILE_MODELS + TAG_MODELS):
+      post_save.connect(cached_model_changed, sender=model)
+      post_delete.connect(cached_model_changed, sender=model)
+   # Profile.tags goes through ProfileTagging
+   m2m_changed.connect(cached_model_changed, sender=ProfileTagging)
@@ -0,0 +1,81 @@
+"""
+Cold-start helpers for serverless deployments, where every new instance
+pays for imports before it can answer. saltnlight.wsgi and saltnlight.asgi
+call warm_up() so the first request doesn't also pay for compiling URL
+patterns and building serializer fields.
+"""
+import inspect
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.urls import URLResolver, get_resolver
+
+# Imports and warms up the app the way the WSGI entry point does
+COLD_START_SCRIPT = (
+   "import time\n"
+   "start = time.perf_counter()\n"
+   "import saltnlight.wsgi\n"
+   "print((time.perf_counter() - start) * 1000)\n"
+)
+
+
+def precompile_urls(resolver=None):
+   """Import the URLconfs and compile every pattern's regex"""
+   resolver = resolver or get_resolver()
+   for pattern in resolver.url_patterns:
+      pattern.pattern.regex  # pylint: disable=pointless-statement
+      # A string urlconf is loaded on first use on purpose (the admin)
+      if isinstance(pattern, URLResolver) and \
+            not isinstance(pattern.urlconf_name, str):
+         precompile_urls(pattern)
+
+
+def precompile_serializers():
+   """Build the field map of every serializer in BaseApp.serializer"""
+   # pylint: disable=import-outside-toplevel
+   from . import serializer
+   for _, cls in inspect.getmembers(serializer, inspect.isclass):
+      if issubclass(cls, serializer.PrecompiledModelSerializer) and \
+            cls is not serializer.PrecompiledModelSerializer:
+         cls.precompiled_fields()
+
+
+def warm_up():
+   precompile_urls()
+   precompile_serializers()
+
+
+def cold_start_env(api_only=None):
+   env = dict(os.environ)
+   env.setdefault('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+   if api_only is not None:
+      env['DJANGO_API_ONLY'] = 'true' if api_only else 'false'
+   return env
+
+
+def measure_cold_start(api_only=None):
+   """Milliseconds a fresh interpreter takes to import saltnlight.wsgi"""
+   result = subprocess.run(
+      [sys.executable, '-c', COLD_START_SCRIPT], env=cold_start_env(api_only),
+      cwd=settings.BASE_DIR, capture_output=True, text=True, check=True)
+   return float(result.stdout.strip().splitlines()[-1])
+
+
+def import_times(api_only=None):
+   """
+   Return {module: (self_us, cumulative_us)} for a cold import of
+   saltnlight.wsgi, from python -X importtime
+   """
+   result = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', 'import saltnlight.wsgi'],
+      env=cold_start_env(api_only), cwd=settings.BASE_DIR,
+      capture_output=True, text=True, check=True)
+   times = {}
+   for line in result.stderr.splitlines():
+      if not line.startswith('import time:') or 'self [us]' in line:
+         continue
+      self_us, cumulative_us, name = line[len('import time:'):].split('|')
+      times[name.strip()] = (int(self_us), int(cumulative_us))
+   return times
@@ -0,0 +1,248 @@
+"""
+Deterministic synthetic data for local load testing. The same seed and
+sizes always produce the same rows, so benchmark runs can be compared.
+"""
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .geo import geocode_profile
+from .models import Tag, Profile, ProfileTagging, ProfileVote, \
+    ProfileComment, Notification, Friendship
+
+TAG_NAMES = [
+   'Evangelism', 'Church Planting', 'Discipleship', 'Youth Ministry',
+   'Medical Missions', 'Education', 'Bible Translation', 'Prayer Support',
+   'Financial Support', 'Short-term Trips', 'Disaster Relief',
+   'Orphan Care', 'Clean Water', 'Agriculture', 'Refugee Support',
+   'Music Ministry', 'Sports Ministry', "Women's Ministry",
+   'Media & Technology', 'Construction',
+]
+FIRST_NAMES = [
+   'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael',
+   'Linda', 'David', 'Elizabeth', 'Samuel', 'Grace', 'Daniel', 'Ruth',
+   'Joseph', 'Esther', 'Paul', 'Hannah', 'Peter', 'Naomi', 'Andrew',
+   'Abigail', 'Thomas', 'Miriam', 'Luis', 'Ana', 'Kwame', 'Amara',
+   'Hiroshi', 'Mei',
+]
+LAST_NAMES = [
+   'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller',
+   'Davis', 'Rodriguez', 'Martinez', 'Wilson', 'Anderson', 'Taylor',
+   'Thomas', 'Moore', 'Jackson', 'Martin', 'Lee', 'Thompson', 'White',
+   'Okafor', 'Mensah', 'Nguyen', 'Kim', 'Silva', 'Santos', 'Tanaka',
+   'Mwangi', 'Haddad', 'Kowalski',
+]
+# (city, state, country); repeated entries make some places more common
+PLACES = [
+   ('Nashville', 'TN', 'USA'), ('Nashville', 'TN', 'USA'),
+   ('Dallas', 'TX', 'USA'), ('Dallas', 'TX', 'USA'),
+   ('Atlanta', 'GA', 'USA'), ('Colorado Springs', 'CO', 'USA'),
+   ('Toronto', 'ON', 'Canada'), ('London', '', 'United Kingdom'),
+   ('Nairobi', '', 'Kenya'), ('Nairobi', '', 'Kenya'),
+   ('Lagos', '', 'Nigeria'), ('Accra', '', 'Ghana'),
+   ('Lima', '', 'Peru'), ('Quito', '', 'Ecuador'),
+   ('Guatemala City', '', 'Guatemala'), ('Manila', '', 'Philippines'),
+   ('Chiang Mai', '', 'Thailand'), ('Seoul', '', 'South Korea'),
+   ('Kampala', '', 'Uganda'), ('Port-au-Prince', '', 'Haiti'),
+]
+USER_TYPES = ['missionary'] * 3 + ['supporter'] * 6 + ['other']
+COMMENTS = [
+   'Praying for your work!', 'Great to connect with you.',
+   'Your ministry has been a blessing to our church.',
+   'Would love to hear more about your next trip.',
+   'Thank you for your faithful service.',
+]
+FRIENDSHIP_STATUSES = ['accepted'] * 6 + ['pending'] * 3 + ['rejected']
+
+
+# Per-user sizes SyntheticDataset takes as keyword arguments
+DEFAULT_SIZES = {
+   'batch_size': 1000,
+   'tags_per_profile': 4,
+   'votes_per_user': 10,
+   # Share of votes that also get a comment
+   'comment_ratio': 0.3,
+   'friends_per_user': 6,
+   'notifications_per_user': 5,
+}
+
+
+class SyntheticDataset:
+   """
+   Generates users and profiles with Zipf-distributed tags, votes skewed
+   towards popular profiles, comments, friendships and notifications.
+   Everything is written with bulk_create in batches.
+   """
+
+   def __init__(self, users=1000, seed=0, prefix='synthetic',
+                password='synthetic-password', **sizes):
+      unknown = set(sizes) - set(DEFAULT_SIZES)
+      if unknown:
+         raise TypeError(f"Unknown sizes: {', '.join(sorted(unknown))}")
+      self.sizes = {**DEFAULT_SIZES, **sizes}
+      if users < 1 or self.sizes['batch_size'] < 1:
+         raise ValueError('users and batch_size must be at least 1')
+      if min(self.sizes.values()) < 0 or self.sizes['comment_ratio'] > 1:
+         raise ValueError('Sizes must not be negative and comment_ratio '
+                          'must be between 0 and 1')
+      self.users = users
+      self.seed = seed
+      self.prefix = prefix
+      self.password = password
+      self.rng = random.Random(seed)
+      self.counts = {}
+
+   def existing_users(self):
+      return User.objects.filter(username__startswith=self.prefix)
+
+   def generate(self, log=None):
+      """Create the dataset and return the number of rows per model"""
+      log = log or (lambda message: None)
+      tag_ids = self.create_tags()
+      user_ids = []
+      # One hash for every account; hashing each one would dominate
+      password_hash = make_password(self.password)
+      batch_size = self.sizes['batch_size']
+      for start in range(0, self.users, batch_size):
+         stop = min(start + batch_size, self.users)
+         user_ids += self.create_profiles(range(start, stop), tag_ids,
+                                          password_hash)
+         log(f"Created {stop} of {self.users} profiles")
+
+      self.create_votes(user_ids)
+      log(f"Created {self.counts['votes']} votes and "
+          f"{self.counts['comments']} comments")
+      friendships = self.create_friendships(user_ids)
+      log(f"Created {len(friendships)} friendships")
+      self.create_notifications(user_ids, friendships)
+      log(f"Created {self.counts['notifications']} notifications")
+      return self.counts
+
+   def create_tags(self):
+      existing = dict(Tag.objects.filter(tag_name__in=TAG_NAMES)
+                      .values_list('tag_name', 'id'))
+      Tag.objects.bulk_create([Tag(tag_name=name, tag_is_predefined=True)
+                               for name in TAG_NAMES if name not in existing])
+      ids = dict(Tag.objects.filter(tag_name__in=TAG_NAMES)
+                 .values_list('tag_name', 'id'))
+      return [ids[name] for name in TAG_NAMES]
+
+   def create_profiles(self, numbers, tag_ids, password_hash):
+      # Zipf weights: the first tags in TAG_NAMES are the most popular
+      tag_weights = [1 / rank for rank in range(1, len(tag_ids) + 1)]
+      rows = []
+      for number in numbers:
+         user, profile = self.make_user(number, password_hash)
+         rows.append((user, profile, self.pick_tags(tag_ids, tag_weights)))
+
+      with transaction.atomic():
+         users = User.objects.bulk_create([user for user, _, _ in rows])
+         for user, (_, profile, _) in zip(users, rows):
+            profile.user_id = user.id
+         Profile.objects.bulk_create([profile for _, profile, _ in rows])
+         ProfileTagging.objects.bulk_create([
+            ProfileTagging(profile_id=user.id, tag_id=tag_id,
+                           added_by_id=user.id, is_self_added=True)
+            for user, (_, _, tags) in zip(users, rows) for tag_id in tags
+         ], batch_size=self.sizes['batch_size'])
+      self.counts['users'] = self.counts.get('users', 0) + len(users)
+      return [user.id for user in users]
+
+   def make_user(self, number, password_hash):
+      """An unsaved (user, profile) pair"""
+      first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+      city, state, country = self.rng.choice(PLACES)
+      profile = Profile(
+         user_type=self.rng.choice(USER_TYPES), first_name=first,
+         last_name=last, city=city, state=state, country=country,
+         years_of_experience=min(40, int(self.rng.expovariate(1 / 6))),
+         description=f'{first} serves in {city}, {country}.',
+         is_anonymous=self.rng.random() < 0.05)
+      geocode_profile(profile)
+      user = User(username=f'{self.prefix}{number:07d}',
+                  email=f'{self.prefix}{number:07d}@example.org',
+                  first_name=first, last_name=last, password=password_hash)
+      return user, profile
+
+   def pick_tags(self, tag_ids, tag_weights):
+      mean = self.sizes['tags_per_profile']
+      count = min(len(tag_ids), max(0, int(self.rng.gauss(mean, mean / 2))))
+      tags = set()
+      while len(tags) < count:
+         tags.add(self.rng.choices(tag_ids, weights=tag_weights)[0])
+      return sorted(tags)
+
+   def create_votes(self, user_ids):
+      rng = self.rng
+      # A heavy-tailed popularity score decides who gets voted on
+      popularity = [rng.paretovariate(1.2) for _ in user_ids]
+      votes, comments = [], []
+      per_user = min(self.sizes['votes_per_user'], len(user_ids) - 1)
+      for voter_id in user_ids:
+         targets = set()
+         for _ in range(per_user * 3):
+            if len(targets) >= per_user:
+               break
+            target = rng.choices(user_ids, weights=popularity)[0]
+            if target != voter_id:
+               targets.add(target)
+         for target in sorted(targets):
+            votes.append(ProfileVote(voter_id=voter_id, profile_id=target,
+                                     is_upvote=rng.random() < 0.85))
+            # The API only lets voters comment
+            if rng.random() < self.sizes['comment_ratio']:
+               comments.append(ProfileComment(
+                  commenter_id=voter_id, profile_id=target,
+                  comment=rng.choice(COMMENTS)))
+      with transaction.atomic():
+         ProfileVote.objects.bulk_create(
+            votes, batch_size=self.sizes['batch_size'])
+         ProfileComment.objects.bulk_create(
+            comments, batch_size=self.sizes['batch_size'])
+      self.counts['votes'] = len(votes)
+      self.counts['comments'] = len(comments)
+
+   def create_friendships(self, user_ids):
+      rng = self.rng
+      pairs = set()
+      # Each user starts about half of their friendships
+      per_user = min(self.sizes['friends_per_user'] // 2, len(user_ids) - 1)
+      for sender_id in user_ids:
+         for receiver_id in rng.sample(user_ids, per_user + 1):
+            if receiver_id != sender_id and \
+                  (receiver_id, sender_id) not in pairs:
+               pairs.add((sender_id, receiver_id))
+      friendships = [
+         Friendship(sender_id=sender_id, receiver_id=receiver_id,
+                    status=rng.choice(FRIENDSHIP_STATUSES))
+         for sender_id, receiver_id in sorted(pairs)
+      ]
+      with transaction.atomic():
+         friendships = Friendship.objects.bulk_create(
+            friendships, batch_size=self.sizes['batch_size'])
+      self.counts['friendships'] = len(friendships)
+      return friendships
+
+   def create_notifications(self, user_ids, friendships):
+      rng = self.rng
+      notifications = [
+         Notification(recipient_id=friendship.receiver_id,
+                      notification_type='friend_request',
+                      message='You have a new friend request',
+                      related_object_id=friendship.id,
+                      is_read=rng.random() < 0.5)
+         for friendship in friendships if friendship.status == 'pending'
+      ]
+      most = self.sizes['notifications_per_user'] * 2
+      for user_id in user_ids:
+         for _ in range(rng.randint(0, most)):
+            notifications.append(Notification(
+               recipient_id=user_id, notification_type='general',
+               message='Someone viewed your profile',
+               is_read=rng.random() < 0.7))
+      with transaction.atomic():
+         Notification.objects.bulk_create(
+            notifications, batch_size=self.sizes['batch_size'])
+      self.counts['notifications'] = len(notifications)
@@ -0,0 +1,262 @@
+"""
+A small task queue on the Task table, so request side effects can run
+outside the request without a separate broker.
+
+   @task(batch=True)
+   def send_emails(payloads): ...
+
+   enqueue(send_emails, {'user_id': 1}, idempotency_key='welcome:1')
+
+Until a worker is deployed, with TASK_QUEUE['WORKER'] off, tasks run
+in-process as soon as the enqueuing transaction commits; tasks queued
+with a delay run in a timer thread once due, so the ones queued meanwhile
+run together, off the request. `manage.py run_tasks` claims ready tasks,
+runs them in a thread or process pool and retries failures with
+exponential backoff. On Postgres, workers
+claim with SELECT ... FOR UPDATE SKIP LOCKED and never wait on each
+other; elsewhere a guarded UPDATE makes sure each task is claimed once.
+Handlers must be safe to run twice: a worker can die after the work is
+done but before the task is marked done.
+"""
+import threading
+import traceback
+import uuid
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Task
+
+DEFAULT_TASK_QUEUE = {
+   # Whether manage.py run_tasks runs the tasks; without a worker they run
+   # in-process after the enqueuing transaction commits, or once due
+   'WORKER': False,
+   'MAX_ATTEMPTS': 5,
+   'RETRY_DELAY': 10,
+   'LEASE_SECONDS': 300,
+}
+
+registry = {}
+
+
+def queue_settings():
+   return {**DEFAULT_TASK_QUEUE, **getattr(settings, 'TASK_QUEUE', {})}
+
+
+class TaskHandler:
+   def __init__(self, func, batch, max_attempts, atomic):
+      self.func = func
+      self.name = func.task_name
+      self.batch = batch
+      self.max_attempts = max_attempts
+      self.atomic = atomic
+
+
+def task(name=None, batch=False, max_attempts=None, atomic=True):
+   """
+   Register a task handler. Batch handlers are called with a list of
+   payloads, so the worker can run many queued tasks of the same type
+   together; other handlers are called with one payload. Handlers run in
+   a transaction unless atomic=False, for ones that commit in steps.
+   """
+   def register(func):
+      func.task_name = name or f'{func.__module__}.{func.__name__}'
+      handler = TaskHandler(func, batch, max_attempts, atomic)
+      registry[handler.name] = handler
+      return func
+   return register
+
+
+def enqueue(handler, payload=None, idempotency_key=None, delay=0):
+   """
+   Queue a task. Inside a transaction it is only visible to workers once
+   the transaction commits, and is dropped if it rolls back. A task whose
+   idempotency_key was already used is not queued again. Without a worker
+   the task runs once the transaction commits, or right away outside one;
+   a delayed task runs in a timer thread once due.
+   """
+   name = getattr(handler, 'task_name', handler)
+   config = queue_settings()
+   row = Task(
+      name=name, payload=payload or {}, idempotency_key=idempotency_key,
+      max_attempts=(registry[name].max_attempts if name in registry
+                    else None) or config['MAX_ATTEMPTS'],
+      run_after=timezone.now() + timedelta(seconds=delay))
+   Task.objects.bulk_create([row], ignore_conflicts=True)
+   if not config['WORKER'] and delay:
+      transaction.on_commit(lambda: run_later(name, delay))
+   elif not config['WORKER']:
+      # The first callback of a transaction runs every task queued in it
+      transaction.on_commit(lambda: run_ready(names=[name]))
+
+
+def claim(limit, names=None):
+   """Mark up to `limit` ready tasks as running and return them"""
+   now = timezone.now()
+   ready = Q(status=Task.QUEUED, run_after__lte=now) | \
+      Q(status=Task.RUNNING, locked_until__lt=now)
+   queryset = Task.objects.filter(ready)
+   if names:
+      queryset = queryset.filter(name__in=names)
+   queryset = queryset.order_by('run_after', 'id')
+
+   token = str(uuid.uuid4())
+   database = router.db_for_write(Task)
+   with transaction.atomic(using=database):
+      if connections[database].features.has_select_for_update_skip_locked:
+         queryset = queryset.select_for_update(skip_locked=True)
+      ids = list(queryset.values_list('id', flat=True)[:limit])
+      if not ids:
+         return []
+      # Re-checking readiness keeps two workers that selected the same
+      # rows (no row locks on SQLite) from both claiming them
+      Task.objects.filter(ready, id__in=ids).update(
+         status=Task.RUNNING, claimed_by=token, attempts=F('attempts') + 1,
+         locked_until=now + timedelta(
+            seconds=queue_settings()['LEASE_SECONDS']))
+   return list(Task.objects.filter(claimed_by=token, status=Task.RUNNING)
+               .order_by('run_after', 'id'))
+
+
+def group_by_name(tasks):
+   """{(name, claim token): ids} of claimed tasks"""
+   groups = {}
+   for row in tasks:
+      groups.setdefault((row.name, row.claimed_by), []).append(row.id)
+   return groups
+
+
+def run_group(name, ids, claimed_by):
+   """
+   Run tasks of one type claimed with the `claimed_by` token and record
+   the outcome. A batch handler gets all of them in one call and one
+   transaction; otherwise each task succeeds or fails on its own. Tasks
+   whose lease ran out and were claimed again since are left alone.
+   Returns (done, failed).
+   """
+   tasks = list(Task.objects.filter(id__in=ids, claimed_by=claimed_by,
+                                    status=Task.RUNNING).order_by('id'))
+   handler = registry.get(name)
+   if handler is None:
+      return 0, fail(tasks, f'No task handler registered as "{name}"',
+                     retry=False)
+
+   done = failed = 0
+   for chunk, error in outcomes(handler, tasks):
+      if error is None:
+         done += finish(chunk)
+      else:
+         failed += fail(chunk, error)
+   return done, failed
+
+
+def outcomes(handler, tasks):
+   """(tasks, error) for each call of the handler; error None on success"""
+   chunks = [tasks] if handler.batch else [[row] for row in tasks]
+   for chunk in filter(None, chunks):
+      error = call(handler, chunk)
+      if error is not None and len(chunk) > 1:
+         # Run the batch's tasks one by one, so only the bad ones fail
+         for row in chunk:
+            yield [row], call(handler, [row])
+      else:
+         yield chunk, error
+
+
+def call(handler, tasks):
+   """Run the handler on the tasks' payloads; the traceback if it raised"""
+   payloads = [row.payload for row in tasks]
+   try:
+      with transaction.atomic() if handler.atomic else nullcontext():
+         handler.func(payloads if handler.batch else payloads[0])
+   except Exception:  # pylint: disable=broad-except
+      return traceback.format_exc()
+   return None
+
+
+def still_claimed(row):
+   return Task.objects.filter(id=row.id, claimed_by=row.claimed_by,
+                              status=Task.RUNNING)
+
+
+def finish(tasks):
+   """Mark the tasks done; returns how many were still claimed"""
+   claimed_by = {row.claimed_by for row in tasks}
+   return Task.objects.filter(
+      id__in=[row.id for row in tasks], claimed_by__in=claimed_by,
+      status=Task.RUNNING,
+   ).update(status=Task.DONE, finished_at=timezone.now(), claimed_by=None,
+            locked_until=None, last_error='')
+
+
+def fail(tasks, error, retry=True):
+   """
+   Requeue tasks with exponential backoff, or mark them failed once they
+   have used max_attempts. Returns the number marked failed.
+   """
+   now = timezone.now()
+   delay = queue_settings()['RETRY_DELAY']
+   failed = 0
+   for row in tasks:
+      if retry and row.attempts < row.max_attempts:
+         changes = {'status': Task.QUEUED, 'run_after': now + timedelta(
+            seconds=delay * 2 ** (row.attempts - 1))}
+      else:
+         changes = {'status': Task.FAILED, 'finished_at': now}
+      if still_claimed(row).update(claimed_by=None, locked_until=None,
+                                   last_error=error, **changes) and \
+            changes['status'] == Task.FAILED:
+         failed += 1
+   return failed
+
+
+def run_ready(limit=100, names=None, executor=None, runner=run_group):
+   """
+   Claim and run one round of ready tasks, calling runner(name, ids,
+   claimed_by) for each type, through executor.map if given. Returns
+   (claimed, done, failed); retried tasks count as neither done nor failed.
+   """
+   tasks = claim(limit, names)
+   groups = group_by_name(tasks)
+   results = list((executor.map if executor else map)(
+      runner, [name for name, _ in groups], groups.values(),
+      [token for _, token in groups]))
+   return (len(tasks), sum(done for done, _ in results),
+           sum(failed for _, failed in results))
+
+
+_timers = {}
+_timers_lock = threading.Lock()
+
+
+def run_later(name, delay):
+   """
+   Without a worker, run the tasks called `name` in a thread after `delay`
+   seconds. While one timer per name is pending, later calls only add
+   their tasks to its run.
+   """
+   with _timers_lock:
+      if name in _timers:
+         return
+      timer = _timers[name] = threading.Timer(delay, run_due, (name,))
+   timer.daemon = True
+   timer.start()
+
+
+def run_due(name):
+   with _timers_lock:
+      _timers.pop(name, None)
+   try:
+      run_ready(names=[name])
+      # Tasks queued while the timer ran, and retries, get a timer of
+      # their own
+      due = Task.objects.filter(name=name, status=Task.QUEUED) \
+         .order_by('run_after').values_list('run_after', flat=True).first()
+      if due is not None:
+         run_later(name, max((due - timezone.now()).total_seconds(), 0))
+   finally:
+      connections.close_all()
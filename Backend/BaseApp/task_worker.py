@@ -0,0 +1,28 @@
+"""
+Entry points for the run_tasks worker pool. They import the ORM lazily so
+spawned worker processes can load this module before Django is set up.
+"""
+import importlib
+
+import django
+from django.apps import apps
+from django.db import close_old_connections
+
+
+def init_worker(modules):
+   if not apps.ready:
+      django.setup()
+   for module in modules:
+      importlib.import_module(module)
+
+
+def run_group_in_worker(name, ids, claimed_by):
+   # pylint: disable=import-outside-toplevel
+   from .task_queue import run_group
+
+   # Pool workers keep their own connections between groups
+   close_old_connections()
+   try:
+      return run_group(name, ids, claimed_by)
+   finally:
+      close_old_connections()
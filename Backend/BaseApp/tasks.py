@@ -0,0 +1,64 @@
+"""Side effects of API requests, run by `manage.py run_tasks`"""
+from .deletion import delete_user
+from .directory_snapshot import build_snapshot, snapshot_exists, \
+    snapshot_settings
+from .models import Notification
+from .task_queue import enqueue, task
+
+
+@task(batch=True)
+def notify_friend_requests(payloads):
+   # Skip requests already notified about, in case a batch runs twice
+   notified = set(Notification.objects.filter(
+      notification_type='friend_request',
+      related_object_id__in=[p['friendship_id'] for p in payloads],
+   ).values_list('related_object_id', flat=True))
+   Notification.objects.bulk_create([
+      Notification(
+         recipient_id=payload['receiver_id'],
+         notification_type='friend_request',
+         message=f"{payload['sender_username']} sent you a friend request",
+         related_object_id=payload['friendship_id'])
+      for payload in payloads if payload['friendship_id'] not in notified
+   ])
+
+
+def queue_friend_request_notification(friendship, sender):
+   enqueue(notify_friend_requests, {
+      'friendship_id': friendship.id,
+      'receiver_id': friendship.receiver_id,
+      'sender_username': sender.username,
+   }, idempotency_key=f'friend-request:{friendship.id}')
+
+
+# Commits batch by batch, so a retry carries on where a failure stopped
+@task(atomic=False)
+def delete_user_data(payload):
+   delete_user(payload['user_id'], batch_size=payload.get('batch_size', 900))
+   queue_directory_refresh(full=True)
+
+
+def queue_user_deletion(user_id, batch_size=900):
+   enqueue(delete_user_data, {'user_id': user_id, 'batch_size': batch_size},
+           idempotency_key=f'delete-user:{user_id}')
+
+
+# Renders files rather than writing rows, so no transaction
+@task(batch=True, atomic=False)
+def refresh_directory_snapshot(payloads):
+   if any(payload.get('full') for payload in payloads):
+      build_snapshot()
+   else:
+      build_snapshot(changed_ids={profile_id for payload in payloads
+                                  for profile_id in payload['profile_ids']})
+
+
+def queue_directory_refresh(profile_ids=(), full=False):
+   """
+   Rebuild the directory snapshot's pages holding profile_ids, and any
+   whose members changed; full=True renders every page
+   """
+   if snapshot_exists():
+      enqueue(refresh_directory_snapshot,
+              {'profile_ids': list(profile_ids), 'full': full},
+              delay=snapshot_settings()['REFRESH_DELAY'])
@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..models import Tag, Profile, ProfileTagging, ProfileVote, \
+    ProfileComment, Notification, Friendship, SearchHistory, ExternalMedia
+
+
+def seed_dataset(fixtures, start, stop):
+   """
+   Add profiles start..stop-1, each with tags, votes, comments, friendships,
+   notifications, search history and media around the viewer.
+   """
+   viewer = fixtures['viewer_user']
+   tags = fixtures['tags']
+   for i in range(start, stop):
+      user = User.objects.create_user(
+         username=f'member{i}', password='budget-password',
+         email=f'member{i}@example.org')
+      profile = Profile.objects.create(
+         user=user, user_type='supporter' if i % 2 else 'missionary',
+         first_name=f'Member{i}', last_name='Budget', city='Springfield',
+         country='USA', years_of_experience=i % 10)
+      for tag in tags[i % 3:i % 3 + 3]:
+         ProfileTagging.objects.create(profile=profile, tag=tag,
+                                       added_by=user)
+      ProfileVote.objects.create(voter=user, profile=fixtures['viewer'],
+                                 is_upvote=bool(i % 3))
+      ProfileComment.objects.create(commenter=user,
+                                    profile=fixtures['viewer'],
+                                    comment=f'Comment {i}')
+      Friendship.objects.create(sender=user, receiver=viewer,
+                                status='accepted' if i % 2 else 'pending')
+      Notification.objects.create(recipient=viewer,
+                                  notification_type='general',
+                                  message=f'Notification {i}')
+      SearchHistory.objects.create(user=viewer, search_text=f'search {i}',
+                                   search_parameters={'q': str(i)})
+      ExternalMedia.objects.create(user=user,
+                                   media_url=f'https://example.org/{i}.png',
+                                   description=f'Media {i}')
+
+
+def create_members(tags):
+   """Users and profiles by name, the viewer and other sharing three tags"""
+   users, profiles = {}, {}
+   for name, user_type, extra in (
+         ('viewer', 'missionary', {}),
+         ('admin', 'missionary', {'is_staff': True, 'is_superuser': True}),
+         ('other', 'supporter', {}), ('stranger', 'supporter', {}),
+         ('victim', 'missionary', {})):
+      users[name] = User.objects.create_user(
+         username=name, password='budget-password', **extra)
+      profiles[name] = Profile.objects.create(
+         user=users[name], user_type=user_type, first_name=name)
+   for tag in tags[:3]:
+      for name in ('viewer', 'other'):
+         ProfileTagging.objects.create(profile=profiles[name], tag=tag,
+                                       added_by=users[name])
+   for voter, profile, is_upvote in (('viewer', 'other', True),
+                                     ('viewer', 'victim', True),
+                                     ('victim', 'other', False)):
+      ProfileVote.objects.create(voter=users[voter],
+                                 profile=profiles[profile],
+                                 is_upvote=is_upvote)
+   return users, profiles
+
+
+def create_fixtures():
+   tags = [Tag.objects.create(tag_name=f'Tag {i}') for i in range(6)]
+   spare_tag = Tag.objects.create(tag_name='Unused tag')
+   users, profiles = create_members(tags)
+   comment = ProfileComment.objects.create(
+      commenter=users['viewer'], profile=profiles['victim'], comment='Hello')
+   victim_comment = ProfileComment.objects.create(
+      commenter=users['victim'], profile=profiles['other'], comment='Spam')
+   pending = Friendship.objects.create(sender=users['other'],
+                                       receiver=users['viewer'])
+   return {
+      'tags': tags, 'viewer_user': users['viewer'],
+      'viewer': profiles['viewer'],
+      'ids': {
+         **{name: user.id for name, user in users.items()
+            if name != 'admin'},
+         'tag': tags[0].id, 'spare_tag': spare_tag.id,
+         'comment': comment.id, 'victim_comment': victim_comment.id,
+         'pending': pending.id,
+         'notification': Notification.objects.create(
+            recipient=users['viewer'], notification_type='friend_request',
+            message='other sent you a friend request',
+            related_object_id=pending.id).id,
+         'history': SearchHistory.objects.create(
+            user=users['viewer'], search_text='x', search_parameters={}).id,
+         'media': ExternalMedia.objects.create(
+            user=users['viewer'], media_url='https://example.org/v.png',
+            description='Viewer media').id,
+      },
+      'users': {'viewer': users['viewer'], 'admin': users['admin']},
+   }
+
+
+def authenticated_client(user):
+   client = APIClient()
+   client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+   return client
@@ -0,0 +1,27 @@
+"""
+Runs the tests with SHARED_MEMORY_PREFIX in a temporary directory, so the
+cache, throttle and response cache files of a server on the same host are
+never read, or cleared, by a test.
+"""
+import os
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class SharedFilesRunner(DiscoverRunner):
+   def __init__(self, *args, **kwargs):
+      super().__init__(*args, **kwargs)
+      self.shared = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.prefix = override_settings(
+         SHARED_MEMORY_PREFIX=os.path.join(self.shared.name, 'test'))
+
+   def setup_test_environment(self, **kwargs):
+      self.prefix.enable()
+      super().setup_test_environment(**kwargs)
+
+   def teardown_test_environment(self, **kwargs):
+      super().teardown_test_environment(**kwargs)
+      self.prefix.disable()
+      self.shared.cleanup()
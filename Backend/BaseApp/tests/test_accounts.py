@@ -0,0 +1,213 @@
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .. import importer
+from ..authentication import ProfileTokenObtainPairSerializer, changed_key, \
+    mark_changed, user_cache
+from ..importer import ImportResult
+from ..models import Profile, ProfileComment, Task
+from ..pagination import exact_count_key
+from .helpers import authenticated_client
+
+
+class TokenUserCacheTests(TestCase):
+   def setUp(self):
+      cache.clear()
+      user_cache.clear()
+      self.user = User.objects.create_user(username='member', password='x')
+      self.admin = User.objects.create_user(username='staff', password='x',
+                                            is_staff=True)
+      for user in (self.user, self.admin):
+         Profile.objects.create(user=user, user_type='supporter')
+
+   def client_with_claims(self, user):
+      token = ProfileTokenObtainPairSerializer.get_token(user).access_token
+      client = APIClient()
+      client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+      return client
+
+   def test_changes_made_by_other_workers_apply_at_once(self):
+      client = authenticated_client(self.user)
+      self.assertEqual(client.get('/api/profiles/me/').status_code, 200)
+      # Another worker deactivates the user; this one only sees the mark
+      User.objects.filter(pk=self.user.pk).update(is_active=False)
+      self.assertEqual(client.get('/api/profiles/me/').status_code, 200)
+      mark_changed(self.user.pk)
+      self.assertEqual(client.get('/api/profiles/me/').status_code, 401)
+
+   @override_settings(TOKEN_USER_CACHE={'TRUST_CLAIMS': True})
+   def test_trusted_claims_grant_no_privileges(self):
+      member = self.client_with_claims(self.user)
+      staff = self.client_with_claims(self.admin)
+      for user in (self.user, self.admin):
+         cache.set(changed_key(user.pk), 0.0, timeout=None)
+      User.objects.update(is_staff=False)
+      # Taken from the token without reading the user...
+      User.objects.filter(pk=self.user.pk).update(is_active=False)
+      self.assertEqual(member.get('/api/profiles/me/').status_code, 200)
+      # ...but staff is checked against the database
+      self.assertEqual(staff.get('/api/admin/profiles/').status_code, 403)
+
+      # Tokens issued before a change aren't trusted
+      self.user.is_active = False
+      self.user.save()
+      self.assertEqual(member.get('/api/profiles/me/').status_code, 401)
+
+
+class ProfileImportTests(TestCase):
+   def setUp(self):
+      User.objects.create_user(username='taken', password='x')
+      admin = User.objects.create_user(username='importer', password='x',
+                                       is_staff=True)
+      self.client = authenticated_client(admin)
+
+   def test_rows_are_validated_one_by_one(self):
+      lines = [
+         'username,password,email,first_name,city,years_of_experience',
+         'ok,secret,ok@example.org,Okay,Springfield,3',
+         f"long,secret,long@example.org,{'x' * 101},,",
+         'mail,secret,not-an-email,,,',
+         'taken,secret,,,,',
+         'ok,secret,,,,',
+         'bad name!,secret,,,,',
+         ',secret,,,,',
+         'years,secret,,,,many',
+      ]
+      upload = SimpleUploadedFile('people.csv',
+                                  '\n'.join(lines).encode(), 'text/csv')
+      # Hashed in the request's own process
+      with mock.patch('BaseApp.importer.ProcessPoolExecutor',
+                      side_effect=AssertionError):
+         response = self.client.post('/api/admin/profiles/import/',
+                                     {'file': upload}, format='multipart')
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual((response.data['rows'], response.data['created'],
+                        response.data['failed']), (8, 1, 7))
+      failed = {error['row']: set(error['errors'])
+                for error in response.data['errors']}
+      self.assertEqual(failed, {2: {'first_name'}, 3: {'email'},
+                                4: {'username'}, 5: {'username'},
+                                6: {'username'}, 7: {'username'},
+                                8: {'years_of_experience'}})
+      profile = Profile.objects.get(user__username='ok')
+      self.assertEqual((profile.first_name, profile.city,
+                        profile.years_of_experience),
+                       ('Okay', 'Springfield', 3))
+      self.assertEqual(User.objects.count(), 3)
+
+   def test_command_streams_errors_and_refreshes_like_the_endpoint(self):
+      directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(directory.cleanup)
+      path = os.path.join(directory.name, 'people.csv')
+      with open(path, 'w', encoding='utf-8') as f:
+         f.write('username,password\nnew,secret\n' +
+                 'taken,secret\n' * 3)
+      with mock.patch.object(importer, 'queue_directory_refresh') as refresh, \
+            mock.patch.object(importer, 'invalidate_user') as invalidate:
+         call_command('import_profiles', path, workers=1, chunk_size=2,
+                      stdout=io.StringIO())
+      created = User.objects.get(username='new').pk
+      refresh.assert_any_call([created])
+      invalidate.assert_called_once_with(created)
+      with open(f'{path}.errors.ndjson', encoding='utf-8') as f:
+         self.assertEqual(sorted(json.loads(line)['row'] for line in f),
+                          [2, 3, 4])
+
+      result = ImportResult(error_limit=1)
+      result.add_error(1, {'username': 'Taken'})
+      result.add_error(2, {'username': 'Taken'})
+      self.assertEqual((result.failed, len(result.errors)), (2, 1))
+
+
+class AdminPaginationTests(TestCase):
+   def setUp(self):
+      cache.clear()
+      admin = User.objects.create_user(username='moderator', password='x',
+                                       is_staff=True)
+      self.profile = Profile.objects.create(user=admin)
+      for i in range(7):
+         self.comment(i)
+      # Every created_at ties, so the id decides the order
+      ProfileComment.objects.update(created_at=ProfileComment.objects.first()
+                                    .created_at)
+      self.client = authenticated_client(admin)
+
+   def comment(self, i):
+      # One comment per commenter and profile
+      commenter = User.objects.create_user(username=f'commenter{i}')
+      ProfileComment.objects.create(commenter=commenter,
+                                    profile=self.profile, comment=str(i))
+
+   def comments(self, url):
+      data = self.client.get(url).json()
+      return [int(row['comment']) for row in data['results']], data
+
+   def test_cursors_walk_both_ways_through_ties(self):
+      pages, url = [], '/api/admin/comments/?page_size=3'
+      while url:
+         page, data = self.comments(url)
+         pages.append(page)
+         url = data['next']
+      self.assertEqual(pages, [[6, 5, 4], [3, 2, 1], [0]])
+
+      backward = []
+      while data['previous']:
+         page, data = self.comments(data['previous'])
+         backward.append(page)
+      self.assertEqual(backward, [[3, 2, 1], [6, 5, 4]])
+
+      # Rows added meanwhile don't shift the next page
+      _, data = self.comments('/api/admin/comments/?page_size=3')
+      self.comment(7)
+      self.assertEqual(self.comments(data['next'])[0], [3, 2, 1])
+
+   @override_settings(TASK_QUEUE={'WORKER': True})
+   def test_cached_counts_are_estimates(self):
+      _, data = self.comments('/api/admin/comments/')
+      self.assertEqual((data['count'], data['count_is_estimate']),
+                       (7, False))
+
+      cache.set(exact_count_key(ProfileComment), (7, time.time()))
+      _, data = self.comments('/api/admin/comments/')
+      self.assertEqual((data['count'], data['count_is_estimate']), (7, True))
+      self.assertFalse(Task.objects.exists())
+
+      # Once stale, a recount is queued rather than run in the request
+      cache.set(exact_count_key(ProfileComment), (7, time.time() - 3600))
+      for _ in range(2):
+         self.comments('/api/admin/comments/')
+      self.assertEqual(list(Task.objects.values_list('payload', flat=True)),
+                       [{'model': 'BaseApp.ProfileComment'}])
+
+
+class AdminBulkDeleteTests(TestCase):
+   def setUp(self):
+      admin = User.objects.create_user(username='moderator', is_staff=True)
+      profile = Profile.objects.create(user=admin)
+      commenter = User.objects.create_user(username='commenter')
+      ProfileComment.objects.create(commenter=commenter, profile=profile,
+                                    comment='spam')
+      self.client = authenticated_client(admin)
+
+   def test_blank_filters_are_rejected(self):
+      for criteria in ({}, {'text': ''}, {'text': ' '}):
+         response = self.client.post('/api/admin/comments/bulk-delete/',
+                                     {'filter': criteria}, format='json')
+         self.assertEqual(response.status_code, 400)
+      self.assertEqual(ProfileComment.objects.count(), 1)
+
+      response = self.client.post('/api/admin/comments/bulk-delete/',
+                                  {'filter': {'text': ' spam '}},
+                                  format='json')
+      self.assertEqual(response.json()['deleted'], 1)
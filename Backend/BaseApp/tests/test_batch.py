@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .. import batch
+from ..models import Profile
+from .helpers import authenticated_client
+
+
+class BatchRequestTests(TestCase):
+   @classmethod
+   def setUpTestData(cls):
+      cls.user = User.objects.create_user(username='member')
+      Profile.objects.create(user=cls.user, user_type='supporter')
+
+   def post(self, requests, client=None):
+      return (client or authenticated_client(self.user)).post(
+         '/api/batch/', {'requests': requests}, format='json')
+
+   def test_sub_requests_run_as_the_batch_user(self):
+      responses = self.post(['/api/profiles/me/', '/tag/']).json()['responses']
+      self.assertEqual([row['status'] for row in responses], [200, 200])
+      self.assertEqual(responses[0]['body']['user']['username'], 'member')
+
+      anonymous = self.post(['/api/profiles/me/', '/tag/'], APIClient())
+      self.assertEqual([row['status'] for row in
+                        anonymous.json()['responses']], [401, 200])
+
+      forged = APIClient()
+      forged.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+      self.assertEqual(self.post(['/tag/'], forged).status_code, 401)
+
+   @override_settings(BATCH_REQUESTS={'MAX_REQUESTS': 2})
+   def test_batches_are_capped(self):
+      self.assertEqual(self.post(['/tag/'] * 2).status_code, 200)
+      self.assertEqual(self.post(['/tag/'] * 3).status_code, 400)
+      self.assertEqual(self.post([]).status_code, 400)
+
+   def test_only_local_gets_of_allowed_paths_are_batched(self):
+      for item in ({'path': '/tag/', 'method': 'POST'}, '/admin/',
+                   '/metrics', 'https://example.org/tag/', '//example.org/'):
+         self.assertEqual(self.post([item]).status_code, 400, item)
+      self.assertEqual(
+         authenticated_client(self.user).get('/api/batch/').status_code, 405)
+
+      nested = self.post(['/api/batch/', '/nowhere/']).json()['responses']
+      self.assertEqual([row['status'] for row in nested], [400, 404])
+
+   def test_repeated_sub_requests_run_once(self):
+      with mock.patch.object(batch, 'dispatch',
+                             wraps=batch.dispatch) as dispatch:
+         responses = self.post(['/tag/', '/api/profiles/me/', '/tag/'])
+      self.assertEqual(dispatch.call_count, 2)
+      responses = responses.json()['responses']
+      self.assertEqual(len(responses), 3)
+      self.assertEqual(responses[0], responses[2])
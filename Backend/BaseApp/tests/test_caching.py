@@ -0,0 +1,237 @@
+import gzip
+import json
+import os
+import tempfile
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+    override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..cache_backend import TieredCache
+from ..caching import shared_path
+from ..models import Tag
+from ..response_cache import Entry, ResponseCache, get_response_cache
+from ..routers import ReplicaRoutingMiddleware, read_alias
+from ..throttling import TokenBuckets
+
+
+class ThrottleTests(TestCase):
+   def setUp(self):
+      directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(directory.cleanup)
+      self.path = os.path.join(directory.name, 'throttle')
+      # A cached /tag/ wouldn't be charged
+      get_response_cache().clear()
+
+   def test_costly_requests_drain_the_bucket_faster(self):
+      buckets = TokenBuckets(self.path, 64)
+      for _ in range(10):
+         self.assertEqual(buckets.consume('ip:a', 1, 10, 60), 0)
+      self.assertAlmostEqual(buckets.consume('ip:a', 1, 10, 60), 6, places=0)
+      self.assertEqual(buckets.consume('ip:b', 5, 10, 60), 0)
+      self.assertEqual(buckets.consume('ip:b', 5, 10, 60), 0)
+      self.assertGreater(buckets.consume('ip:b', 1, 10, 60), 0)
+      # Another process mapping the same file sees the same buckets
+      self.assertGreater(TokenBuckets(self.path, 64).consume(
+         'ip:b', 1, 10, 60), 0)
+
+   def test_throttled_requests_get_retry_after(self):
+      with override_settings(THROTTLE={
+            'PATH': self.path, 'RATES': {'user': '2/min', 'anon': '2/min'},
+            'COSTS': {'profile-page': 2}}):
+         client = APIClient()
+         self.assertEqual(client.get('/tag/').status_code, 200)
+         response = client.get('/api/profiles/1/page/')
+      self.assertEqual(response.status_code, 429)
+      self.assertEqual(response['Retry-After'], '30')
+
+   def test_forged_forwarded_for_headers_share_a_bucket(self):
+      with override_settings(THROTTLE={
+            'PATH': self.path, 'RATES': {'user': '2/min', 'anon': '2/min'},
+            'COSTS': {}}):
+         client = APIClient()
+         statuses = [client.get('/api/profiles/1/page/',
+                                HTTP_X_FORWARDED_FOR=f'10.0.0.{i}').status_code
+                     for i in range(3)]
+      self.assertEqual(statuses, [404, 404, 429])
+
+
+class ResponseCacheTests(TestCase):
+   def setUp(self):
+      directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(directory.cleanup)
+      overridden = override_settings(RESPONSE_CACHE={
+         'GENERATIONS_PATH': os.path.join(directory.name, 'generations')})
+      overridden.enable()
+      self.addCleanup(overridden.disable)
+      get_response_cache().clear()
+      Tag.objects.create(tag_name='Cached')
+
+   def tag_names(self, response):
+      body = response.content
+      if response.get('Content-Encoding') == 'gzip':
+         body = gzip.decompress(body)
+      return {tag['tag_name'] for tag in json.loads(body)}
+
+   def test_hits_skip_the_view_until_a_write(self):
+      client = APIClient()
+      first = client.get('/tag/', HTTP_ACCEPT_ENCODING='gzip')
+      self.assertEqual(first['Content-Encoding'], 'gzip')
+      self.assertIn('Accept-Encoding', first['Vary'])
+      with self.assertNumQueries(0):
+         hit = client.get('/tag/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+         plain = client.get('/tag/')
+      self.assertEqual(hit.content, first.content)
+      self.assertFalse(plain.has_header('Content-Encoding'))
+      self.assertEqual(self.tag_names(plain), {'Cached'})
+
+      Tag.objects.create(tag_name='New')
+      self.assertEqual(self.tag_names(client.get('/tag/')), {'Cached', 'New'})
+      # Not for signed-in users
+      user = User.objects.create_user(username='tagger', password='x')
+      client.credentials(
+         HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+      response = client.get('/tag/', HTTP_ACCEPT_ENCODING='gzip')
+      self.assertFalse(response.has_header('Content-Encoding'))
+
+   async def test_async_requests_are_cached_the_same(self):
+      first = await self.async_client.get(
+         '/tag/', headers={'Accept-Encoding': 'gzip'})
+      self.assertEqual(first['Content-Encoding'], 'gzip')
+      # An update() sends no signal, so only a view call would see it
+      await Tag.objects.aupdate(tag_name='Renamed')
+      hit = await self.async_client.get(
+         '/tag/', headers={'Accept-Encoding': 'gzip'})
+      self.assertEqual(hit.content, first.content)
+      self.assertEqual(self.tag_names(hit), {'Cached'})
+
+   def test_least_recently_used_entries_go_over_budget(self):
+      responses = ResponseCache(max_bytes=300)
+      for key in 'abc':
+         responses.set(key, Entry({'identity': b'x' * 100},
+                                  'application/json', ((), ()), 0))
+      responses.get('a')
+      responses.set('d', Entry({'identity': b'x' * 100}, 'application/json',
+                               ((), ()), 0))
+      self.assertEqual(list(responses.entries), ['c', 'a', 'd'])
+      self.assertEqual(responses.size, 300)
+
+
+class TieredCacheTests(SimpleTestCase):
+   def setUp(self):
+      directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(directory.cleanup)
+      self.location = os.path.join(directory.name, 'cache.sqlite3')
+
+   def worker(self, **options):
+      # Each instance stands in for another process on the node
+      return TieredCache(self.location, {'OPTIONS': options})
+
+   def test_workers_share_l2_and_invalidate_each_others_l1(self):
+      first, second = self.worker(), self.worker()
+      first.set('exact-count:a', 1)
+      self.assertEqual(second.get('exact-count:a'), 1)
+      self.assertEqual(second.get('exact-count:a'), 1)
+      first.set('exact-count:a', 2)
+      self.assertEqual(second.get('exact-count:a'), 2)
+      self.assertFalse(second.add('exact-count:a', 3))
+      first.delete('exact-count:a')
+      self.assertIsNone(second.get('exact-count:a'))
+      self.assertEqual(second.stats(), {
+         'l1_hits': 1, 'l2_hits': 2, 'misses': 1, 'l2_evictions': 0,
+         'l1_evictions': 0, 'l1_entries': 1})
+
+      second.set('exact-count:b', 1)
+      second.set('replica-pin:1', True)
+      first.invalidate_namespace('exact-count')
+      self.assertIsNone(second.get('exact-count:b'))
+      self.assertTrue(second.get('replica-pin:1'))
+
+   def test_tiers_are_bounded(self):
+      worker = self.worker(L1_MAX_ENTRIES=2, MAX_ENTRIES=10)
+      for i in range(300):
+         worker.set(f'key:{i}', i)
+      worker.set('expired:a', 1, timeout=0)
+      self.assertIsNone(worker.get('expired:a'))
+      stats = worker.stats()
+      self.assertEqual(stats['l1_entries'], 2)
+      self.assertEqual(stats['l1_evictions'], 298)
+      # Culled on the 256th set
+      self.assertEqual(stats['l2_evictions'], 246)
+      self.assertEqual(worker.get('key:299'), 299)
+
+   def test_shared_files_are_named_per_deployment(self):
+      # The test runner keeps them out of the way of a running server
+      self.assertTrue(caches['default'].l2.path.startswith(
+         settings.SHARED_MEMORY_PREFIX))
+      with override_settings(SHARED_MEMORY_PREFIX='/srv/app'):
+         self.assertEqual(shared_path('throttle'), '/srv/app-throttle')
+      paths = set()
+      for base_dir in ('/srv/one', '/srv/two'):
+         with override_settings(SHARED_MEMORY_PREFIX=None, BASE_DIR=base_dir):
+            paths.add(shared_path('throttle'))
+      self.assertEqual(len(paths), 2)
+
+
+@override_settings(READ_REPLICAS=['replica_0'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(SimpleTestCase):
+   """
+   Which database each request reads from. To try it against real
+   databases, point DATABASE_URL and DATABASE_REPLICA_URLS at two SQLite
+   files and copy the primary file over the replica.
+   """
+
+   def setUp(self):
+      cache.clear()
+      self.factory = RequestFactory()
+      token = AccessToken.for_user(User(id=42, username='reader'))
+      self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+   def read_alias_of(self, request, status=200):
+      seen = []
+
+      def view(request):  # pylint: disable=unused-argument
+         seen.append(read_alias.get())
+         return HttpResponse(status=status)
+      ReplicaRoutingMiddleware(view)(request)
+      return seen[0]
+
+   def test_safe_requests_read_from_replica(self):
+      self.assertEqual(self.read_alias_of(self.factory.get('/', **self.auth)),
+                       'replica_0')
+      self.assertEqual(self.read_alias_of(self.factory.get('/')), 'replica_0')
+
+   def test_unsafe_requests_read_from_primary(self):
+      self.assertIsNone(
+         self.read_alias_of(self.factory.post('/', **self.auth)))
+
+   def test_writer_is_pinned_to_primary(self):
+      self.read_alias_of(self.factory.post('/', **self.auth))
+      self.assertIsNone(self.read_alias_of(self.factory.get('/', **self.auth)))
+      # Other users still read from the replica
+      self.assertEqual(self.read_alias_of(self.factory.get('/')), 'replica_0')
+
+   async def test_async_requests_are_routed_the_same(self):
+      seen = []
+
+      async def view(request):
+         seen.append(read_alias.get())
+         return HttpResponse(status=200 if request.method == 'GET' else 201)
+      middleware = ReplicaRoutingMiddleware(view)
+      self.assertTrue(iscoroutinefunction(middleware))
+      await middleware(self.factory.get('/', **self.auth))
+      await middleware(self.factory.post('/', **self.auth))
+      await middleware(self.factory.get('/', **self.auth))
+      self.assertEqual(seen, ['replica_0', None, None])
+      self.assertIsNone(read_alias.get())
+
+   def test_failed_write_does_not_pin(self):
+      self.read_alias_of(self.factory.post('/', **self.auth), status=400)
+      self.assertEqual(self.read_alias_of(self.factory.get('/', **self.auth)),
+                       'replica_0')
@@ -0,0 +1,187 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import deletion
+from ..deletion import delete_user
+from ..management.commands.benchmark_load import percentile
+from ..models import Profile, ProfileVote, Notification, Friendship, \
+    SearchHistory, ProfileComment, ProfileTagging, Tag
+from ..retention import NotificationRetention, SearchHistoryRetention, \
+    apply_policy, delete_batch, measure_expired
+from ..synthetic import SyntheticDataset
+
+
+class RetentionTests(TestCase):
+   def setUp(self):
+      self.users = [User.objects.create_user(username=f'searcher{i}')
+                    for i in range(3)]
+      for user in self.users:
+         for i in range(7):
+            SearchHistory.objects.create(user=user, search_text=str(i),
+                                         search_parameters={})
+      old = timezone.now() - timedelta(days=100)
+      for i in range(6):
+         Notification.objects.create(recipient=self.users[0],
+                                     notification_type='general',
+                                     message=str(i), is_read=i % 2 == 0)
+      Notification.objects.update(created_at=old)
+
+   def test_search_history_keeps_each_users_latest(self):
+      policy = SearchHistoryRetention(keep_last=3)
+      self.assertEqual(measure_expired(policy, 100).rows, 12)
+      report = apply_policy(policy, batch_size=5)
+      self.assertEqual((report.rows, report.batches), (12, 3))
+      for user in self.users:
+         self.assertEqual(list(SearchHistory.objects.filter(
+            user=user).order_by('id').values_list('search_text', flat=True)),
+            ['4', '5', '6'])
+
+   def test_archive_holds_exactly_the_deleted_rows(self):
+      directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(directory.cleanup)
+      policy = NotificationRetention(max_age_days=90)
+      ids = policy.next_batch(10)
+      # Marked unread after being selected, so it has to stay
+      Notification.objects.filter(pk=ids[0]).update(is_read=False)
+      self.assertEqual(len(delete_batch(policy, ids, None)), 2)
+
+      report = apply_policy(NotificationRetention(read_only=False),
+                            archive_dir=directory.name)
+      self.assertEqual(report.rows, 4)
+      [name] = os.listdir(directory.name)
+      with gzip.open(os.path.join(directory.name, name), 'rt') as f:
+         archived = [json.loads(line)['id'] for line in f]
+      self.assertEqual(len(archived), 4)
+      self.assertFalse(Notification.objects.exists())
+
+
+class SyntheticDataTests(TestCase):
+   def rows(self, prefix):
+      dataset = SyntheticDataset(users=12, seed=7, prefix=prefix,
+                                 batch_size=5)
+      counts = dataset.generate()
+      profiles = Profile.objects.filter(user__username__startswith=prefix) \
+         .order_by('user__username')
+      return counts, [
+         (profile.first_name, profile.city, profile.is_anonymous,
+          sorted(profile.tags.values_list('id', flat=True)))
+         for profile in profiles]
+
+   def test_same_seed_same_rows(self):
+      counts, rows = self.rows('first')
+      self.assertEqual((counts, rows), self.rows('second'))
+      self.assertEqual(counts['users'], 12)
+      self.assertFalse(ProfileVote.objects.filter(
+         voter_id=F('profile_id')).exists())
+      pairs = Friendship.objects.values_list('sender_id', 'receiver_id')
+      self.assertEqual(len({frozenset(pair) for pair in pairs}), len(pairs))
+
+   def test_bad_sizes_are_rejected(self):
+      for sizes in ({'users': 0}, {'users': -3}, {'batch_size': 0},
+                    {'votes_per_user': -1}, {'comment_ratio': 2}):
+         with self.assertRaises(ValueError):
+            SyntheticDataset(**sizes)
+      with self.assertRaises(TypeError):
+         SyntheticDataset(friends=3)
+      with self.assertRaises(CommandError):
+         call_command('seed_data', users=0, stdout=io.StringIO())
+
+   def test_load_benchmark_needs_seeded_users(self):
+      with self.assertRaises(CommandError):
+         call_command('benchmark_load', prefix='nobody',
+                      stdout=io.StringIO())
+      self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+      self.assertIsNone(percentile([], 50))
+
+
+class DeleteUserTests(TestCase):
+   def setUp(self):
+      self.victim, self.other, self.third = [
+         User.objects.create_user(username=name)
+         for name in ('victim', 'other', 'third')]
+      profiles = [Profile.objects.create(user=user) for user in
+                  (self.victim, self.other, self.third)]
+      tag = Tag.objects.create(tag_name='Prayer')
+      for voter, profile in ((self.victim, profiles[1]),
+                             (self.other, profiles[0]),
+                             (self.third, profiles[1])):
+         ProfileVote.objects.create(voter=voter, profile=profile,
+                                    is_upvote=True)
+         ProfileComment.objects.create(commenter=voter, profile=profile,
+                                       comment='hi')
+      # Tagged by the victim, on someone else's profile
+      ProfileTagging.objects.create(profile=profiles[1], tag=tag,
+                                    added_by=self.victim)
+      ProfileTagging.objects.create(profile=profiles[0], tag=tag)
+      Friendship.objects.create(sender=self.victim, receiver=self.other)
+      Notification.objects.create(recipient=self.victim,
+                                  notification_type='general', message='x')
+      SearchHistory.objects.create(user=self.victim, search_text='x',
+                                   search_parameters={})
+
+   def remaining(self):
+      return {
+         'users': set(User.objects.values_list('username', flat=True)),
+         'votes': set(ProfileVote.objects.values_list(
+            'voter__username', 'profile__user__username')),
+         'comments': ProfileComment.objects.count(),
+         'taggings': set(ProfileTagging.objects.values_list(
+            'profile__user__username', 'added_by')),
+         'friendships': Friendship.objects.count(),
+         'notifications': Notification.objects.count(),
+         'searches': SearchHistory.objects.count(),
+      }
+
+   def test_only_the_users_rows_go(self):
+      report = delete_user(self.victim.pk, batch_size=1)
+      self.assertEqual(self.remaining(), {
+         'users': {'other', 'third'},
+         'votes': {('third', 'other')},
+         'comments': 1,
+         'taggings': {('other', None)},
+         'friendships': 0, 'notifications': 0, 'searches': 0,
+      })
+      self.assertEqual(report.deleted['BaseApp.ProfileVote'], 2)
+      self.assertEqual(report.updated, {'BaseApp.ProfileTagging': 1})
+      self.assertIsNone(delete_user(self.victim.pk))
+
+   def test_failure_leaves_an_inactive_user_to_delete_again(self):
+      delete = deletion.raw_delete
+
+      def failing(model, ids):
+         if model is ProfileComment:
+            raise DatabaseError('lost the connection')
+         return delete(model, ids)
+
+      with mock.patch.object(deletion, 'raw_delete', failing), \
+            self.assertRaises(DatabaseError):
+         delete_user(self.victim.pk)
+      self.victim.refresh_from_db()
+      self.assertFalse(self.victim.is_active)
+      # The comments, and the rows they block, are all still there
+      self.assertEqual(self.remaining()['comments'], 3)
+      self.assertIn('victim', self.remaining()['users'])
+
+      delete_user(self.victim.pk)
+      self.assertEqual(self.remaining()['users'], {'other', 'third'})
+      self.assertEqual(self.remaining()['comments'], 1)
+
+   def test_batches_fit_the_databases_parameter_limit(self):
+      with mock.patch.object(connection.features, 'max_query_params', 2):
+         deleter = deletion.BatchedDeleter(batch_size=1000)
+         deleter.delete(ProfileComment.objects.all())
+      self.assertEqual(deleter.report.deleted, {'BaseApp.ProfileComment': 3})
+      self.assertEqual(deleter.report.batches, 2)
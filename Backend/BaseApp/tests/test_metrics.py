@@ -0,0 +1,66 @@
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..metrics import RequestMetricsMiddleware, registry
+from ..models import Profile
+from .helpers import authenticated_client
+
+
+class MetricsAccessTests(TestCase):
+   @classmethod
+   def setUpTestData(cls):
+      cls.member = User.objects.create_user('member', password='pw')
+      cls.staff = User.objects.create_user('staff', password='pw',
+                                           is_staff=True)
+
+   @override_settings(REQUEST_METRICS={'TOKEN': None})
+   def test_only_staff_may_scrape_without_a_token(self):
+      self.assertEqual(APIClient().get('/metrics').status_code, 401)
+      self.assertEqual(
+         authenticated_client(self.member).get('/metrics').status_code, 401)
+      response = authenticated_client(self.staff).get('/metrics')
+      self.assertEqual(response.status_code, 200)
+      self.assertIn(b'saltnlight_requests_total', response.content)
+
+      client = APIClient()
+      client.force_login(self.staff)
+      self.assertEqual(client.get('/metrics').status_code, 200)
+
+   @override_settings(REQUEST_METRICS={'TOKEN': 'scrape-token'})
+   def test_the_token_lets_scrapers_in(self):
+      client = APIClient()
+      client.credentials(HTTP_AUTHORIZATION='Bearer scrape-token')
+      self.assertEqual(client.get('/metrics').status_code, 200)
+      client.credentials(HTTP_AUTHORIZATION='Bearer wrong-token')
+      self.assertEqual(client.get('/metrics').status_code, 401)
+      self.assertEqual(
+         authenticated_client(self.member).get('/metrics').status_code, 401)
+
+
+class RequestMetricsTests(TestCase):
+   @classmethod
+   def setUpTestData(cls):
+      cls.member = User.objects.create_user('member', password='pw')
+      Profile.objects.create(user=cls.member, user_type='supporter')
+
+   def setUp(self):
+      registry.reset()
+
+   async def test_async_views_are_timed_without_a_thread(self):
+      async def view(_request):
+         return None
+      self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(view)))
+
+      token = AccessToken.for_user(self.member)
+      response = await self.async_client.get(
+         '/api/async/profiles/me/',
+         headers={'Authorization': f'Bearer {token}'})
+      self.assertEqual(response.status_code, 200)
+      self.assertRegex(response['Server-Timing'],
+                       r'db;desc="[1-9]\d* queries"')
+      requests, _ = registry.collect()
+      self.assertEqual(
+         requests[('/api/async/profiles/me/', 'GET', 200)], 1)
@@ -0,0 +1,275 @@
+import json
+import os
+import re
+import time
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..authentication import user_cache
+from ..friend_graph import reset_friend_graph
+from ..matching import reset_match_features
+from ..response_cache import get_response_cache
+from ..throttling import get_buckets
+from .helpers import seed_dataset, create_fixtures
+
+# Dataset sizes the budgets are checked at; query counts must not grow
+# between the first and the last. The last is over the largest page size
+# (20), so an N+1 over a page shows up as growth
+DATASET_SIZES = [int(size) for size in os.environ.get(
+   'ROUTE_BUDGET_SIZES', '5,60').split(',')]
+# Write a JSON report of per-route costs here to compare between commits
+REPORT_PATH = os.environ.get('ROUTE_BUDGET_REPORT')
+DEFAULT_MAX_MS = 500
+
+
+class RouteCase:
+   """
+   One request against a route, with the status it must answer with and
+   the budget it must stay within. `options` are method, data, user and
+   data_format of the request, and max_ms.
+   """
+
+   def __init__(self, route, path, max_queries, status=200, **options):
+      self.route = route
+      self.path = path
+      self.max_queries = max_queries
+      self.status = status
+      self.max_ms = options.pop('max_ms', DEFAULT_MAX_MS)
+      self.request = {'method': 'get', 'data': None, 'user': 'viewer',
+                      'data_format': 'json', **options}
+
+   @property
+   def label(self):
+      return f"{self.request['method'].upper()} {self.route}"
+
+
+def import_file(ids):  # pylint: disable=unused-argument
+   return {'file': SimpleUploadedFile(
+      'import.ndjson', b'{"username": "imported", "password": "pw"}\n')}
+
+
+ROUTE_CASES = [
+   RouteCase('', '/', 0, user=None),
+   RouteCase('api/notifications/', '/api/notifications/', 3),
+   RouteCase('api/notifications/<pk>/',
+             '/api/notifications/{notification}/', 3),
+   RouteCase('api/notifications/mark-read/', '/api/notifications/mark-read/',
+             3, method='post', data={'up_to_id': 10 ** 9}),
+   RouteCase('api/notifications/unread-count/',
+             '/api/notifications/unread-count/', 3),
+   RouteCase('friendships/', '/friendships/', 3),
+   RouteCase('friendships/<pk>/', '/friendships/{pending}/', 3),
+   RouteCase('friendships/<pk>/respond/', '/friendships/{pending}/respond/',
+             4, method='post', data={'action': 'accept'}),
+   RouteCase('friendships/mutual/', '/friendships/mutual/?ids={other}', 3),
+   # The router's route to status() has no profile id to look up
+   RouteCase('friendships/status/', '/friendships/status/', 2, status=400),
+   RouteCase('friendships/suggestions/', '/friendships/suggestions/', 3),
+   RouteCase('tag/', '/tag/', 3),
+   RouteCase('tag/<pk>/', '/tag/{tag}/', 3),
+   RouteCase('tag/add-to-profile/', '/tag/add-to-profile/', 7,
+             method='post',
+             data={'profile_id': '{other}', 'tag_id': '{spare_tag}'}),
+   RouteCase('tag/remove-from-profile/', '/tag/remove-from-profile/', 8,
+             method='post', data={'profile_id': '{viewer}', 'tag_id': '{tag}'}),
+   RouteCase('searchhistory/', '/searchhistory/', 3),
+   RouteCase('searchhistory/<pk>/', '/searchhistory/{history}/', 3),
+   RouteCase('externalmedia/', '/externalmedia/', 3),
+   RouteCase('externalmedia/<pk>/', '/externalmedia/{media}/', 3),
+   RouteCase('api/profiles/', '/api/profiles/', 5),
+   RouteCase('api/profiles/<int:pk>/', '/api/profiles/{other}/', 5),
+   RouteCase('api/profiles/<int:pk>/media/', '/api/profiles/{viewer}/media/',
+             4),
+   RouteCase('api/profiles/<int:pk>/page/', '/api/profiles/{viewer}/page/',
+             5),
+   # Includes loading the matching features, done once per TTL
+   RouteCase('api/profiles/match', '/api/profiles/match', 8),
+   RouteCase('api/profiles/me/', '/api/profiles/me/', 5),
+   RouteCase('api/profiles/vote/', '/api/profiles/vote/', 5, method='post',
+             data={'profile': '{other}', 'is_upvote': False}),
+   RouteCase('api/profiles/comment/', '/api/profiles/comment/', 6, 201,
+             method='post', data={'profile': '{other}', 'comment': 'Hi'}),
+   RouteCase('api/profiles/comment/<int:pk>/',
+             '/api/profiles/comment/{comment}/', 5, method='patch',
+             data={'comment': 'Edited'}),
+   RouteCase('api/profiles/<int:profile_id>/vote-status/',
+             '/api/profiles/{other}/vote-status/', 3),
+   RouteCase('api/friendships/<int:pk>/respond/',
+             '/api/friendships/{pending}/respond/', 4, method='post',
+             data={'action': 'reject'}),
+   RouteCase('api/friendships/', '/api/friendships/', 6, 201, method='post',
+             data={'receiver': '{stranger}'}),
+   RouteCase('api/friendships/status/<int:profile_id>/',
+             '/api/friendships/status/{other}/', 5),
+   RouteCase('api/friendships/mutual/',
+             '/api/friendships/mutual/?ids={other},{stranger}', 3),
+   RouteCase('api/friendships/suggestions/',
+             '/api/friendships/suggestions/', 3),
+   RouteCase('api/search/', '/api/search/?q=member', 4),
+   RouteCase('api/dedicated-search/', '/api/dedicated-search/?q=member', 4),
+   RouteCase('api/async/search/', '/api/async/search/?q=member', 4),
+   RouteCase('api/async/profiles/match', '/api/async/profiles/match', 8),
+   RouteCase('api/async/profiles/me/', '/api/async/profiles/me/', 5),
+   RouteCase('api/async/profiles/<int:pk>/overview/',
+             '/api/async/profiles/{other}/overview/', 7),
+   # The sub-requests' own queries, with a single authentication
+   RouteCase('api/batch/', '/api/batch/', 11, method='post',
+             data=lambda ids: {'requests': [
+                '/api/profiles/me/', f"/api/profiles/{ids['other']}/",
+                '/api/async/profiles/me/']}),
+   RouteCase('api/admin/check-superuser/', '/api/admin/check-superuser/', 2,
+             user='admin'),
+   RouteCase('api/admin/profiles/', '/api/admin/profiles/', 5, user='admin'),
+   RouteCase('api/admin/profiles/import/', '/api/admin/profiles/import/', 8,
+             method='post', data=import_file, user='admin',
+             data_format='multipart', max_ms=5000),
+   # A SELECT of ids per dependent table, and a DELETE or UPDATE per
+   # table with rows
+   RouteCase('api/admin/profiles/<int:pk>/', '/api/admin/profiles/{victim}/',
+             25, 204, method='delete', user='admin'),
+   RouteCase('api/admin/comments/', '/api/admin/comments/', 4, user='admin'),
+   RouteCase('api/admin/comments/bulk-delete/',
+             '/api/admin/comments/bulk-delete/', 5, method='post',
+             data=lambda ids: {'filter': {'commenter': ids['victim']}},
+             user='admin'),
+   RouteCase('api/admin/comments/<int:pk>/',
+             '/api/admin/comments/{victim_comment}/', 4, 204, method='delete',
+             user='admin'),
+]
+
+
+def route_key(pattern):
+   # '^tag/(?P<pk>[^/.]+)/$' -> 'tag/<pk>/'
+   return re.sub(r'\(\?P<(\w+)>[^)]*\)', r'<\1>', pattern).strip('^$')
+
+
+def app_routes(patterns=None, prefix=''):
+   if patterns is None:
+      patterns = get_resolver('BaseApp.urls').url_patterns
+   for pattern in patterns:
+      if isinstance(pattern, URLResolver):
+         yield from app_routes(pattern.url_patterns,
+                               prefix + str(pattern.pattern))
+      elif 'format' not in str(pattern.pattern):
+         yield route_key(prefix + str(pattern.pattern))
+
+
+# Budgets count queries wherever they run, so keep reads on the primary
+@override_settings(READ_REPLICAS=[])
+class RouteBudgetTests(TestCase):
+   """
+   Query-count and latency budgets for every route in BaseApp/urls.py.
+
+   Each case runs at every size in DATASET_SIZES; a route fails if it goes
+   over its budget or if it needs more queries on the larger dataset.
+   """
+
+   def test_every_route_has_a_budget(self):
+      missing = set(app_routes()) - {case.route for case in ROUTE_CASES}
+      self.assertFalse(missing, f'Routes without a budget: {missing}')
+
+   def test_route_budgets(self):
+      costs = self.measure_all()
+      self.report(costs)
+      failures = [failure for case in ROUTE_CASES
+                  for failure in self.check(case, costs[case.label])]
+      self.assertFalse(failures, '\n' + '\n'.join(failures))
+
+   def measure_all(self):
+      """{case label: {dataset size: cost}}"""
+      fixtures = create_fixtures()
+      tokens = {name: str(AccessToken.for_user(user))
+                for name, user in fixtures['users'].items()}
+      costs = {case.label: {} for case in ROUTE_CASES}
+      seeded = 0
+      for size in DATASET_SIZES:
+         seed_dataset(fixtures, seeded, size)
+         seeded = size
+         for case in ROUTE_CASES:
+            costs[case.label][size] = self.measure(case, fixtures['ids'],
+                                                   tokens)
+      return costs
+
+   @staticmethod
+   def check(case, costs):
+      """Failure messages for one case's costs"""
+      runs = [costs[size] for size in DATASET_SIZES]
+      counts = [run['queries'] for run in runs]
+      failures = [f"{case.label}: status {run['status']} at size {size}, "
+                  f"expected {case.status}"
+                  for size, run in zip(DATASET_SIZES, runs)
+                  if run['status'] != case.status]
+      if max(counts) > case.max_queries:
+         failures.append(f'{case.label}: {max(counts)} queries, '
+                         f'budget {case.max_queries}')
+      if counts[-1] > counts[0]:
+         failures.append(f'{case.label}: queries grew with the dataset '
+                         f'({" -> ".join(map(str, counts))})')
+      slowest = max(run['ms'] for run in runs)
+      if slowest > case.max_ms:
+         failures.append(f'{case.label}: {slowest:.1f} ms, '
+                         f'budget {case.max_ms} ms')
+      return failures
+
+   @staticmethod
+   def measure(case, ids, tokens):
+      client, path, data = case_request(case, ids, tokens)
+      # Run inside a rolled-back savepoint so writes don't leak into the
+      # next case, and start each request with cold in-process caches
+      with transaction.atomic():
+         user_cache.clear()
+         reset_friend_graph()
+         reset_match_features()
+         get_buckets().clear()
+         get_response_cache().clear()
+         cache.clear()
+         with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, case.request['method'])(
+               path, data, format=case.request['data_format'])
+            elapsed_ms = (time.perf_counter() - start) * 1000
+         transaction.set_rollback(True)
+      return {'queries': len(queries.captured_queries),
+              'ms': round(elapsed_ms, 2), 'status': response.status_code}
+
+   @staticmethod
+   def report(costs):
+      """
+      Write the costs as JSON to ROUTE_BUDGET_REPORT and as a table next
+      to it, with a .txt extension
+      """
+      if not REPORT_PATH:
+         return
+      with open(REPORT_PATH, 'w', encoding='utf-8') as f:
+         json.dump(costs, f, indent=2, sort_keys=True)
+      sizes = DATASET_SIZES
+      lines = [f"{'route':<52}" + ''.join(
+         f"{f'q@{size}':>8}{f'ms@{size}':>10}" for size in sizes)]
+      lines.extend(f'{label:<52}' + ''.join(
+         f"{runs[size]['queries']:>8}{runs[size]['ms']:>10.1f}"
+         for size in sizes) for label, runs in sorted(costs.items()))
+      table_path = os.path.splitext(REPORT_PATH)[0] + '.txt'
+      with open(table_path, 'w', encoding='utf-8') as f:
+         f.write('\n'.join(lines) + '\n')
+
+
+def case_request(case, ids, tokens):
+   """(client, path, data) for a case, filled in with the fixture ids"""
+   client = APIClient()
+   user = case.request['user']
+   if user:
+      client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[user]}')
+   data = case.request['data']
+   if callable(data):
+      data = data(ids)
+   else:
+      data = {key: value.format(**ids) if isinstance(value, str) else value
+              for key, value in (data or {}).items()}
+   return client, case.path.format(**ids), data
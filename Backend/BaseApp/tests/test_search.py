@@ -0,0 +1,242 @@
+import gzip
+import json
+import tempfile
+from unittest import mock
+
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, pre_delete
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+
+from .. import signals
+from ..directory_snapshot import build_snapshot
+from ..geo import COLUMNS, ROWS, cell_of, cell_ranges, get_gazetteer
+from ..matching import MatchFeatures, load_tags, parse_weights, rank, \
+   reset_match_features
+from ..models import Profile, ProfileTagging, Tag
+from .helpers import seed_dataset, create_fixtures, authenticated_client
+
+
+class AsyncSearchTests(TestCase):
+   def setUp(self):
+      for i in range(5):
+         user = User.objects.create_user(username=f'seeker{i}', password='x')
+         Profile.objects.create(user=user, user_type='supporter',
+                                first_name=f'Seeker{i}')
+      self.client = authenticated_client(user)
+
+   def test_pages_like_the_sync_view(self):
+      with mock.patch.object(PageNumberPagination, 'page_size', 2):
+         pages = [self.client.get(f'{url}?q=seeker&page=2').json()
+                  for url in ('/api/search/', '/api/async/search/')]
+         missing = self.client.get('/api/async/search/?q=seeker&page=9')
+      self.assertEqual(pages[0]['count'], 5)
+      self.assertEqual(len(pages[1]['results']), 2)
+      for key in ('count', 'results'):
+         self.assertEqual(pages[0][key], pages[1][key])
+      self.assertIn('page=3', pages[1]['next'])
+      self.assertEqual(missing.status_code, 404)
+      # Unpaged without a PAGE_SIZE, as the sync view is
+      self.assertEqual(len(self.client.get('/api/async/search/').json()), 5)
+
+
+@override_settings(READ_REPLICAS=[])
+class DirectorySnapshotTests(TestCase):
+   def setUp(self):
+      root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+      self.addCleanup(root.cleanup)
+      settings = override_settings(
+         DIRECTORY_SNAPSHOT={'ROOT': root.name, 'PAGE_SIZE': 4})
+      settings.enable()
+      self.addCleanup(settings.disable)
+      seed_dataset(create_fixtures(), 0, 12)
+      self.client = APIClient()
+
+   def listing(self, params=None, from_snapshot=True, **headers):
+      # An empty ?search= changes nothing but needs the database
+      params = dict(params or {}, **({} if from_snapshot else {'search': ''}))
+      response = self.client.get('/api/profiles/', params, **headers)
+      self.assertEqual(response.status_code, 200)
+      body = b''.join(response.streaming_content) \
+         if response.streaming else response.content
+      if response.get('Content-Encoding') == 'gzip':
+         body = gzip.decompress(body)
+      return json.loads(body)
+
+   def test_snapshot_matches_the_database_without_queries(self):
+      build_snapshot()
+      for params in [{}, {'user_type': 'supporter'}, {'country': 'USA'},
+                     {'user_type': 'missionary', 'country': 'USA'}]:
+         for encoding in ['gzip', '']:
+            with self.assertNumQueries(0):
+               listed = self.listing(params, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(listed, self.listing(params,
+                                                  from_snapshot=False))
+
+   def test_refresh_renders_only_changed_pages(self):
+      first = build_snapshot()
+      Profile.objects.filter(first_name='Member3').update(first_name='New')
+      changed = Profile.objects.get(first_name='New').pk
+      report = build_snapshot(changed_ids={changed})
+      self.assertEqual(report.rendered, 1)
+      self.assertEqual(report.reused, first.rendered - 1)
+      self.assertIn('New', [p['first_name'] for p in self.listing()])
+
+   def test_tag_changes_refresh_the_profiles_shown_with_them(self):
+      # Connected at startup when DIRECTORY_SNAPSHOT['ROOT'] is set
+      for signal in (post_save, pre_delete):
+         signal.connect(signals.tag_changed, sender=Tag)
+         self.addCleanup(signal.disconnect, signals.tag_changed, sender=Tag)
+      tag = Tag.objects.create(tag_name='Before')
+      tagged = sorted(Profile.objects.values_list('pk', flat=True)[:2])
+      for profile_id in tagged:
+         ProfileTagging.objects.create(profile_id=profile_id, tag=tag)
+
+      with mock.patch.object(signals, 'queue_directory_refresh') as refresh:
+         tag.tag_name = 'After'
+         tag.save()
+         tag.delete()
+      self.assertEqual([sorted(call.args[0]) for call in
+                        refresh.call_args_list], [tagged, tagged])
+
+
+def match_features(profiles):
+   """MatchFeatures from (id, user_type, tag bits, city, experience, votes)"""
+   return MatchFeatures(
+      ids=np.array([p[0] for p in profiles], dtype=np.int64),
+      user_types=np.array([p[1] for p in profiles], dtype=np.int8),
+      listed=np.ones(len(profiles), dtype=bool),
+      tags=np.array([[p[2]] for p in profiles], dtype=np.uint64),
+      countries=np.zeros(len(profiles), dtype=np.int32),
+      states=np.zeros(len(profiles), dtype=np.int32),
+      cities=np.array([p[3] for p in profiles], dtype=np.int32),
+      experience=np.array([p[4] for p in profiles], dtype=np.float32),
+      votes=np.array([p[5] for p in profiles], dtype=np.float32))
+
+
+class MatchingEngineTests(SimpleTestCase):
+   def setUp(self):
+      self.features = match_features([
+         (1, 0, 0b0111, 1, 5, 0),   # the viewer
+         (2, 1, 0b0111, 2, 30, 0),  # every tag
+         (3, 1, 0b0001, 1, 5, 40),  # one tag, same city, popular
+         (4, 1, 0b1000, 1, 5, 0),   # no shared tag
+         (5, 0, 0b0111, 1, 5, 0),   # same user type
+      ])
+
+   def test_only_other_types_sharing_a_tag_match(self):
+      self.assertEqual({match_id for match_id, _ in rank(self.features, 1)},
+                       {2, 3})
+
+   def test_weights_change_the_order(self):
+      by_tags = rank(self.features, 1, {'tags': 1, 'location': 0,
+                                        'experience': 0, 'votes': 0})
+      by_rest = rank(self.features, 1, {'tags': 0, 'location': 1,
+                                        'experience': 1, 'votes': 1})
+      self.assertEqual([match_id for match_id, _ in by_tags], [2, 3])
+      self.assertEqual([match_id for match_id, _ in by_rest], [3, 2])
+      self.assertAlmostEqual(by_tags[0][1], 1.0)
+
+   def test_limit_keeps_the_best(self):
+      features = match_features(
+         [(1, 0, 1, 0, 0, 0)] +
+         [(i, 1, 1, 0, i, 0) for i in range(2, 200)])
+      ranked = rank(features, 1, {'tags': 0, 'location': 0, 'votes': 0},
+                    limit=3)
+      self.assertEqual([match_id for match_id, _ in ranked], [2, 3, 4])
+
+   def test_unknown_scorer_is_rejected(self):
+      self.assertEqual(parse_weights('tags:2, votes:0.5'),
+                       {'tags': 2.0, 'votes': 0.5})
+      with self.assertRaises(ValueError):
+         parse_weights('height:1')
+
+
+class MatchmakingTests(TestCase):
+   def setUp(self):
+      reset_match_features()
+      tag = Tag.objects.create(tag_name='Prayer')
+      self.profiles = []
+      for name, user_type in (('viewer', 'supporter'),
+                              ('match', 'missionary')):
+         profile = Profile.objects.create(
+            user=User.objects.create_user(username=name),
+            user_type=user_type)
+         ProfileTagging.objects.create(profile=profile, tag=tag)
+         self.profiles.append(profile)
+
+   def matches(self):
+      response = authenticated_client(self.profiles[0].user).get(
+         '/api/profiles/match')
+      return [row['user']['id'] for row in response.json()]
+
+   def test_profiles_made_anonymous_since_loading_are_left_out(self):
+      match = self.profiles[1]
+      self.assertEqual(self.matches(), [match.pk])
+      Profile.objects.filter(pk=match.pk).update(is_anonymous=True)
+      self.assertEqual(self.matches(), [])
+
+   def test_taggings_of_profiles_not_loaded_are_skipped(self):
+      viewer = self.profiles[0].pk
+      tags = load_tags({viewer: 0})
+      self.assertEqual(tags.shape, (1, 1))
+      self.assertEqual(int(tags[0, 0]), 1)
+
+
+def covered(ranges, latitude, longitude):
+   cell = cell_of(latitude, longitude)
+   return any(first <= cell <= last for first, last in ranges)
+
+
+class GeoSearchTests(TestCase):
+   def test_ranges_wrap_around_the_antimeridian(self):
+      ranges = cell_ranges(0, 179.5, 200)
+      self.assertTrue(covered(ranges, 0, 179.5))
+      self.assertTrue(covered(ranges, 0, -179.5))
+      self.assertFalse(covered(ranges, 0, 0))
+      # Two ranges per grid row, one on each side
+      self.assertEqual(len(ranges), 2 * len({first // COLUMNS
+                                             for first, _ in ranges}))
+
+   def test_ranges_around_a_pole_take_whole_rows(self):
+      for latitude in (89.5, -89.5):
+         ranges = cell_ranges(latitude, 10, 300)
+         self.assertEqual(len(ranges), 1)
+         for longitude in (-180, 0, 179.9):
+            self.assertTrue(covered(ranges, latitude, longitude))
+      self.assertEqual(cell_ranges(89.5, 10, 300)[0][1], ROWS * COLUMNS - 1)
+      self.assertEqual(cell_ranges(-89.5, 10, 300)[0][0], 0)
+
+   def test_locate_falls_back_from_city_to_country(self):
+      gazetteer = get_gazetteer()
+      self.assertEqual(gazetteer.locate('Nashville', 'TN', 'USA'),
+                       ((36.16, -86.78), 'city'))
+      self.assertEqual(gazetteer.locate('nashville', None, 'United States'),
+                       ((36.16, -86.78), 'city'))
+      self.assertEqual(gazetteer.locate('Nowhere', 'Tennessee', 'US')[1],
+                       'state')
+      self.assertEqual(gazetteer.locate('Nowhere', '', 'US')[1], 'country')
+      self.assertIsNone(gazetteer.locate('Nashville', 'TN', 'Atlantis'))
+
+   def test_near_keeps_profiles_within_the_radius_nearest_first(self):
+      for name, city in (('memphis', 'Memphis'), ('nashville', 'Nashville'),
+                         ('knoxville', 'Knoxville'), ('somewhere', '')):
+         Profile.objects.create(
+            user=User.objects.create_user(username=name), city=city,
+            state='' if not city else 'TN', country='United States')
+      client = authenticated_client(User.objects.get(username='memphis'))
+      found = client.get('/api/search/',
+                         {'near': '36.16,-86.78', 'radius': 400}).json()
+      self.assertEqual([row['user']['username'] for row in found],
+                       ['nashville', 'knoxville', 'memphis'])
+      self.assertEqual(found[0]['distance_km'], 0.0)
+      # Placed by their country alone, so far too roughly to be found even
+      # with a radius that reaches the country's middle
+      found = client.get('/api/search/',
+                         {'near': '39.83,-98.58', 'radius': 2000}).json()
+      self.assertNotIn('somewhere', [row['user']['username'] for row in found])
+      self.assertEqual(client.get('/api/search/',
+                                  {'near': '91,0'}).status_code, 400)
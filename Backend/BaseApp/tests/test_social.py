@@ -0,0 +1,236 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..authentication import user_cache
+from ..friend_graph import reset_friend_graph
+from ..models import ExternalMedia, Profile, ProfileTagging, Notification, \
+   Friendship
+from .helpers import seed_dataset, create_fixtures, authenticated_client
+
+
+class NotificationTests(TestCase):
+   def setUp(self):
+      self.user = User.objects.create_user(username='reader', password='x')
+      self.other = User.objects.create_user(username='other', password='x')
+      self.notifications = [Notification.objects.create(
+         recipient=self.user, notification_type='general', message=str(i))
+         for i in range(25)]
+      Notification.objects.create(recipient=self.other,
+                                  notification_type='general', message='x')
+      self.client = authenticated_client(self.user)
+
+   def unread(self):
+      return self.client.get(
+         '/api/notifications/unread-count/').json()['unread_count']
+
+   def test_feed_follows_cursors_newest_first(self):
+      first = self.client.get('/api/notifications/').json()
+      second = self.client.get(first['next']).json()
+      self.assertIsNone(second['next'])
+      ids = [n['id'] for n in first['results'] + second['results']]
+      self.assertEqual(ids, [n.id for n in reversed(self.notifications)])
+
+   def test_mark_read_up_to_an_id(self):
+      self.assertEqual(self.unread(), 25)
+      response = self.client.post(
+         '/api/notifications/mark-read/',
+         {'up_to_id': self.notifications[9].id}, format='json')
+      self.assertEqual(response.json(), {'updated': 10})
+      self.assertEqual(self.unread(), 15)
+      # Other users' notifications are left alone
+      self.assertFalse(Notification.objects.get(recipient=self.other).is_read)
+
+   def test_mark_read_rejects_bad_bounds(self):
+      for data in ({}, {'up_to': 'yesterday'}, {'up_to_id': 'x'}):
+         response = self.client.post('/api/notifications/mark-read/', data,
+                                     format='json')
+         self.assertEqual(response.status_code, 400, data)
+      self.assertEqual(self.unread(), 25)
+
+
+class FriendSuggestionTests(TestCase):
+   def setUp(self):
+      cache.clear()
+      reset_friend_graph()
+      self.addCleanup(reset_friend_graph)
+      self.users = []
+      for i in range(8):
+         user = User.objects.create_user(username=f'friend{i}',
+                                         password='x')
+         Profile.objects.create(user=user, user_type='supporter',
+                                first_name=f'Friend{i}',
+                                is_anonymous=i in (2, 3))
+         self.users.append(user)
+      # friend0 and friend1 know everyone else, so friend2 shares both with
+      # friend3..7; friend2 and friend3 are anonymous
+      for sender in self.users[:2]:
+         for receiver in self.users[2:]:
+            Friendship.objects.create(sender=sender, receiver=receiver,
+                                      status='accepted')
+      self.client = authenticated_client(self.users[2])
+
+   def suggestions(self, **params):
+      response = self.client.get('/api/friendships/suggestions/', params)
+      self.assertEqual(response.status_code, 200)
+      return [(row['username'], row['mutual_count']) for row in response.data]
+
+   def test_anonymous_profiles_do_not_shorten_the_list(self):
+      # Ties rank by id, which puts anonymous friend3 first
+      self.assertEqual(self.suggestions(limit=2),
+                       [('friend4', 2), ('friend5', 2)])
+      self.assertEqual(len(self.suggestions()), 4)
+
+   def test_limit_is_clamped(self):
+      self.assertEqual(self.suggestions(limit=-3), [('friend4', 2)])
+      self.assertEqual(self.suggestions(limit='many'), self.suggestions())
+
+   def test_changes_reach_other_workers(self):
+      self.assertEqual(len(self.suggestions()), 4)
+      # Another worker accepts a friendship and publishes a new version
+      Friendship.objects.create(sender=self.users[2], receiver=self.users[4],
+                                status='accepted')
+      cache.set('friend-graph:version', 'elsewhere', timeout=None)
+      self.assertNotIn(('friend4', 2), self.suggestions())
+
+   def test_responding_publishes_a_change(self):
+      pending = Friendship.objects.create(sender=self.users[4],
+                                          receiver=self.users[2])
+      self.suggestions()
+      with self.captureOnCommitCallbacks(execute=True):
+         response = self.client.post(
+            f'/api/friendships/{pending.id}/respond/', {'action': 'accept'},
+            format='json')
+      self.assertEqual(response.status_code, 200)
+      self.assertIsNotNone(cache.get('friend-graph:version'))
+      self.assertNotIn(('friend4', 2), self.suggestions())
+
+
+class FriendRequestTests(TestCase):
+   def setUp(self):
+      self.sender = User.objects.create_user(username='asker', password='x')
+      self.receiver = User.objects.create_user(username='asked', password='x')
+
+   def send(self, sender, receiver):
+      with self.captureOnCommitCallbacks(execute=True):
+         return authenticated_client(sender).post(
+            '/api/friendships/', {'receiver': receiver.id}, format='json')
+
+   def reject(self, response):
+      Friendship.objects.filter(pk=response.data['id']) \
+         .update(status='rejected')
+
+   def notified(self, user):
+      return Notification.objects.filter(
+         recipient=user, notification_type='friend_request').count()
+
+   def test_rejected_request_can_be_sent_again(self):
+      first = self.send(self.sender, self.receiver)
+      self.assertEqual(first.status_code, 201)
+      self.assertEqual(self.send(self.sender, self.receiver).status_code, 400)
+      self.reject(first)
+
+      again = self.send(self.sender, self.receiver)
+      self.assertEqual(again.status_code, 201)
+      self.assertNotEqual(again.data['id'], first.data['id'])
+      self.assertEqual(again.data['status'], 'pending')
+
+      # Either of the two may ask again
+      self.reject(again)
+      reverse = self.send(self.receiver, self.sender)
+      self.assertEqual(reverse.status_code, 201)
+      friendship = Friendship.objects.get()
+      self.assertEqual((friendship.sender, friendship.receiver,
+                        friendship.status),
+                       (self.receiver, self.sender, 'pending'))
+
+   def test_resent_request_notifies_again(self):
+      self.reject(self.send(self.sender, self.receiver))
+      self.assertEqual(self.notified(self.receiver), 1)
+      self.reject(self.send(self.sender, self.receiver))
+      self.assertEqual(self.notified(self.receiver), 2)
+
+      self.send(self.receiver, self.sender)
+      self.assertEqual(self.notified(self.sender), 1)
+
+   def test_accepted_friendship_blocks_requests(self):
+      Friendship.objects.create(sender=self.sender, receiver=self.receiver,
+                                status='accepted')
+      self.assertEqual(self.send(self.receiver, self.sender).status_code, 400)
+      self.assertEqual(self.send(self.sender, self.sender).status_code, 400)
+
+
+@override_settings(READ_REPLICAS=[])
+class ProfilePageTests(TestCase):
+   def test_page_is_five_queries_however_many_comments_and_tags(self):
+      fixtures = create_fixtures()
+      seed_dataset(fixtures, 0, 30)
+      viewer = fixtures['viewer']
+      other = User.objects.get(pk=fixtures['ids']['other'])
+      for tag in fixtures['tags'][2:]:
+         ProfileTagging.objects.create(profile=viewer, tag=tag,
+                                       added_by=other)
+      client = APIClient()
+      client.credentials(
+         HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(other)}')
+      user_cache.clear()
+
+      with self.assertNumQueries(5):
+         response = client.get(f'/api/profiles/{viewer.pk}/page/',
+                               {'comments': 50})
+      page = response.json()
+      self.assertEqual(len(page['comments']), 30)
+      self.assertEqual(page['comment_count'], 30)
+      self.assertEqual({tag['tag_name']: tag['is_self_added']
+                        for tag in page['tags']},
+                       {'Tag 0': True, 'Tag 1': True, 'Tag 2': True,
+                        'Tag 3': False, 'Tag 4': False, 'Tag 5': False})
+      self.assertEqual(page['votes'], {'upvotes': 20, 'downvotes': 10,
+                                       'viewer_vote': None})
+      self.assertEqual(page['friendship']['status'], 'pending')
+      self.assertTrue(page['friendship']['is_sender'])
+
+   def test_async_overview_of_a_missing_profile_is_one_query(self):
+      client = authenticated_client(User.objects.create_user('viewer'))
+      # Loads the viewer into the token user cache
+      self.assertEqual(client.get('/api/async/profiles/0/overview/')
+                       .status_code, 404)
+      with self.assertNumQueries(1):
+         response = client.get('/api/async/profiles/0/overview/')
+      self.assertEqual(response.status_code, 404)
+
+
+class MediaTests(TestCase):
+   def setUp(self):
+      self.owner = User.objects.create_user(username='owner')
+      Profile.objects.create(user=self.owner)
+      self.other = User.objects.create_user(username='other')
+      self.media = ExternalMedia.objects.create(
+         user=self.owner, media_url='https://example.org/a.png')
+
+   def test_adding_to_a_missing_profile_is_not_found(self):
+      admin = User.objects.create_user(username='admin', is_staff=True)
+      response = authenticated_client(admin).post(
+         '/api/profiles/999/media/',
+         [{'media_url': 'https://example.org/b.png', 'description': 'b'}],
+         format='json')
+      self.assertEqual(response.status_code, 404)
+
+   def test_members_only_change_their_own_media(self):
+      data = {'user': self.owner.pk, 'media_url': 'https://example.org/b.png',
+              'description': 'Not the owner'}
+      self.assertEqual(
+         APIClient().post('/externalmedia/', data).status_code, 401)
+      client = authenticated_client(self.other)
+      self.assertEqual(client.post('/externalmedia/', data).status_code, 201)
+      self.assertEqual(ExternalMedia.objects.latest('id').user, self.other)
+
+      self.assertEqual(
+         client.delete(f'/externalmedia/{self.media.pk}/').status_code, 404)
+      self.assertEqual(
+         APIClient().get(f'/externalmedia/{self.media.pk}/').status_code,
+         200)
+      self.assertEqual(authenticated_client(self.owner).delete(
+         f'/externalmedia/{self.media.pk}/').status_code, 204)
@@ -0,0 +1,22 @@
+import os
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from ..startup import measure_cold_start
+
+# Milliseconds a fresh process may take to import saltnlight.wsgi
+COLD_START_BUDGET_MS = int(os.environ.get('COLD_START_BUDGET_MS', 2500))
+
+
+# Timing-dependent, so only run where asked, e.g. on a quiet CI runner
+@skipUnless(os.environ.get('RUN_SLOW_TESTS') == 'true',
+            'Set RUN_SLOW_TESTS=true to time the cold start')
+class ColdStartTests(SimpleTestCase):
+   """Import time of the WSGI entry point in a fresh interpreter"""
+
+   def test_cold_start_within_budget(self):
+      # Best of three, to keep a busy machine from failing the build
+      elapsed_ms = min(measure_cold_start() for _ in range(3))
+      self.assertLess(elapsed_ms, COLD_START_BUDGET_MS,
+                      'Run manage.py profile_imports to see what got slower')
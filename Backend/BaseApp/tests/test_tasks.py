@@ -0,0 +1,137 @@
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import task_queue
+from ..models import Notification, Task
+from ..task_queue import claim, enqueue, run_due, run_group, run_ready, \
+   task
+from .helpers import authenticated_client
+
+calls = []
+
+
+@task(name='tests.record', batch=True)
+def record(payloads):
+   if any(payload.get('bad') for payload in payloads):
+      raise ValueError('bad payload')
+   calls.append([payload['n'] for payload in payloads])
+
+
+@task(name='tests.broken', max_attempts=2)
+def broken(payload):
+   raise RuntimeError(f"broken {payload['n']}")
+
+
+@override_settings(TASK_QUEUE={'WORKER': True, 'RETRY_DELAY': 10})
+class TaskQueueTests(TestCase):
+   def setUp(self):
+      calls.clear()
+
+   def test_each_task_is_claimed_once(self):
+      for n in range(3):
+         enqueue(record, {'n': n})
+      first = claim(2)
+      self.assertEqual(len(first), 2)
+      self.assertEqual(len({row.claimed_by for row in first}), 1)
+      self.assertEqual([row.payload['n'] for row in claim(10)], [2])
+      self.assertEqual(claim(10), [])
+
+      # Until its lease runs out, when another worker may take it over
+      Task.objects.filter(pk=first[0].pk).update(
+         locked_until=timezone.now() - timedelta(seconds=1))
+      again = claim(10)
+      self.assertEqual([row.pk for row in again], [first[0].pk])
+      self.assertEqual(again[0].attempts, 2)
+
+   @skipUnless(connection.features.has_select_for_update_skip_locked,
+               'The database has no SELECT ... FOR UPDATE SKIP LOCKED')
+   def test_claim_skips_locked_rows(self):
+      enqueue(record, {'n': 0})
+      with CaptureQueriesContext(connection) as queries:
+         claim(10)
+      self.assertTrue(any('SKIP LOCKED' in query['sql']
+                          for query in queries.captured_queries))
+
+   def test_idempotency_key_queues_once(self):
+      enqueue(record, {'n': 0}, idempotency_key='once')
+      enqueue(record, {'n': 1}, idempotency_key='once')
+      self.assertEqual(list(Task.objects.values_list('payload', flat=True)),
+                       [{'n': 0}])
+
+   def test_failures_are_retried_with_backoff_then_failed(self):
+      enqueue(broken, {'n': 1})
+      self.assertEqual(run_ready(), (1, 0, 0))
+      row = Task.objects.get()
+      self.assertEqual((row.status, row.attempts), (Task.QUEUED, 1))
+      self.assertGreater(row.run_after, timezone.now() + timedelta(seconds=9))
+      self.assertIn('broken 1', row.last_error)
+      self.assertEqual(run_ready(), (0, 0, 0))
+
+      Task.objects.update(run_after=timezone.now())
+      self.assertEqual(run_ready(), (1, 0, 1))
+      row = Task.objects.get()
+      self.assertEqual((row.status, row.attempts), (Task.FAILED, 2))
+      self.assertIsNone(row.claimed_by)
+
+   def test_bad_payload_does_not_fail_its_batch(self):
+      for n in range(3):
+         enqueue(record, {'n': n, 'bad': n == 1})
+      self.assertEqual(run_ready(), (3, 2, 0))
+      self.assertEqual(calls, [[0], [2]])
+      self.assertEqual(
+         dict(Task.objects.values_list('payload__n', 'status')),
+         {0: Task.DONE, 1: Task.QUEUED, 2: Task.DONE})
+
+   def test_tasks_claimed_again_are_left_to_their_new_worker(self):
+      enqueue(record, {'n': 0})
+      enqueue(broken, {'n': 1})
+      claimed = claim(10)
+      # Both leases ran out and another worker claimed the tasks meanwhile
+      Task.objects.update(claimed_by='other-worker')
+      for row in claimed:
+         self.assertEqual(run_group(row.name, [row.pk], row.claimed_by),
+                          (0, 0))
+      self.assertEqual(calls, [])
+      self.assertEqual(set(Task.objects.values_list('status', 'claimed_by')),
+                       {(Task.RUNNING, 'other-worker')})
+
+
+class InlineTaskTests(TestCase):
+   @override_settings(TASK_QUEUE={'WORKER': False})
+   def test_tasks_run_after_commit_without_a_worker(self):
+      sender = User.objects.create_user(username='sender')
+      receiver = User.objects.create_user(username='receiver')
+      with self.captureOnCommitCallbacks(execute=True):
+         response = authenticated_client(sender).post(
+            '/api/friendships/', {'receiver': receiver.pk}, format='json')
+      self.assertEqual(response.status_code, 201)
+      self.assertEqual(Task.objects.get().status, Task.DONE)
+      self.assertEqual(
+         Notification.objects.get(recipient=receiver).notification_type,
+         'friend_request')
+
+   @override_settings(TASK_QUEUE={'WORKER': False})
+   def test_delayed_tasks_run_together_off_the_request(self):
+      calls.clear()
+      with mock.patch.object(task_queue, 'run_later') as run_later, \
+            self.captureOnCommitCallbacks(execute=True):
+         enqueue(record, {'n': 0}, delay=30)
+         enqueue(record, {'n': 1}, delay=30)
+      run_later.assert_called_with('tests.record', 30)
+      self.assertEqual(calls, [])
+
+      # The timer fires; a task queued since gets a timer of its own
+      Task.objects.update(run_after=timezone.now())
+      enqueue(record, {'n': 2}, delay=30)
+      with mock.patch.object(task_queue, 'run_later') as run_later, \
+            mock.patch.object(task_queue.connections, 'close_all'):
+         run_due('tests.record')
+      self.assertEqual(calls, [[0, 1]])
+      self.assertEqual(run_later.call_args.args[0], 'tests.record')
+      self.assertGreater(run_later.call_args.args[1], 25)
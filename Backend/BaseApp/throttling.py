@@ -0,0 +1,154 @@
+"""
+Request throttling with token buckets every worker process on a node
+shares through a memory-mapped file, so a client can't multiply its
+allowance by landing on different workers and a check costs no cache
+round trip.
+
+Each client - the user, or the IP address of anonymous requests, taken
+from X-Forwarded-For only as far as REST_FRAMEWORK['NUM_PROXIES'] - gets
+RATES['user'] or RATES['anon'] tokens per period, refilled continuously,
+and each request spends its endpoint's cost from COSTS (by URL name,
+default 1), so a search drains the bucket faster than a tag list.
+
+The table is a fixed array of slots of two 8-byte words, a key hash and
+the time the bucket will be full again (GCRA), so checking a bucket
+reads and writes aligned words and takes no lock. Two processes updating
+the same bucket at the same instant can lose one update, letting a
+request through uncharged; that is the price of not locking. A key whose
+slot was taken by another starts over with a full bucket, which is rare
+while SLOTS is well above the number of active clients.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .caching import map_file, shared_path
+
+DEFAULT_THROTTLE = {
+   'ENABLED': True,
+   # Shared by the processes using the same file; by default
+   # shared_path('throttle'), see BaseApp/caching.py
+   'PATH': None,
+   'SLOTS': 65536,
+   # Tokens per period, in DRF's "number/period" format
+   'RATES': {'user': '600/min', 'anon': '120/min'},
+   # Tokens a request spends, by URL name
+   'COSTS': {
+      'profile-list-create': 5,
+      'profile-search': 10,
+      'dedicated-search': 10,
+      'async-profile-search': 10,
+      'profile-match': 10,
+      'async-profile-match': 10,
+      'profile-page': 2,
+   },
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def throttle_settings():
+   return {**DEFAULT_THROTTLE, **getattr(settings, 'THROTTLE', {})}
+
+
+def parse_rate(rate):
+   """(tokens, period in seconds) from e.g. "100/min" """
+   tokens, period = rate.split('/')
+   return int(tokens), PERIODS[period[0]]
+
+
+def key_hash(key):
+   # Python's hash() differs between processes; 0 marks an empty slot
+   digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+   return int.from_bytes(digest, 'little') | 1
+
+
+class TokenBuckets:
+   """Token buckets in a file-backed table of SLOTS slots"""
+
+   def __init__(self, path, slots):
+      self.path = path
+      self.slots = slots
+      self.map = map_file(path, slots * 16)
+      # Slot i is keys[2 * i] and times[2 * i + 1], over the same memory
+      self.keys = memoryview(self.map).cast('Q')
+      self.times = memoryview(self.map).cast('d')
+
+   def consume(self, key, cost, tokens, period):
+      """
+      Spend `cost` of the key's `tokens` per `period` seconds. Returns 0 if
+      the request may go ahead, or the seconds until it could.
+      """
+      hashed = key_hash(key)
+      slot = hashed % self.slots * 2
+      interval = period / tokens
+      cost = min(cost, tokens)
+      now = time.time()
+      full_at = self.times[slot + 1] if self.keys[slot] == hashed else now
+      # Clamped, so clock changes and torn writes can't lock a key out
+      full_at = min(max(full_at, now), now + period)
+      full_at += cost * interval
+      if full_at - now > period:
+         return full_at - now - period
+      self.times[slot + 1] = full_at
+      self.keys[slot] = hashed
+      return 0
+
+   def clear(self):
+      self.map[:] = bytes(len(self.map))
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+   global _buckets  # pylint: disable=global-statement
+   config = throttle_settings()
+   wanted = (config['PATH'] or shared_path('throttle'), config['SLOTS'])
+   buckets = _buckets
+   if buckets is None or (buckets.path, buckets.slots) != wanted:
+      with _buckets_lock:
+         if _buckets is None or (_buckets.path, _buckets.slots) != wanted:
+            _buckets = TokenBuckets(*wanted)
+         buckets = _buckets
+   return buckets
+
+
+def request_cost(request, config):
+   match = getattr(request, 'resolver_match', None)
+   return config['COSTS'].get(match.url_name if match else None, 1)
+
+
+def throttle_wait(request, user, ident):
+   """
+   Charge a request to the user's (or, anonymous, the IP's) bucket.
+   Returns 0 or the seconds to wait before retrying.
+   """
+   config = throttle_settings()
+   if not config['ENABLED']:
+      return 0
+   if user is not None and user.is_authenticated:
+      key, rate = f'user:{user.pk}', config['RATES']['user']
+   else:
+      key, rate = f'ip:{ident}', config['RATES']['anon']
+   return get_buckets().consume(key, request_cost(request, config),
+                                *parse_rate(rate))
+
+
+class TokenBucketThrottle(BaseThrottle):
+   """DRF throttle over the shared token buckets; Retry-After on 429"""
+
+   def __init__(self):
+      self.wait_seconds = 0
+
+   def allow_request(self, request, view):
+      self.wait_seconds = throttle_wait(request, request.user,
+                                        self.get_ident(request))
+      return not self.wait_seconds
+
+   def wait(self):
+      return self.wait_seconds
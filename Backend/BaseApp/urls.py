@@ -1,14 +1,18 @@
 from django.urls import path, include
 from rest_framework import routers
 from .views import TagViewSet, SearchHistoryViewSet, \
-    ExternalMediaViewSet, \
+    ExternalMediaViewSet, ProfileMediaView, ProfilePageView, \
     ProfileListCreateView, ProfileDetailView, \
     MatchmakingResultsView, CurrentUserView, \
     ProfileVoteView, ProfileCommentView, \
-    ProfileVoteStatusView, NotificationView, FriendshipViewSet, \
-    check_superuser, AdminProfileListView, AdminProfileDeleteView, \
-    AdminCommentListView, AdminCommentDeleteView, \
-    DedicatedSearchView
+    ProfileVoteStatusView, NotificationView, FriendshipViewSet
+from .search_views import DedicatedSearchView
+from .admin_views import check_superuser, AdminProfileListView, \
+    AdminProfileDeleteView, AdminProfileImportView, AdminCommentListView, \
+    AdminCommentDeleteView, AdminCommentBulkDeleteView
+from .async_views import async_dedicated_search, \
+    async_matchmaking_results, async_current_user, async_profile_overview
+from .batch import batch_view
 
 # Automatically generates URLs for all ViewSet classes
 router = routers.DefaultRouter()
@@ -24,7 +28,12 @@ urlpatterns = [
         name='profile-list-create'),
    path('api/profiles/<int:pk>/', ProfileDetailView.as_view(),
         name='profile-detail'),
-   path('api/profiles/match', MatchmakingResultsView.as_view()),
+   path('api/profiles/<int:pk>/media/', ProfileMediaView.as_view(),
+        name='profile-media'),
+   path('api/profiles/<int:pk>/page/', ProfilePageView.as_view(),
+        name='profile-page'),
+   path('api/profiles/match', MatchmakingResultsView.as_view(),
+        name='profile-match'),
    path('api/profiles/me/', CurrentUserView.as_view(),
         name='current-user'),
    path('api/profiles/vote/', ProfileVoteView.as_view(),
@@ -44,20 +53,42 @@ urlpatterns = [
    path('api/friendships/status/<int:profile_id>/',
         FriendshipViewSet.as_view({'get': 'status'}),
         name='friendship-status'),
+   path('api/friendships/mutual/',
+        FriendshipViewSet.as_view({'get': 'mutual'}),
+        name='friendship-mutual'),
+   path('api/friendships/suggestions/',
+        FriendshipViewSet.as_view({'get': 'suggestions'}),
+        name='friendship-suggestions'),
    path('api/search/', DedicatedSearchView.as_view(),
         name='profile-search'),
    path('api/dedicated-search/', DedicatedSearchView.as_view(),
         name='dedicated-search'),
 
+   # Async variants, intended for ASGI deployments
+   path('api/async/search/', async_dedicated_search,
+        name='async-profile-search'),
+   path('api/async/profiles/match', async_matchmaking_results,
+        name='async-profile-match'),
+   path('api/async/profiles/me/', async_current_user,
+        name='async-current-user'),
+   path('api/async/profiles/<int:pk>/overview/', async_profile_overview,
+        name='async-profile-overview'),
+   path('api/batch/', batch_view, name='batch'),
+
    # Admin API endpoints
    path('api/admin/check-superuser/', check_superuser,
         name='admin-check-superuser'),
    path('api/admin/profiles/', AdminProfileListView.as_view(),
         name='admin-profile-list'),
+   path('api/admin/profiles/import/', AdminProfileImportView.as_view(),
+        name='admin-profile-import'),
    path('api/admin/profiles/<int:pk>/',
         AdminProfileDeleteView.as_view(), name='admin-profile-delete'),
    path('api/admin/comments/', AdminCommentListView.as_view(),
         name='admin-comment-list'),
+   path('api/admin/comments/bulk-delete/',
+        AdminCommentBulkDeleteView.as_view(),
+        name='admin-comment-bulk-delete'),
    path('api/admin/comments/<int:pk>/',
         AdminCommentDeleteView.as_view(), name='admin-comment-delete'),
 ]
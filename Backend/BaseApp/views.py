@@ -1,27 +1,26 @@
 # Standard library imports
 import logging
-import operator
-from functools import reduce
+from itertools import islice
 
 # Third-party imports
 # pylint: disable=C0412
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework import generics, filters, views, response, status
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
 from django_filters.rest_framework import DjangoFilterBackend
-from django_filters import FilterSet, CharFilter
 # pylint: enable=C0412
 
 # Django imports
-from django.db.models import Q
+from django.db.models import Case, Count, FloatField, IntegerField, \
+    OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
 from django.core.exceptions import ValidationError, ObjectDoesNotExist, \
     PermissionDenied
-from django.contrib.auth.models import User
-from django.db.utils import DatabaseError
 from .models import Tag, SearchHistory, \
     ExternalMedia, Profile, ProfileVote, ProfileComment, \
     ProfileTagging, Notification, Friendship
@@ -29,36 +28,90 @@ from .serializer import TagSerializer, SearchHistorySerializer, \
     ExternalMediaSerializer, \
     ProfileSerializer, ProfileVoteSerializer, \
     ProfileCommentSerializer, NotificationSerializer, FriendshipSerializer, \
-    AdminProfileCommentSerializer, AdminProfileSerializer, \
-    SearchProfileSerializer
+    ProfileMediaSerializer, ProfilePageSerializer
+from .friend_graph import get_friend_graph, record_friendship
+from .authentication import CachedJWTAuthentication, get_profile_info
+from .directory_snapshot import ORDERING as SNAPSHOT_ORDERING, \
+    snapshot_response
+from .matching import matching_settings, parse_weights, rank_profiles
+from .response_cache import PROFILE_MODELS, TAG_MODELS
+from .tasks import queue_friend_request_notification
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Upper bound on profile ids accepted by the batched mutual-friends lookup
+MAX_MUTUAL_IDS = 100
+# Upper bound on ?media=N, the media embedded per profile
+MAX_EMBEDDED_MEDIA = 10
+# Upper bound on media created or deleted by one request
+MAX_MEDIA_BATCH = 100
+# Latest comments on a profile page, and the upper bound on ?comments=N
+PAGE_COMMENTS = 10
+MAX_PAGE_COMMENTS = 50
 
-# Custom pagination class for admin views
-class AdminPagination(PageNumberPagination):
+
+def media_limit(request):
+   """The number of media to embed per profile, from ?media=N"""
+   try:
+      limit = int(request.query_params.get('media', 0))
+   except ValueError:
+      return 0
+   return min(max(limit, 0), MAX_EMBEDDED_MEDIA)
+
+
+# Keyset pagination for the notification feed, newest first
+class NotificationPagination(CursorPagination):
+   page_size = 20
+   page_size_query_param = 'page_size'
+   max_page_size = 100
+   ordering = ('-created_at', '-id')
+
+
+# Keyset pagination for a profile's media, newest first
+class ProfileMediaPagination(CursorPagination):
    page_size = 20
    page_size_query_param = 'page_size'
    max_page_size = 100
+   ordering = ('-uploaded_at', '-id')
+
+
+# Keyset pagination for a user's friendships, newest first
+class FriendshipPagination(CursorPagination):
+   page_size = 20
+   page_size_query_param = 'page_size'
+   max_page_size = 100
+   ordering = ('-created_at', '-id')
 
 
 class ProfileListCreateView(generics.ListCreateAPIView):
+   """
+   The public directory. Anonymous listings are served from the directory
+   snapshot when one is built, see BaseApp/directory_snapshot.py, and
+   other anonymous queries from the response cache.
+   """
    queryset = Profile.objects.select_related(
       'user').prefetch_related('tags').all()
    serializer_class = ProfileSerializer
    permission_classes = [AllowAny]  # Public access for testing
-   filter_backends = [filters.SearchFilter]
+   # Anonymous GETs are cached, see BaseApp/response_cache.py
+   anonymous_cache_models = PROFILE_MODELS
+   filter_backends = [DjangoFilterBackend, filters.SearchFilter]
    search_fields = ['user_type', 'city', 'state', 'country']
    filterset_fields = ['user_type', 'city', 'state', 'country',
                        'tags']
 
    def get_queryset(self):
-      # Get the base queryset
-      queryset = super().get_queryset()
+      # Get the base queryset, in the same order as the snapshot
+      queryset = super().get_queryset().order_by(*SNAPSHOT_ORDERING)
       # Filter out anonymous profiles
       queryset = queryset.exclude(is_anonymous=True)
-      return queryset
+      return ProfileSerializer.setup_queryset(
+         queryset, self.request.user, media_limit(self.request))
+
+   def list(self, request, *args, **kwargs):
+      return snapshot_response(request) or \
+         super().list(request, *args, **kwargs)
 
 
 class ProfileDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -70,38 +123,165 @@ class ProfileDetailView(generics.RetrieveUpdateDestroyAPIView):
    )
    serializer_class = ProfileSerializer
    permission_classes = [AllowAny]  # Public access for testing
+   # Anonymous GETs are cached, see BaseApp/response_cache.py
+   anonymous_cache_models = PROFILE_MODELS
+
+   def get_queryset(self):
+      return ProfileSerializer.setup_queryset(
+         super().get_queryset(), self.request.user,
+         media_limit(self.request))
 
    def get_serializer_context(self):
       context = super().get_serializer_context()
       context['profile_id'] = self.kwargs.get('pk')
       return context
 
+
+class ProfilePageView(views.APIView):
+   """
+   Everything a profile page shows in three queries, plus authentication:
+   the profile with its vote totals, the viewer's vote and the friendship
+   state; its tags with their self-added flags; and the latest comments,
+   ?comments=N of them.
+   """
+   authentication_classes = [CachedJWTAuthentication]
+   permission_classes = [AllowAny]
+
+   def get(self, request, pk):
+      viewer = request.user if request.user.is_authenticated else None
+      profile = self.profile_queryset(pk, viewer).first()
+      if profile is None:
+         return Response({'error': 'Profile not found'},
+                         status=status.HTTP_404_NOT_FOUND)
+
+      tags, self_added = self.profile_tags(pk)
+      comments = ProfileComment.objects.filter(profile_id=pk) \
+         .select_related('commenter') \
+         .order_by('-created_at', '-id')[:self.comment_limit()]
+
+      context = {'request': request, 'profile_id': pk,
+                 'self_added_tag_ids': self_added}
+      return Response({
+         'profile': ProfilePageSerializer(profile, context=context).data,
+         'tags': TagSerializer(tags, many=True, context=context).data,
+         'votes': {
+            'upvotes': profile.upvote_total,
+            'downvotes': profile.downvote_total,
+            'viewer_vote': getattr(profile, 'viewer_vote', None),
+         },
+         'friendship': self.friendship_state(profile, viewer),
+         'comments': ProfileCommentSerializer(comments, many=True).data,
+         'comment_count': profile.comment_total,
+      })
+
+   @staticmethod
+   def profile_tags(pk):
+      """The profile's tags by name, and the ids of the self-added ones"""
+      taggings = ProfileTagging.objects.filter(profile_id=pk) \
+         .select_related('tag').order_by('tag__tag_name', 'tag_id')
+      tags, self_added = {}, set()
+      for tagging in taggings:
+         tags.setdefault(tagging.tag_id, tagging.tag)
+         if tagging.is_self_added:
+            self_added.add(tagging.tag_id)
+      return list(tags.values()), self_added
+
+   @staticmethod
+   def friendship_state(profile, viewer):
+      if getattr(profile, 'friendship_id', None) is None:
+         return {'status': None}
+      return {
+         'status': profile.friendship_status,
+         'friendship_id': profile.friendship_id,
+         'is_sender': profile.friendship_sender_id == viewer.id,
+      }
+
+   def comment_limit(self):
+      try:
+         limit = int(self.request.query_params.get('comments',
+                                                   PAGE_COMMENTS))
+      except ValueError:
+         return PAGE_COMMENTS
+      return min(max(limit, 0), MAX_PAGE_COMMENTS)
+
+   @staticmethod
+   def profile_queryset(pk, viewer):
+      # Vote totals and the viewer's vote from setup_queryset, without its
+      # tag and comment prefetches; counts and the friendship as subqueries
+      queryset = ProfileSerializer.setup_queryset(
+         Profile.objects.filter(pk=pk), viewer).prefetch_related(None)
+      queryset = queryset.annotate(comment_total=Coalesce(Subquery(
+         ProfileComment.objects.filter(profile=OuterRef('pk')).order_by()
+         .values('profile').annotate(total=Count('id')).values('total')),
+         0))
+      if viewer is None or viewer.pk == pk:
+         return queryset
+      friendship = Friendship.objects.filter(
+         Q(sender=viewer, receiver=OuterRef('pk')) |
+         Q(sender=OuterRef('pk'), receiver=viewer)).order_by('-created_at')
+      return queryset.annotate(
+         friendship_id=Subquery(friendship.values('id')[:1]),
+         friendship_status=Subquery(friendship.values('status')[:1]),
+         friendship_sender_id=Subquery(friendship.values('sender_id')[:1]))
+
+
 class MatchmakingResultsView(generics.ListAPIView):
+   """
+   The viewer's best matches, best first. ?weights=tags:1,votes:0.5
+   overrides the scorer weights in settings.MATCHING and ?limit=N the
+   number of matches.
+   """
    serializer_class = ProfileSerializer
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    # Only authenticated users can access
    permission_classes = [IsAuthenticated]
 
    def get_queryset(self):
-      user_profile = Profile.objects.filter(
-         user=self.request.user).prefetch_related('tags').first()
-
-      if not user_profile:
-         return Profile.objects.none()
-         # Return an empty queryset if the user has no profile
-
-      # Get the tags associated with the current user's profile
-      user_tags = user_profile.tags.all()
-
-      # Find profiles with at least one matching tag, excluding
-      # the current user's profile and anonymous profiles
-      matching_profiles = Profile.objects.filter(
-         Q(tags__in=user_tags)
-      ).exclude(
-         Q(user=self.request.user) | Q(is_anonymous=True)
-      ).distinct()
-
-      return matching_profiles.exclude(user_type=user_profile.user_type)
+      try:
+         weights, limit = match_options(self.request.query_params)
+      except ValueError as e:
+         raise ParseError(str(e)) from e
+      return ProfileSerializer.setup_queryset(
+         matchmaking_queryset(self.request.user, weights, limit),
+         self.request.user)
+
+
+def match_options(params):
+   """(weights, limit) from the query string; raises ValueError"""
+   weights = parse_weights(params.get('weights'))
+   limit = params.get('limit')
+   if limit is not None:
+      limit = int(limit)
+      max_limit = matching_settings()['MAX_LIMIT']
+      if not 1 <= limit <= max_limit:
+         raise ValueError(f'limit must be between 1 and {max_limit}')
+   return weights, limit
+
+
+def matchmaking_queryset(user, weights=None, limit=None):
+   # Profile id and type usually come from the authentication cache
+   profile_id, _ = get_profile_info(user)
+   if not profile_id:
+      return Profile.objects.none()
+      # Return an empty queryset if the user has no profile
+
+   # Listed profiles of another type sharing a tag, ranked in memory by
+   # BaseApp/matching.py and returned in rank order with their score
+   ranked = rank_profiles(profile_id, weights, limit)
+   if not ranked:
+      return Profile.objects.none()
+   # The features can be up to MATCHING['TTL'] seconds old, so profiles
+   # made anonymous since then are dropped here
+   return Profile.objects.filter(
+      pk__in=[match_id for match_id, _ in ranked], is_anonymous=False
+   ).annotate(
+      match_rank=Case(*[When(pk=match_id, then=Value(position))
+                        for position, (match_id, _) in enumerate(ranked)],
+                      output_field=IntegerField()),
+      match_score=Case(*[When(pk=match_id, then=Value(score))
+                         for match_id, score in ranked],
+                       output_field=FloatField()),
+   ).order_by('match_rank')
 
 
 # Tag viewset that performs CRUD operations
@@ -110,6 +290,8 @@ class TagViewSet(ModelViewSet):
    queryset = Tag.objects.all()
    serializer_class = TagSerializer
    permission_classes = [AllowAny]  # Allow public access
+   # Anonymous GETs are cached, see BaseApp/response_cache.py
+   anonymous_cache_models = TAG_MODELS
 
    def get_permissions(self):
       if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -269,23 +451,103 @@ class SearchHistoryViewSet(ModelViewSet):
    permission_classes = [AllowAny]
 
 
-# External media viewset that performs CRUD operations
+# External media viewset that performs CRUD operations. Anyone can read;
+# members can only add media to their own profile and change their own.
 class ExternalMediaViewSet(ModelViewSet):
    queryset = ExternalMedia.objects.all()
    serializer_class = ExternalMediaSerializer
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [AllowAny]
 
+   def get_permissions(self):
+      if self.action in ['create', 'update', 'partial_update', 'destroy']:
+         return [IsAuthenticated()]
+      return [AllowAny()]
+
+   def get_queryset(self):
+      user = self.request.user
+      if self.action in ['update', 'partial_update', 'destroy'] and \
+            not user.is_staff:
+         return self.queryset.filter(user=user)
+      return self.queryset
+
+   def perform_create(self, serializer):
+      if self.request.user.is_staff:
+         serializer.save()
+      else:
+         serializer.save(user=self.request.user)
+
+
+class ProfileMediaView(generics.ListCreateAPIView):
+   """
+   One profile's media, newest first. The owner (or an admin) can POST a
+   list of media to add them in one INSERT, and DELETE {"ids": [...]} to
+   remove several at once.
+   """
+   serializer_class = ProfileMediaSerializer
+   authentication_classes = [CachedJWTAuthentication]
+   pagination_class = ProfileMediaPagination
+
+   def get_permissions(self):
+      if self.request.method in ('GET', 'HEAD', 'OPTIONS'):
+         return [AllowAny()]
+      return [IsAuthenticated()]
+
+   def get_queryset(self):
+      return ExternalMedia.objects.filter(user_id=self.kwargs['pk'])
+
+   def check_owner(self):
+      user = self.request.user
+      if user.id != self.kwargs['pk'] and not user.is_staff:
+         raise PermissionDenied(
+            "You can only change your own media")
+
+   def list(self, request, *args, **kwargs):
+      if not Profile.objects.filter(pk=kwargs['pk']).exists():
+         return Response({'error': 'Profile not found'},
+                         status=status.HTTP_404_NOT_FOUND)
+      return super().list(request, *args, **kwargs)
+
+   def create(self, request, *args, **kwargs):
+      if not Profile.objects.filter(pk=kwargs['pk']).exists():
+         return Response({'error': 'Profile not found'},
+                         status=status.HTTP_404_NOT_FOUND)
+      self.check_owner()
+      items = request.data if isinstance(request.data, list) \
+         else [request.data]
+      if not items or len(items) > MAX_MEDIA_BATCH:
+         return Response(
+            {'error': f'Send between 1 and {MAX_MEDIA_BATCH} media'},
+            status=status.HTTP_400_BAD_REQUEST)
+      serializer = self.get_serializer(data=items, many=True)
+      serializer.is_valid(raise_exception=True)
+      serializer.save(user_id=kwargs['pk'])
+      return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+   def delete(self, request, *_args, **_kwargs):
+      self.check_owner()
+      ids = request.data.get('ids') if isinstance(request.data, dict) \
+         else None
+      if not isinstance(ids, list) or not ids or \
+            len(ids) > MAX_MEDIA_BATCH or \
+            not all(isinstance(i, int) for i in ids):
+         return Response(
+            {'error': f'"ids" must list 1 to {MAX_MEDIA_BATCH} media ids'},
+            status=status.HTTP_400_BAD_REQUEST)
+      # Media have no dependents, so this is a single DELETE
+      deleted, _ = self.get_queryset().filter(id__in=ids).delete()
+      return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
 
 # View for retrieving the currently logged in user
 class CurrentUserView(views.APIView):
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
 
    def get(self, request):
       # Fetch the user's profile in the same way as MatchmakingResultsView
-      user_profile = Profile.objects.filter(
-         user=request.user
-      ).select_related('user').prefetch_related('tags').first()
+      user_profile = ProfileSerializer.setup_queryset(
+         Profile.objects.filter(user=request.user)).first()
 
       if user_profile:
          serializer = ProfileSerializer(user_profile)
@@ -295,7 +557,7 @@ class CurrentUserView(views.APIView):
 
 class ProfileVoteView(generics.CreateAPIView, generics.UpdateAPIView):
    serializer_class = ProfileVoteSerializer
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
 
    def create(self, request, *args, **kwargs):
@@ -324,7 +586,7 @@ class ProfileVoteView(generics.CreateAPIView, generics.UpdateAPIView):
 
 class ProfileCommentView(generics.CreateAPIView, generics.UpdateAPIView):
    serializer_class = ProfileCommentSerializer
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
    queryset = ProfileComment.objects.all()
 
@@ -377,7 +639,7 @@ class ProfileCommentView(generics.CreateAPIView, generics.UpdateAPIView):
       return response.Response(serializer.data)
 
 class ProfileVoteStatusView(views.APIView):
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
 
    def get(self, request, profile_id):
@@ -394,25 +656,79 @@ class ProfileVoteStatusView(views.APIView):
 
 class NotificationView(ModelViewSet):
    serializer_class = NotificationSerializer
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
+   pagination_class = NotificationPagination
 
    def get_queryset(self):
       # Only return notifications for the current user
-      return Notification.objects.filter(recipient=self.request.user)
+      return Notification.objects.filter(
+         recipient=self.request.user).select_related('recipient')
 
    def perform_create(self, serializer):
       # Set the recipient as the current user when creating a notification
       serializer.save(recipient=self.request.user)
 
+   @action(detail=False, methods=['get'], url_path='unread-count',
+   url_name='unread_count')
+   def unread_count(self, request):
+      # Answered from the (recipient, is_read, created_at) index
+      count = Notification.objects.filter(
+         recipient=request.user, is_read=False).count()
+      return Response({'unread_count': count})
+
+   @action(detail=False, methods=['post'], url_path='mark-read',
+   url_name='mark_read')
+   def mark_read(self, request):
+      up_to_id = request.data.get('up_to_id')
+      up_to = request.data.get('up_to')
+      if up_to_id is None and up_to is None:
+         return Response(
+            {'error': 'Either up_to_id or up_to is required'},
+            status=status.HTTP_400_BAD_REQUEST
+         )
+
+      queryset = Notification.objects.filter(
+         recipient=request.user, is_read=False)
+      try:
+         if up_to_id is not None:
+            queryset = queryset.filter(id__lte=int(up_to_id))
+         if up_to is not None:
+            up_to_time = parse_datetime(str(up_to))
+            if up_to_time is None:
+               raise ValueError(up_to)
+            queryset = queryset.filter(created_at__lte=up_to_time)
+      except (TypeError, ValueError):
+         return Response(
+            {'error': 'Invalid up_to_id or up_to value'},
+            status=status.HTTP_400_BAD_REQUEST
+         )
+
+      # A single UPDATE regardless of how many notifications are affected
+      updated = queryset.update(is_read=True)
+      return Response({'updated': updated}, status=status.HTTP_200_OK)
+
 
 class FriendshipViewSet(ModelViewSet):
    serializer_class = FriendshipSerializer
-   authentication_classes = [JWTAuthentication]
+   authentication_classes = [CachedJWTAuthentication]
    permission_classes = [IsAuthenticated]
+   pagination_class = FriendshipPagination
 
-   # Define the queryset
-   queryset = Friendship.objects.all()
+   def get_queryset(self):
+      # Only friendships the current user takes part in
+      user = self.request.user
+      queryset = Friendship.objects.select_related('sender', 'receiver')
+      direction = self.request.query_params.get('direction')
+
+      if direction == 'incoming':
+         return queryset.filter(receiver=user, status='pending')
+      if direction == 'outgoing':
+         return queryset.filter(sender=user, status='pending')
+      if direction == 'accepted':
+         return queryset.filter(
+            Q(sender=user) | Q(receiver=user), status='accepted')
+      return queryset.filter(Q(sender=user) | Q(receiver=user))
 
    def perform_create(self, serializer):
       # Check if the user is authenticated
@@ -422,13 +738,13 @@ class FriendshipViewSet(ModelViewSet):
       # Set the sender as the current user
       serializer.save(sender=self.request.user)
 
-      # Create a notification for the receiver
-      Notification.objects.create(
-         recipient=serializer.validated_data['receiver'],
-         notification_type='friend_request',
-         message=f"{self.request.user.username} sent you a friend request",
-         related_object_id=serializer.instance.id
-      )
+      # The receiver's notification is created by a task
+      queue_friend_request_notification(serializer.instance,
+                                        self.request.user)
+
+   def perform_destroy(self, instance):
+      instance.delete()
+      record_friendship(instance, removed=True)
 
    @action(detail=True, methods=['post'])
    def respond(self, request, pk=None):  # pylint: disable=unused-argument
@@ -451,6 +767,7 @@ class FriendshipViewSet(ModelViewSet):
             )
 
          friendship.save()
+         record_friendship(friendship)
          return Response({
             "message": f"Friend request {response_action}ed successfully"
          }, status=status.HTTP_200_OK)
@@ -473,10 +790,7 @@ class FriendshipViewSet(ModelViewSet):
                             status=status.HTTP_400_BAD_REQUEST)
 
          # Get the friendship between the current user and the specified profile
-         friendship = Friendship.objects.filter(
-             Q(sender=request.user, receiver_id=profile_id) |
-             Q(sender_id=profile_id, receiver=request.user)
-         ).first()
+         friendship = Friendship.between(request.user.id, profile_id).first()
 
          print(f"Found friendship: {friendship}")  # Debug log
 
@@ -484,7 +798,7 @@ class FriendshipViewSet(ModelViewSet):
             response_data = {
                 'status': friendship.status,
                 'friendship_id': friendship.id,
-                'is_sender': friendship.sender == request.user
+                'is_sender': friendship.sender_id == request.user.id
             }
             print(f"Returning response: {response_data}")  # Debug log
             return Response(response_data)
@@ -495,260 +809,52 @@ class FriendshipViewSet(ModelViewSet):
          return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-# Admin API views
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def check_superuser(request):
-   """Check if the current user is a superuser"""
-   is_superuser = request.user.is_superuser
-   return Response({'is_superuser': is_superuser})
-
-
-class AdminProfileListView(generics.ListAPIView):
-   """List all profiles for admin purposes"""
-   serializer_class = AdminProfileSerializer
-   authentication_classes = [JWTAuthentication]
-   permission_classes = [IsAuthenticated, IsAdminUser]
-   # Add pagination
-   pagination_class = AdminPagination
-
-   def get_queryset(self):
-      return Profile.objects.select_related('user').prefetch_related(
-         'tags').order_by('user__username').all()
-
-
-class AdminProfileDeleteView(generics.DestroyAPIView):
-   """Delete a profile and all related data"""
-   authentication_classes = [JWTAuthentication]
-   permission_classes = [IsAuthenticated, IsAdminUser]
-
-   def destroy(self, request, *args, **kwargs):
-      try:
-          # Get the user ID from the URL
-         user_id = kwargs.get('pk')
-
-         # Get the user
-         user = User.objects.get(id=user_id)
-
-         # Delete the user (this will cascade delete profile and other related
-         # objects)
-         user.delete()
-
-         return Response(status=status.HTTP_204_NO_CONTENT)
-      except ObjectDoesNotExist:
-         return Response(
-             {'error': 'User not found'},
-             status=status.HTTP_404_NOT_FOUND
-         )
-      except (ValidationError, PermissionDenied) as e:
-         return Response(
-             {'error': str(e)},
-             status=status.HTTP_400_BAD_REQUEST
-         )
-      except DatabaseError as e:
+   @action(detail=False, methods=['get'])
+   def mutual(self, request):
+      # Mutual friend counts between the current user and many profiles
+      raw_ids = request.query_params.get('ids', '')
+      profile_ids = [int(i) for i in raw_ids.split(',') if i.strip().isdigit()]
+      if not profile_ids:
+         return Response({'error': 'ids is required'},
+                         status=status.HTTP_400_BAD_REQUEST)
+      if len(profile_ids) > MAX_MUTUAL_IDS:
          return Response(
-             {'error': f'Database error: {str(e)}'},
-             status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': f'At most {MAX_MUTUAL_IDS} ids are allowed'},
+            status=status.HTTP_400_BAD_REQUEST
          )
 
+      counts = get_friend_graph().mutual_counts(request.user.id, profile_ids)
+      return Response({str(k): v for k, v in counts.items()})
 
-class AdminCommentListView(generics.ListAPIView):
-   """List all comments for admin purposes"""
-   serializer_class = AdminProfileCommentSerializer
-   authentication_classes = [JWTAuthentication]
-   permission_classes = [IsAuthenticated, IsAdminUser]
-   # Add pagination
-   pagination_class = AdminPagination
-
-   def get_queryset(self):
-      return ProfileComment.objects.select_related(
-          'commenter', 'profile', 'profile__user'
-      ).order_by('-created_at').all()
-
-
-class AdminCommentDeleteView(generics.DestroyAPIView):
-   """Delete a specific comment"""
-   authentication_classes = [JWTAuthentication]
-   permission_classes = [IsAuthenticated, IsAdminUser]
-   queryset = ProfileComment.objects.all()
-
-   def destroy(self, request, *args, **kwargs):
+   @action(detail=False, methods=['get'])
+   def suggestions(self, request):
+      # "People you may know": friends of friends ranked by mutual count
       try:
-         comment = self.get_object()
-         comment.delete()
-         return Response(status=status.HTTP_204_NO_CONTENT)
-      except ObjectDoesNotExist:
-         return Response(
-             {'error': 'Comment not found'},
-             status=status.HTTP_404_NOT_FOUND
-         )
-      except (ValidationError, PermissionDenied) as e:
-         return Response(
-             {'error': str(e)},
-             status=status.HTTP_400_BAD_REQUEST
-         )
-      except DatabaseError as e:
-         return Response(
-             {'error': f'Database error: {str(e)}'},
-             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-         )
-
-class ProfileFilter(FilterSet):
-   tags = CharFilter(method='filter_tags')
-
-   def filter_tags(self, queryset, value):
-      if not value:
-         return queryset
-      tag_ids = [int(id) for id in value.split(',') if id.strip().isdigit()]
-      return queryset.filter(tags__id__in=tag_ids)
-
-   class Meta:
-      model = Profile
-      fields = ['user_type', 'city', 'state', 'country']
-
-class ProfileSearchView(generics.ListAPIView):
-   serializer_class = SearchProfileSerializer
-   permission_classes = [AllowAny]
-   filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-   filterset_class = ProfileFilter
-   search_fields = [
-      'user_type', 'city', 'state', 'country', 'tags__tag_name',
-      'first_name', 'last_name', 'description'
-   ]
-
-   def get_queryset(self):
-      logger.info("Starting search with params: %s",
-                  self.request.query_params)
-
-      # Log all query parameters
-      for key, value in self.request.query_params.items():
-         logger.info("Query param - %s: %s", key, value)
-
-      # Build queryset with detailed logging
-      logger.info("Building base queryset...")
-      queryset = Profile.objects.select_related('user').prefetch_related(
-         'tags'
-      )
-      logger.info("Base queryset count: %s", queryset.count())
-
-      # Apply anonymous filter
-      logger.info("Applying anonymous filter...")
-      queryset = queryset.exclude(is_anonymous=True)
-      logger.info("After anonymous filter count: %s", queryset.count())
-
-      # Log search parameters if present
-      search_term = self.request.query_params.get('search', None)
-      if search_term:
-         logger.info("Search term: %s", search_term)
-
-      # Log filter parameters
-      for field in self.filterset_class.Meta.fields + ['tags']:
-         value = self.request.query_params.get(field)
-         if value:
-            logger.info("Filter %s: %s", field, value)
-
-      # Log final queryset SQL
-      logger.info("Final queryset SQL: %s", str(queryset.query))
-
-      return queryset
-
-   def get_serializer_context(self):
-      context = super().get_serializer_context()
-      context['request'] = self.request
-      if self.request.user.is_authenticated:
-         try:
-            profile = Profile.objects.get(user=self.request.user)
-            context['profile_id'] = profile.user.id
-            logger.info(
-               "Added profile_id %s to context for user %s",
-               profile.user.id, self.request.user.id)
-         except ObjectDoesNotExist:
-            logger.warning("Profile not found for user %s",
-               self.request.user.id)
-      return context
-
-   def list(self, request, *args, **kwargs):
-      logger.info("Starting search request from IP: %s",
-         request.META.get('REMOTE_ADDR'))
-      logger.info("Request headers: %s", request.headers)
-
-      # Get the queryset
-      queryset = self.get_queryset()
-      logger.info("Queryset count before filtering: %s", queryset.count())
-
-      # Apply filters
-      queryset = self.filter_queryset(queryset)
-      logger.info("Queryset count after filtering: %s", queryset.count())
-
-      # Paginate
-      page = self.paginate_queryset(queryset)
-      if page is not None:
-         logger.info("Paginated results count: %s", len(page))
-         serializer = self.get_serializer(page, many=True)
-         return self.get_paginated_response(serializer.data)
-
-      # Serialize
-      serializer = self.get_serializer(queryset, many=True)
-      logger.info("Serialized results count: %s", len(serializer.data))
-
-      return Response(serializer.data)
-
-class DedicatedSearchView(generics.ListAPIView):
-   serializer_class = SearchProfileSerializer
-   authentication_classes = [JWTAuthentication]
-   permission_classes = [IsAuthenticated]
-   pagination_class = PageNumberPagination
-
-   def get_queryset(self):
-      """Get the queryset for the dedicated search view"""
-      queryset = Profile.objects.select_related(
-         'user').prefetch_related('tags').all()
-
-      # Always filter out anonymous profiles
-      queryset = queryset.filter(is_anonymous=False)
-
-      # Get search parameters
-      search_query = self.request.query_params.get('q', '')
-      user_type = self.request.query_params.get('user_type', '')
-      location = self.request.query_params.get('location', '')
-      city = self.request.query_params.get('city', '')
-      tags = self.request.query_params.getlist('tags', [])
-
-      # Apply filters
-      if search_query:
-         queryset = apply_filters(search_query, queryset)
-
-      if user_type:
-         queryset = queryset.filter(user_type=user_type)
-
-      if location:
-         queryset = queryset.filter(
-         Q(city__icontains=location) |
-         Q(state__icontains=location) |
-         Q(country__icontains=location)
+         limit = max(1, min(int(request.query_params.get('limit', 10)), 50))
+      except ValueError:
+         limit = 10
+
+      # Anonymous profiles aren't suggested, so read the ranking in chunks
+      # until enough of the others are found
+      ranked = iter(get_friend_graph().suggestions(request.user.id))
+      results = []
+      while len(results) < limit:
+         chunk = list(islice(ranked, 2 * limit))
+         if not chunk:
+            break
+         profiles = Profile.objects.filter(
+            user_id__in=[user_id for user_id, _ in chunk],
+            is_anonymous=False
+         ).select_related('user').in_bulk()
+         results.extend(
+            {
+               'user_id': user_id,
+               'username': profiles[user_id].user.username,
+               'first_name': profiles[user_id].first_name,
+               'last_name': profiles[user_id].last_name,
+               'mutual_count': mutual_count,
+            }
+            for user_id, mutual_count in chunk if user_id in profiles
          )
 
-      if city:
-         queryset = queryset.filter(city__icontains=city)
-
-      if tags:
-         tag_objects = Tag.objects.filter(tag_name__in=tags)
-         if tag_objects.exists():
-            for tag in tag_objects:
-               queryset = queryset.filter(tags=tag)
-            queryset = queryset.distinct()
-
-      return queryset
-
-def apply_filters(search_query, queryset):
-   search_terms = search_query.split()
-   name_filters = []
-   for term in search_terms:
-      name_filters.append(
-         Q(first_name__icontains=term) |
-         Q(last_name__icontains=term)
-      )
-   if name_filters:
-      queryset = queryset.filter(reduce(operator.and_, name_filters))
-
-   return queryset
+      return Response(results[:limit])
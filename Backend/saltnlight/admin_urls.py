@@ -0,0 +1,6 @@
+"""Admin URLs, loaded lazily by saltnlight/urls.py"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
@@ -2,6 +2,9 @@
 ASGI config for saltnlight project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The async views under /api/async/ run natively on its event loop, e.g.
+
+    uvicorn saltnlight.asgi:application --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -14,3 +17,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saltnlight.settings')
 
 application = get_asgi_application()
+
+# Do the URL and serializer setup now rather than in the first request
+# pylint: disable=wrong-import-position
+from BaseApp.startup import warm_up  # noqa: E402
+warm_up()
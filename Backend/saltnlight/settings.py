@@ -30,8 +30,14 @@ DEBUG = False
 ALLOWED_HOSTS = []
 
 # Application definition
+# Serverless API-only mode: no admin, sessions, messages, static files,
+# browsable API or middleware that only browsers need
+API_ONLY = os.environ.get('DJANGO_API_ONLY') == 'true'
+
 INSTALLED_APPS = [
-   'django.contrib.admin',
+   # Admin modules are only registered on the first /admin/ request, see
+   # saltnlight/admin_urls.py
+   'django.contrib.admin.apps.SimpleAdminConfig',
    'django.contrib.auth',
    'django.contrib.contenttypes',
    'django.contrib.sessions',
@@ -45,16 +51,39 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+   'BaseApp.metrics.RequestMetricsMiddleware',
    'django.middleware.security.SecurityMiddleware',
    'django.contrib.sessions.middleware.SessionMiddleware',
    'corsheaders.middleware.CorsMiddleware',
    'django.middleware.common.CommonMiddleware',
    'django.middleware.csrf.CsrfViewMiddleware',
    'django.contrib.auth.middleware.AuthenticationMiddleware',
+   # After AuthenticationMiddleware, to pin session users as well
+   'BaseApp.routers.ReplicaRoutingMiddleware',
    'django.contrib.messages.middleware.MessageMiddleware',
    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+   # Last, so the middleware above also sees the responses it caches
+   'BaseApp.response_cache.AnonymousResponseCacheMiddleware',
 ]
 
+if API_ONLY:
+   INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+      'django.contrib.admin.apps.SimpleAdminConfig',
+      'django.contrib.sessions',
+      'django.contrib.messages',
+      'django.contrib.staticfiles',
+   )]
+   # API clients authenticate with JWTs, so sessions, CSRF and framing
+   # protection don't apply
+   MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+                 if middleware not in (
+      'django.contrib.sessions.middleware.SessionMiddleware',
+      'django.middleware.csrf.CsrfViewMiddleware',
+      'django.contrib.auth.middleware.AuthenticationMiddleware',
+      'django.contrib.messages.middleware.MessageMiddleware',
+      'django.middleware.clickjacking.XFrameOptionsMiddleware',
+   )]
+
 # Authentication backends
 AUTHENTICATION_BACKENDS = [
    'django.contrib.auth.backends.ModelBackend',
@@ -88,8 +117,86 @@ SESSION_SAVE_EVERY_REQUEST = True
 # Session Authentication Configurations
 REST_FRAMEWORK = {
    'DEFAULT_AUTHENTICATION_CLASSES': (
-      'rest_framework_simplejwt.authentication.JWTAuthentication',
+      'BaseApp.authentication.CachedJWTAuthentication',
+   ),
+   'DEFAULT_THROTTLE_CLASSES': (
+      'BaseApp.throttling.TokenBucketThrottle',
    ),
+   # Proxies in front of the app that append to X-Forwarded-For. The
+   # anonymous throttle keys on the client address the outermost of them
+   # recorded, or on REMOTE_ADDR with 0, so a forged header can't pick a
+   # fresh bucket
+   'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
+}
+if API_ONLY:
+   REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+      'rest_framework.renderers.JSONRenderer',
+   )
+
+SIMPLE_JWT = {
+   'TOKEN_OBTAIN_SERIALIZER':
+      'BaseApp.authentication.ProfileTokenObtainPairSerializer',
+}
+
+# Per-process cache of authenticated users, see BaseApp/authentication.py
+TOKEN_USER_CACHE = {
+   'TTL': 60,
+   'MAX_SIZE': 10000,
+   'TRUST_CLAIMS': os.environ.get('TOKEN_TRUST_CLAIMS') == 'true',
+}
+
+# Files the workers on a node share - the cache, the throttle's buckets and
+# the response cache's generations - are named with this prefix. Without
+# one it's made from the project directory, in /dev/shm when there is one,
+# see BaseApp/caching.py
+SHARED_MEMORY_PREFIX = os.environ.get('SHARED_MEMORY_PREFIX')
+# The tests use a temporary one, see BaseApp/tests/runner.py
+TEST_RUNNER = 'BaseApp.tests.runner.SharedFilesRunner'
+
+# Two-tier cache shared by the workers on a node, see
+# BaseApp/cache_backend.py
+CACHES = {
+   'default': {
+      'BACKEND': 'BaseApp.cache_backend.TieredCache',
+      # A SQLite file named with SHARED_MEMORY_PREFIX by default
+      'LOCATION': os.environ.get('CACHE_PATH', ''),
+      'TIMEOUT': 300,
+      'OPTIONS': {
+         'MAX_ENTRIES': 100000,
+         'L1_MAX_ENTRIES': 10000,
+         'L1_TIMEOUT': 60,
+      },
+   },
+}
+if os.environ.get('REDIS_URL'):
+   # Redis instead of the SQLite file, shared across nodes
+   CACHES['shared'] = {
+      'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+      'LOCATION': os.environ['REDIS_URL'],
+   }
+   CACHES['default']['OPTIONS']['L2_CACHE'] = 'shared'
+
+# Seconds each process keeps its in-memory friendship graph at most; it is
+# rebuilt sooner once another worker changes a friendship, see
+# BaseApp/friend_graph.py
+FRIEND_GRAPH_TTL = 300
+
+# Token buckets shared by the workers on a node, see BaseApp/throttling.py
+THROTTLE = {
+   'ENABLED': os.environ.get('THROTTLE_ENABLED', 'true') == 'true',
+   # Per user, or per IP for anonymous requests; endpoints spend tokens by
+   # their cost in THROTTLE['COSTS']
+   'RATES': {'user': '600/min', 'anon': '120/min'},
+}
+
+# Request timing and /metrics, see BaseApp/metrics.py
+REQUEST_METRICS = {
+   'SLOW_REQUEST_MS': 500,
+   'SLOW_LOG_SAMPLE_RATE': 0.1,
+   'SLOW_LOG_QUERIES': 5,
+   # Scrapers send "Authorization: Bearer <token>"; without a token set,
+   # only staff sessions and JWTs may read /metrics
+   'TOKEN': os.environ.get('METRICS_TOKEN'),
 }
 
 ALLOWED_HOSTS = [
@@ -138,15 +245,42 @@ WSGI_APPLICATION = 'saltnlight.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+def ssl_required(url):
+   # SQLite files, e.g. local stand-ins for the primary and a replica,
+   # have no SSL
+   return not (url or '').startswith('sqlite')
+
+
 DATABASES = {
    'default': dj_database_url.config(default=os.getenv("DATABASE_URL"),
-                                     conn_max_age=600, ssl_require=True)
+                                     conn_max_age=600,
+                                     ssl_require=ssl_required(
+                                        os.getenv("DATABASE_URL")))
     #    'default': {
     #        'ENGINE': 'django.db.backends.sqlite3',
     #        'NAME': BASE_DIR / 'db.sqlite3',
     #    }
 }
 
+# Comma-separated read replica URLs; GET requests read from them, see
+# BaseApp/routers.py
+REPLICA_URLS = [url.strip() for url in
+                os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+                if url.strip()]
+READ_REPLICAS = [f'replica_{index}' for index in range(len(REPLICA_URLS))]
+for alias, replica_url in zip(READ_REPLICAS, REPLICA_URLS):
+   DATABASES[alias] = {
+      **dj_database_url.parse(replica_url, conn_max_age=600,
+                              ssl_require=ssl_required(replica_url)),
+      # Tests read the primary's test database through the replica alias
+      'TEST': {'MIRROR': 'default'},
+   }
+
+DATABASE_ROUTERS = ['BaseApp.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write
+REPLICA_PIN_SECONDS = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -186,3 +320,79 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Retention rules applied by `manage.py prune_history`
+RETENTION_POLICIES = {
+   'notifications': {'max_age_days': 90, 'read_only': True},
+   'search_history': {'keep_last': 50},
+   'tasks': {'max_age_days': 7},
+}
+
+# Background tasks, see BaseApp/task_queue.py
+TASK_QUEUE = {
+   # Set where `manage.py run_tasks` runs; until then requests run their
+   # tasks in-process once their transaction commits
+   'WORKER': os.environ.get('TASK_WORKER') == 'true',
+   'MAX_ATTEMPTS': 5,
+   'RETRY_DELAY': 10,
+   'LEASE_SECONDS': 300,
+}
+
+# Matchmaking ranking, see BaseApp/matching.py
+MATCHING = {
+   # Scorer weights; requests can override them with ?weights=tags:1,...
+   'WEIGHTS': {'tags': 0.5, 'location': 0.2, 'experience': 0.1,
+               'votes': 0.2},
+   # Seconds before a worker reloads profile features from the database
+   'TTL': 60,
+   'LIMIT': 50,
+   'MAX_LIMIT': 200,
+}
+
+# Geocoding and ?near= radius search, see BaseApp/geo.py
+GEO_SEARCH = {
+   'GAZETTEER': os.path.join(BASE_DIR, 'BaseApp', 'data', 'gazetteer.tsv'),
+   'DEFAULT_RADIUS_KM': 50,
+   'MAX_RADIUS_KM': 20000,
+   'MAX_RESULTS': 500,
+}
+
+# POST /api/batch/, see BaseApp/batch.py
+BATCH_REQUESTS = {
+   # Sub-requests per batch, so one call can't fan out without bound
+   'MAX_REQUESTS': 20,
+   'MAX_CONCURRENCY': 8,
+}
+
+# Pre-rendered public directory, see BaseApp/directory_snapshot.py; build
+# it with `manage.py build_directory_snapshot`
+DIRECTORY_SNAPSHOT = {
+   'ROOT': os.environ.get('DIRECTORY_SNAPSHOT_ROOT'),
+   'PAGE_SIZE': 500,
+   'KEEP_GENERATIONS': 2,
+   'REFRESH_DELAY': 5,
+}
+
+# Compressed responses to anonymous GETs of the public endpoints, see
+# BaseApp/response_cache.py
+RESPONSE_CACHE = {
+   'ENABLED': os.environ.get('RESPONSE_CACHE_ENABLED', 'true') == 'true',
+   'MAX_BYTES': 64 * 1024 * 1024,
+   'MAX_AGE': 300,
+}
+
+# Counts reported by the admin lists, see BaseApp/pagination.py
+ADMIN_COUNTS = {
+   # Larger results get a cached or estimated count instead of COUNT(*)
+   'EXACT_THRESHOLD': 10000,
+   'CACHE_SECONDS': 300,
+}
+
+# Rows per DELETE when the admin deletes a profile, see BaseApp/deletion.py.
+# Each row is a bound parameter; SQLite allows at most 999 per query
+PROFILE_DELETE_BATCH_SIZE = 900
+# Rows per DELETE for the admin bulk comment delete
+COMMENT_DELETE_BATCH_SIZE = 900
+
+# Row cap for uploads to the admin profile import endpoint
+PROFILE_IMPORT_MAX_ROWS = 5000
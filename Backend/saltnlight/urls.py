@@ -13,12 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
-from django.urls    import path, include
+from django.conf import settings
+from django.urls    import path, include, URLResolver
+from django.urls.resolvers import RoutePattern
 from rest_framework_simplejwt import views as jwt_views
+from BaseApp.metrics import metrics_view
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('BaseApp.urls')),
     path('api/token/',
          jwt_views.TokenObtainPairView.as_view(),
@@ -27,3 +29,10 @@ urlpatterns = [
          jwt_views.TokenRefreshView.as_view(),
          name ='token_refresh')
 ]
+
+if not settings.API_ONLY:
+   # Naming the URLconf by string defers importing it, and with it the
+   # admin registrations, until a request under admin/ or a reverse()
+   urlpatterns.insert(0, URLResolver(RoutePattern('admin/'),
+                                     'saltnlight.admin_urls',
+                                     app_name='admin', namespace='admin'))
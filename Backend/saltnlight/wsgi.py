@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'saltnlight.settings')
 
 application = get_wsgi_application()
+
+# Do the URL and serializer setup now rather than in the first request
+# pylint: disable=wrong-import-position
+from BaseApp.startup import warm_up  # noqa: E402
+warm_up()